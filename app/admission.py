@@ -0,0 +1,255 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'admission:'
+PROCESSES_KEY = METRICS_PREFIX + 'processes'
+
+# ==============================================================================
+# 1. LIMITADOR DE ANÁLISIS SIMULTÁNEOS
+# ==============================================================================
+
+class AnalysisBusy(Exception):
+    """ Sin hueco para analizar: la cola de espera está llena o se agotó la espera """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Como mucho `slots` análisis a la vez en el proceso y `queue_size` esperando.
+    Quien llega con la cola llena, o espera más de `timeout` segundos, recibe
+    AnalysisBusy al momento en lugar de acumularse hasta el timeout de gunicorn.
+    """
+
+    def __init__(self, slots: int, queue_size: int, timeout: float):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.counters = {'admitted': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+                         'cache_hits': 0, 'wait_seconds': 0.0}
+        self.condition = threading.Condition()
+        self.process_id = f'{socket.gethostname()}:{os.getpid()}'
+        # Las métricas las escribe un hilo propio: ni el bucle de eventos ni quien
+        # tiene self.condition esperan nunca a Redis
+        self._publish_requested = threading.Event()
+        self._publisher = None
+        self._publisher_lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        return max(1, int(self.timeout))
+
+    # --- Estado (siempre con self.condition tomado) ---
+
+    def _try_enter(self) -> bool:
+        if self.running < self.slots:
+            self.running += 1
+            self.counters['admitted'] += 1
+            return True
+        return False
+
+    def _join_queue(self):
+        if self.waiting >= self.queue_size:
+            self._reject('queue_full')
+        self.waiting += 1
+
+    def _reject(self, reason: str):
+        self.counters['rejected_' + reason] += 1
+        logger.warning(f"Analysis rejected ({reason}): running={self.running} waiting={self.waiting}")
+        raise AnalysisBusy(reason, self.retry_after())
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+        self.publish()
+
+    # --- Síncrono: vistas síncronas e hilos ---
+
+    def acquire(self, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            with self.condition:
+                if not self._try_enter():
+                    self._join_queue()
+                    try:
+                        while not self._try_enter():
+                            remaining = start + timeout - time.monotonic()
+                            if remaining <= 0:
+                                self._reject('timeout')
+                            self.condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                self.counters['wait_seconds'] += time.monotonic() - start
+        finally:
+            self.publish()
+
+    @contextmanager
+    def admit(self, timeout: float = None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- Asíncrono: vistas async (la espera no ocupa ningún hilo) ---
+
+    async def acquire_async(self, timeout: float = None, poll: float = 0.05):
+        try:
+            await self._acquire_async(timeout, poll)
+        finally:
+            self.publish()
+
+    async def _acquire_async(self, timeout: float, poll: float):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self.condition:
+            if self._try_enter():
+                return
+            self._join_queue()
+        try:
+            while True:
+                await asyncio.sleep(poll)
+                with self.condition:
+                    if self._try_enter():
+                        self.counters['wait_seconds'] += time.monotonic() - start
+                        return
+                    if time.monotonic() - start >= timeout:
+                        self._reject('timeout')
+        finally:
+            with self.condition:
+                self.waiting -= 1
+
+    @asynccontextmanager
+    async def admit_async(self, timeout: float = None):
+        await self.acquire_async(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def cache_hit(self):
+        """ Resultado servido desde caché sin pasar por la cola """
+        with self.condition:
+            self.counters['cache_hits'] += 1
+        self.publish()
+
+    # --- Métricas: estado del proceso en la caché compartida ---
+
+    def snapshot(self) -> dict:
+        with self.condition:
+            return dict(self.counters, running=self.running, waiting=self.waiting,
+                        slots=self.slots, queue_size=self.queue_size, time=time.time())
+
+    def publish(self):
+        """
+        Pide publicar el estado del proceso. No espera a la caché: la escribe el
+        hilo publicador, como mucho una vez por segundo.
+        """
+        if self._publisher is None:
+            with self._publisher_lock:
+                if self._publisher is None:
+                    self._publisher = threading.Thread(target=self._publish_loop, name='admission-metrics',
+                                                       daemon=True)
+                    self._publisher.start()
+        self._publish_requested.set()
+
+    def _publish_loop(self):
+        while True:
+            self._publish_requested.wait()
+            self._publish_requested.clear()
+            try:
+                cache.set(METRICS_PREFIX + self.process_id, self.snapshot(), settings.ADMISSION_METRICS_TTL)
+                register_process(self.process_id)
+            except Exception as e:
+                logger.error(f"Could not publish admission metrics: {e}")
+            time.sleep(1)
+
+
+# ==============================================================================
+# 2. MÉTRICAS Y LIMITADOR DEL PROCESO
+# ==============================================================================
+
+def redis_client(write: bool = False):
+    """ Cliente de Redis de la caché por defecto, o None si no es Redis (locmem en las pruebas) """
+    get_client = getattr(getattr(cache, '_cache', None), 'get_client', None)
+    return get_client(write=write) if get_client else None
+
+
+def register_process(process_id: str):
+    """ Añade el proceso a la lista de los que publican métricas (un conjunto de Redis) """
+    client = redis_client(write=True)
+    if client is not None:
+        client.sadd(cache.make_key(PROCESSES_KEY), process_id)
+        return
+    # Sin Redis no hay varios procesos compartiendo la caché: basta con una lista
+    processes = cache.get(PROCESSES_KEY) or []
+    if process_id not in processes:
+        cache.set(PROCESSES_KEY, processes + [process_id], None)
+
+
+def registered_processes() -> list:
+    client = redis_client()
+    if client is not None:
+        return sorted(member.decode() for member in client.smembers(cache.make_key(PROCESSES_KEY)))
+    return cache.get(PROCESSES_KEY) or []
+
+
+def forget_processes(process_ids: list):
+    """ Quita de la lista los procesos cuyas métricas caducaron """
+    client = redis_client(write=True)
+    if client is not None:
+        client.srem(cache.make_key(PROCESSES_KEY), *process_ids)
+        return
+    processes = cache.get(PROCESSES_KEY) or []
+    cache.set(PROCESSES_KEY, [process for process in processes if process not in process_ids], None)
+
+
+def admission_metrics() -> dict:
+    """
+    Suma de los procesos vivos (los que publicaron hace menos de
+    ADMISSION_METRICS_TTL segundos) y el detalle por proceso.
+    """
+    processes = registered_processes()
+    snapshots = cache.get_many([METRICS_PREFIX + process for process in processes])
+    per_process = {key[len(METRICS_PREFIX):]: value for key, value in snapshots.items()}
+    gone = [process for process in processes if process not in per_process]
+    if gone:
+        forget_processes(gone)
+    totals = {}
+    for snapshot in per_process.values():
+        for field, value in snapshot.items():
+            if field != 'time':
+                totals[field] = totals.get(field, 0) + value
+    return {'totals': totals, 'processes': per_process}
+
+
+_admission = None
+_admission_pid = None
+_admission_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """ Limitador compartido por proceso (se crea de nuevo tras un fork) """
+    global _admission, _admission_pid
+    with _admission_lock:
+        if _admission is None or _admission_pid != os.getpid():
+            _admission = AdmissionController(settings.ANALYSIS_MAX_CONCURRENT, settings.ANALYSIS_QUEUE_SIZE,
+                                             settings.ANALYSIS_QUEUE_TIMEOUT)
+            _admission_pid = os.getpid()
+        return _admission
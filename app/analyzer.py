@@ -1,17 +1,21 @@
+import hashlib
 import json
 import os
 import shutil
 import traceback
-import uuid
 import logging
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen
 from urllib.parse import quote, urlparse, parse_qs
 from zipfile import BadZipfile, ZipFile
 
+from django.db import connection
 from django.http import HttpResponseRedirect
+from django.utils import translation
 from app.exception import DrScratchException
 
 # Imports de Hairball
@@ -21,8 +25,12 @@ from app.hairball3.mastery import Mastery
 from app.hairball3.spriteNaming import SpriteNaming
 from app.hairball3.scratchGolfing import ScratchGolfing
 from app.hairball3.block_sprite_usage import Block_Sprite_Usage
+from app.admission import get_admission
 from app.models import Coder, File, Organization
-from app.scratchclient import ScratchSession
+from app.project_store import load_stored_project, read_upload, store_project
+from app.results import load_parsed, load_result, project_result_key, rubric_code, save_parsed, save_result
+from app.scratchclient import ScratchSession, get_snap_client
+from app.stats import record_file_stats
 from app.recomender import RecomenderSystem
 import app.consts_drscratch as consts
 from lxml import etree
@@ -67,7 +75,6 @@ def translate(request, d, filename, vanilla=False):
 
     try:
         filename.language = lang if lang in translations else "en"
-        filename.save()
     except: pass
     
     return result
@@ -135,10 +142,8 @@ def set_file_obj(request, file_obj, dict_data, mode=None):
             
             if hasattr(file_obj, db_field):
                 setattr(file_obj, db_field, score)
-                
-        file_obj.save()
     except Exception as e:
-        logger.error(f"Error saving file object stats: {e}")
+        logger.error(f"Error setting file object stats: {e}")
 
 # ==============================================================================
 # 2. FUNCIONES DE BAD SMELLS (PROC_*)
@@ -153,7 +158,6 @@ def proc_duplicate_script(dict_result, file_obj) -> dict:
             "csv_format": dict_result['result']['list_csv']
         }
         file_obj.duplicateScript = dict_result['result']['total_duplicate_scripts']
-        file_obj.save()
     except Exception:
         dict_ds["duplicateScript"] = {"number": 0, "csv_format": []}
     return dict_ds
@@ -166,7 +170,6 @@ def proc_dead_code(dict_dead_code, filename):
             for sprite_name, list_blocks in dict_sprite_dead_code_blocks.items():
                 dict_dc["deadCode"][sprite_name] = list_blocks
         filename.deadCode = dict_dead_code['result']['total_dead_code_scripts']
-        filename.save()
     except Exception: pass
     return dict_dc
 
@@ -179,7 +182,6 @@ def proc_sprite_naming(lines, file_obj):
         lfinal = lObjects[:-1]
         dic['spriteNaming'] = {'number': int(number), 'sprite': lfinal}
         file_obj.spriteNaming = number
-        file_obj.save()
     except Exception: pass
     return dic
 
@@ -192,7 +194,6 @@ def proc_backdrop_naming(lines, file_obj):
         lfinal = lObjects[:-1]
         dic['backdropNaming'] = {'number': int(number), 'backdrop': lfinal}
         file_obj.backdropNaming = number
-        file_obj.save()
     except Exception: pass
     return dic
 
@@ -231,20 +232,35 @@ def proc_recomender(dict_recom):
 # 3. CORE DE ANÁLISIS (EL MOTOR)
 # ==============================================================================
 
-def analyze_project(request, info_project, skill_points: dict, filename_obj, file_obj):
+def analyze_project(request, info_project, skill_points: dict, filename_obj, file_obj, json_snap_project=None, save_file=True):
+    """
+    Los proc_* solo rellenan file_obj; la fila File se escribe una única vez al final
+    (o la guarda el llamador en bloque si save_file=False, como hace el modo batch).
+    """
     dict_analysis = {}
     dashboard = request.POST.get('dashboard_mode', 'Default')
     curr_type = request.POST.get('curr_type', '')
 
     try:
-        # 1. Cargar Proyecto
-        if info_project.get("projectname"):
-            scratch_project_inf = get_snap_project_xml(info_project['username'], info_project['projectname'])
-        else:
-            scratch_project_inf = load_json_project(filename_obj)
-        
-        # Parseo XML Seguro
-        json_snap_project = split_xml(request, scratch_project_inf)
+        # 1. Cargar Proyecto (el modo batch puede traerlo ya descargado y parseado)
+        if json_snap_project is None:
+            if info_project.get("xml") is not None:
+                scratch_project_inf = info_project['xml']
+            elif info_project.get("projectname"):
+                scratch_project_inf = get_snap_project_xml(info_project['username'], info_project['projectname'])
+            else:
+                scratch_project_inf = load_json_project(filename_obj)
+
+            if file_obj is not None:
+                file_obj.content_hash = project_content_hash(scratch_project_inf)
+            if info_project.get("projectname") and file_obj is not None:
+                # Los de URL también se guardan: get_analysis_d los necesita cuando caduca su parseo
+                store_project(str(scratch_project_inf).encode('utf-8'), file_obj.content_hash)
+
+            # Parseo XML Seguro (se cachea por contenido para get_analysis_d)
+            json_snap_project = split_xml(request, scratch_project_inf)
+            if file_obj is not None:
+                save_parsed(file_obj.content_hash, json_snap_project)
         path_projectsb3 = info_project.get("projectname", "upload")
 
         # 2. Análisis por módulos
@@ -317,10 +333,15 @@ def analyze_project(request, info_project, skill_points: dict, filename_obj, fil
             
     except Exception as e:
         logger.error(f"Critical error analyzing project: {e}")
-        return {'Error': 'critical_error'}
+        dict_analysis = {'Error': 'critical_error'}
     
     if 'Error' not in dict_analysis:
         dict_analysis['Error'] = 'None'
+    if file_obj is not None and file_obj.content_hash:
+        dict_analysis['content_hash'] = file_obj.content_hash
+
+    if save_file and file_obj:
+        save_file_obj(file_obj)
 
     return dict_analysis
 
@@ -329,30 +350,23 @@ def analyze_project(request, info_project, skill_points: dict, filename_obj, fil
 # ==============================================================================
 
 def analysis_by_upload(request, skill_points: dict, upload):
+    """
+    El proyecto se analiza desde memoria; solo su copia para get_analysis_d va al
+    almacén direccionado por contenido.
+    """
     try:
         original_name = upload.name
         safe_name = original_name[:95] if len(original_name) > 95 else original_name
         zip_filename = safe_name.encode('utf-8', 'ignore')
         
         filename_obj = save_analysis_in_file_db(request, zip_filename)
-        
-        dir_zips = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads/")
-        if not os.path.exists(dir_zips):
-            os.makedirs(dir_zips)
 
-        project_name = str(uuid.uuid4()) 
-        unique_id = '{}_{}{}'.format(project_name, datetime.now().strftime("%Y_%m_%d_%H_%M_%S_"), datetime.now().microsecond)
-        file_saved = os.path.join(dir_zips, unique_id + ".sb2")
-        
-        info_project = {'platform': 'Snap', 'username': "", 'projectname': ''}
-        write_activity_in_logfile(filename_obj)
+        content = read_upload(upload)
+        store_project(content, project_content_hash(content))
 
-        request.session['current_project_path'] = file_saved
-        with open(file_saved, 'wb+') as destination:
-            for chunk in upload.chunks():
-                destination.write(chunk)
-                
-        dict_drscratch_analysis = analyze_project(request, info_project, skill_points, file_saved, filename_obj)
+        info_project = {'platform': 'Snap', 'username': "", 'projectname': '',
+                        'xml': content.decode('utf-8', errors='replace')}
+        dict_drscratch_analysis = analyze_project(request, info_project, skill_points, None, filename_obj)
 
         if not dict_drscratch_analysis:
              dict_drscratch_analysis = {'Error': 'empty_result'}
@@ -373,12 +387,14 @@ def analysis_by_upload(request, skill_points: dict, upload):
             'dashboard_mode': request.POST.get('dashboard_mode')
         }
 
-def analysis_by_url(request, url, skill_points: dict):
+def analysis_by_url(request, url, skill_points: dict, project_xml=None):
     try:
         info_project = return_scratch_project_identifier(url)
         if info_project['platform'] == "error":
             return {'Error': 'id_error'}
         else:
+            if project_xml is not None:
+                info_project['xml'] = project_xml
             dic = generator_dic(request, info_project, skill_points)
             dic.update({
                 'url': url,
@@ -390,6 +406,39 @@ def analysis_by_url(request, url, skill_points: dict):
     except Exception:
         return {'Error': 'analyzing'}
 
+def analysis_by_parsed_project(request, skill_points: dict, json_snap_project: dict, filename: str, url=None, file_buffer=None, content_hash=None) -> dict:
+    """
+    Analiza un proyecto ya descargado y parseado (etapa de análisis del modo batch).
+    Con file_buffer la fila File se acumula para guardarla en bloque con otras.
+    content_hash es el SHA-256 del contenido original, ya calculado al descargarlo.
+    """
+    try:
+        if url:
+            info_project = return_scratch_project_identifier(url)
+            file_obj = send_request_getsb3(info_project['projectname'], None, method="url")
+        else:
+            info_project = {'platform': 'Snap', 'username': "", 'projectname': ''}
+            file_obj = save_analysis_in_file_db(request, filename)
+        file_obj.content_hash = content_hash
+
+        dic = analyze_project(
+            request, info_project, skill_points, None, file_obj, json_snap_project,
+            save_file=file_buffer is None
+        )
+        if file_buffer is not None:
+            file_buffer.add(file_obj)
+    except Exception:
+        traceback.print_exc()
+        dic = {'Error': 'analyzing'}
+
+    dic.update({
+        'url': url,
+        'filename': filename,
+        'dashboard_mode': request.POST.get('dashboard_mode', 'Default'),
+        'multiproject': False
+    })
+    return dic
+
 def generator_dic(request, info_project, skill_points: dict) -> dict:
     try:
         username = None
@@ -407,32 +456,88 @@ def generator_dic(request, info_project, skill_points: dict) -> dict:
 
     return d
 
+def compare_sources(request) -> list:
+    """
+    (proyecto, contenido, nombre, url) de los dos proyectos de la comparación. Las
+    URLs se descargan a la vez; si algo falla el contenido es un dict de error.
+    """
+    sources = []
+    if "_urls" in request.POST:
+        urls = request.POST.getlist('urlProject')[:2]
+        infos = [return_scratch_project_identifier(url) for url in urls]
+        valid = [i for i, info in enumerate(infos) if info['platform'] != 'error']
+        contents = {i: {'Error': 'id_error'} for i in range(len(urls)) if i not in valid}
+        fetched = get_snap_client().fetch_many([infos[i] for i in valid], max_workers=2)
+        for index, xml, error in fetched:
+            contents[valid[index]] = xml if error is None else {'Error': 'no_exists'}
+        for counter, url in enumerate(urls):
+            sources.append((check_project(counter), contents[counter], url, url))
+    elif "_uploads" in request.POST:
+        for counter, upload in enumerate(request.FILES.getlist('zipFile')[:2]):
+            content = read_upload(upload)
+            sources.append((check_project(counter), content.decode('utf-8', errors='replace'), upload.name, None))
+    return sources
+
+def cached_project_analysis(request, skill_points: dict, content, filename: str, url=None,
+                            admission_timeout: float = None) -> tuple:
+    """
+    Análisis de un proyecto a partir de su contenido. Devuelve (resultado, proyecto
+    parseado) desde las cachés por contenido si ya se analizó (p. ej. el mismo
+    "Original" frente a varias versiones "New", o los refrescos de get_analysis_d).
+    Las vistas síncronas pasan admission_timeout=0: no esperan turno en el hilo
+    que comparten con el resto de peticiones del worker.
+    """
+    if isinstance(content, dict):
+        return dict(content, url=url, filename=filename, dashboard_mode=request.POST.get('dashboard_mode')), {}
+
+    content_hash = project_content_hash(content)
+    mode = request.POST.get('dashboard_mode') or 'Default'
+    key = project_result_key(content_hash, rubric_code(skill_points), mode, request.LANGUAGE_CODE)
+    result = load_result(key)
+    json_snap_project = load_parsed(content_hash)
+    admission = get_admission()
+    if result is not None:
+        admission.cache_hit()
+    if result is not None and json_snap_project is not None:
+        return dict(result, url=url, filename=filename), json_snap_project
+
+    try:
+        with translation.override(request.LANGUAGE_CODE):
+            if json_snap_project is None:
+                json_snap_project = split_xml(request, content)
+                save_parsed(content_hash, json_snap_project)
+            if result is None:
+                # Solo el análisis pasa por el control de admisión (AnalysisBusy si no hay hueco)
+                with admission.admit(admission_timeout):
+                    result = analysis_by_parsed_project(request, skill_points, json_snap_project, filename, url,
+                                                        content_hash=content_hash)
+                if result.get('Error') in (None, 'None'):
+                    save_result(result, key)
+    finally:
+        # Puede ejecutarse en un hilo propio: no debe dejar su conexión abierta
+        connection.close()
+    return dict(result, url=url, filename=filename), json_snap_project
+
 def _make_compare(request, skill_points: dict):
-    counter = 0
-    d = {}
-    path = {}
-    json_projects = {}
-    
+    """
+    Los dos proyectos se descargan y analizan a la vez; ScratchGolfing recibe
+    directamente sus versiones ya parseadas.
+    """
     if request.method != "POST":
         return HttpResponseRedirect('/')
 
-    if "_urls" in request.POST:
-        for url in request.POST.getlist('urlProject'):
-            project = check_project(counter)
-            d[project] = analysis_by_url(request, url, skill_points)
-            path[project] = request.session.get('current_project_path')
-            counter += 1
-    elif "_uploads" in request.POST:
-        for upload in request.FILES.getlist('zipFile'):
-            project = check_project(counter)
-            d[project] = analysis_by_upload(request, skill_points, upload)
-            path[project] = request.session.get('current_project_path')
-            counter += 1
-
-    for key, value in path.items():
-        json_projects[key] = load_json_project(value)    
-    
-    dict_scratch_golfing = ScratchGolfing(json_projects.get('Original'), json_projects.get('New')).finalize()
+    d = {}
+    json_projects = {}
+    sources = compare_sources(request)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            project: executor.submit(cached_project_analysis, request, skill_points, content, filename, url)
+            for project, content, filename, url in sources
+        }
+        for project, future in futures.items():
+            d[project], json_projects[project] = future.result()
+
+    dict_scratch_golfing = ScratchGolfing(json_projects.get('Original') or {}, json_projects.get('New') or {}).finalize()
     d['Compare'] = dict_scratch_golfing['result']['scratch_golfing']
     check_same_functionality(request, d)
 
@@ -442,39 +547,31 @@ def _make_compare(request, skill_points: dict):
 # 5. FUNCIONES DE SOPORTE Y PARSEO XML (CORE)
 # ==============================================================================
 
+def project_content_hash(content) -> str:
+    """ SHA-256 del contenido original del proyecto (el mismo que usa el modo batch) """
+    if content is None:
+        return None
+    data = content if isinstance(content, bytes) else str(content).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
 def load_json_project(path_projectsb3):
-    try:
-       with open(path_projectsb3, "r", encoding="utf-8") as archivo_xml:
-        return archivo_xml.read()
-    except Exception: return ""
+    return load_stored_project(path_projectsb3)
 
 def get_snap_project_xml(username, projectname):
-    # --- CORRECCIÓN CRUCIAL PARA URLS ---
-    safe_user = quote(username)
-    safe_proj = quote(projectname)
-    url = f"https://snap.berkeley.edu/api/v1/projects/{safe_user}/{safe_proj}"
-    try:
-        # Añadido HEADER para evitar bloqueo de Snap
-        headers = {'User-Agent': 'DrSnap-Analyzer/1.0', 'Accept': 'application/json'}
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        try:
-            data = response.json()
-            if 'xml' in data: return data['xml']
-            if 'code' in data: return data['code']
-            return response.text
-        except json.JSONDecodeError: return response.text
-    except Exception:
-        raise DrScratchException(f"Could not download project.")
+    # Cliente compartido: reutiliza conexiones y reintenta fallos transitorios
+    return get_snap_client().get_project_xml(username, projectname)
 
 def send_request_getsb3(id_project, username, method):
+    """
+    Prepara (sin guardar) la fila File de un análisis por URL; se guarda al terminar el análisis.
+    """
     file_url = f'{id_project}.sb3'[:95]
     now = datetime.now()
     
     # Determinar propietario
-    if Organization.objects.filter(username=username).exists():
+    if username and Organization.objects.filter(username=username).exists():
         file_obj = File(filename=file_url, organization=username, method=method, time=now)
-    elif Coder.objects.filter(username=username).exists():
+    elif username and Coder.objects.filter(username=username).exists():
         file_obj = File(filename=file_url, coder=username, method=method, time=now)
     else:
         file_obj = File(filename=file_url, method=method, time=now)
@@ -488,9 +585,6 @@ def send_request_getsb3(id_project, username, method):
     
     for attr in attributes:
         setattr(file_obj, attr, 0)
-    
-    file_obj.save()
-    write_activity_in_logfile(file_obj)
     return file_obj
 
 def parse_snap_script(script_node, scene_name, dict_datos, id_counter):
@@ -623,14 +717,65 @@ def return_scratch_project_identifier(url) -> dict:
     else:
         return {'platform': 'error', 'message': 'Missing username/projectname'}
 
-def write_activity_in_logfile(file_name):
+def write_activity_in_logfile(*file_names):
     try:
         log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'log', 'logFile.txt')
         with open(log_path, "a+") as log_file:
-            log_file.write(f"ID: {file_name.id}\n")
+            for file_name in file_names:
+                # bulk_create no rellena la clave en MySQL: entonces se anota nombre y hash
+                if file_name.id is not None:
+                    log_file.write(f"ID: {file_name.id}\n")
+                else:
+                    log_file.write(f"File: {file_name.filename} ({file_name.content_hash or 'no hash'})\n")
     except Exception: pass
 
+def save_file_obj(file_obj):
+    """ Única escritura de la fila File de un análisis """
+    try:
+        file_obj.save()
+        record_file_stats([file_obj])
+        write_activity_in_logfile(file_obj)
+    except Exception as e:
+        logger.error(f"Error saving file object: {e}")
+
+
+class FileBuffer:
+    """
+    Acumula filas File del modo batch y las inserta con bulk_create cada 'size' proyectos.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def add(self, file_obj):
+        with self._lock:
+            self.pending.append(file_obj)
+            if len(self.pending) < self.size:
+                return
+            rows, self.pending = self.pending, []
+        self._write(rows)
+
+    def flush(self):
+        with self._lock:
+            rows, self.pending = self.pending, []
+        self._write(rows)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        try:
+            File.objects.bulk_create(rows)
+            record_file_stats(rows)
+            write_activity_in_logfile(*rows)
+        except Exception as e:
+            logger.error(f"Error saving {len(rows)} file objects: {e}")
+
 def save_analysis_in_file_db(request, zip_filename):
+    """
+    Prepara (sin guardar) la fila File de un análisis de fichero; se guarda al terminar el análisis.
+    """
     now = datetime.now()
     safe_name = zip_filename[:95] if len(zip_filename) > 95 else zip_filename
     if request.user.is_authenticated and Organization.objects.filter(username=request.user.username).exists():
@@ -641,7 +786,6 @@ def save_analysis_in_file_db(request, zip_filename):
                  'flowControl', 'userInteractivity', 'dataRepresentation', 'spriteNaming', 
                  'initialization', 'deadCode', 'duplicateScript']:
         if hasattr(f, attr): setattr(f, attr, 0)
-    f.save()
     return f
 
 def check_project(counter): return "Original" if counter == 0 else "New"
@@ -0,0 +1,221 @@
+import hmac
+import io
+import json
+import queue
+import threading
+import zipfile
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from app.admission import AnalysisBusy
+from app.analyzer import cached_project_analysis, return_scratch_project_identifier
+from app.batch import iter_zip_sources, scan_batch_zip
+from app.exception import DrScratchException
+from app.project_store import read_upload
+from app.scratchclient import get_snap_client
+
+API_VERSION = 1
+API_MODES = ('Default', 'Recommender')
+
+SKILLS = ['Abstraction', 'Parallelization', 'Logic', 'Synchronization', 'FlowControl',
+          'UserInteractivity', 'DataRepresentation', 'MathOperators', 'MotionOperators']
+SMELLS = ['deadCode', 'duplicateScript', 'spriteNaming', 'backdropNaming']
+
+# ==============================================================================
+# 1. LECTURA DE LA PETICIÓN
+# ==============================================================================
+
+def api_authorized(request) -> bool:
+    """
+    El cliente envía uno de los tokens de API_TOKENS en 'Authorization: Bearer <token>'.
+    Sin tokens configurados la API queda cerrada.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    token = token.strip()
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    return any(hmac.compare_digest(token, allowed) for allowed in settings.API_TOKENS)
+
+
+def read_api_request(request) -> dict:
+    """
+    URLs, archivo, rúbrica y modo de una petición JSON ({"urls": [...]}) o multipart
+    (campos 'urls' y 'file'). Todo se valida antes de empezar a responder, para
+    poder devolver un 400 normal.
+    """
+    if request.content_type == 'application/json':
+        try:
+            options = json.loads(request.body or b'{}')
+        except ValueError:
+            raise DrScratchException("Invalid JSON body")
+        if not isinstance(options, dict):
+            raise DrScratchException("The JSON body must be an object")
+        urls = options.get('urls') or []
+    else:
+        options = request.POST
+        urls = [url for value in request.POST.getlist('urls') for url in value.split()]
+
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        raise DrScratchException("'urls' must be a list of project URLs")
+    urls = [url.strip() for url in urls if url.strip()]
+
+    mode = options.get('mode') or 'Default'
+    if mode not in API_MODES:
+        raise DrScratchException(f"'mode' must be one of {', '.join(API_MODES)}")
+    rubric = str(options.get('rubric') or '')
+    # Una cifra por competencia: con menos, generate_rubric dejaría competencias sin puntos
+    if rubric and (not rubric.isdigit() or len(rubric) != len(SKILLS)):
+        raise DrScratchException("'rubric' must be exactly 9 digits (points per skill)")
+
+    archive, members, single = None, [], None
+    upload = request.FILES.get('file')
+    if upload is not None:
+        data = read_upload(upload)
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            archive = zipfile.ZipFile(io.BytesIO(data))
+            members = scan_batch_zip(archive)
+        else:
+            single = (upload.name, data)
+
+    total = len(urls) + len(members) + (single is not None)
+    if not total:
+        raise DrScratchException("Send project URLs in 'urls' or an archive in 'file'")
+    if total > settings.API_MAX_PROJECTS:
+        raise DrScratchException(f"Too many projects ({total}); the limit is {settings.API_MAX_PROJECTS}")
+
+    return {'urls': urls, 'archive': archive, 'members': members, 'single': single,
+            'rubric': rubric, 'mode': mode, 'total': total}
+
+
+def api_request_context(request, mode: str) -> SimpleNamespace:
+    """
+    Petición mínima para el analizador: se usa desde otro hilo, así que no comparte
+    la sesión ni el usuario perezoso de la petición original.
+    """
+    return SimpleNamespace(
+        POST={'dashboard_mode': mode},
+        LANGUAGE_CODE=request.LANGUAGE_CODE,
+        user=SimpleNamespace(is_authenticated=request.user.is_authenticated, username=request.user.username),
+        session={},
+    )
+
+# ==============================================================================
+# 2. PROYECTOS Y LÍNEAS NDJSON
+# ==============================================================================
+
+def iter_api_projects(job: dict):
+    """
+    (índice, nombre, url, contenido) de cada proyecto. Los ficheros van primero y
+    luego las URLs según termina su descarga; si algo falla el contenido es un
+    dict de error.
+    """
+    index = 0
+    if job['single'] is not None:
+        name, data = job['single']
+        yield index, name, None, data.decode('utf-8', errors='replace')
+        index += 1
+    if job['archive'] is not None:
+        for source in iter_zip_sources(job['archive'], job['members']):
+            yield index, source['filename'], None, source['content'].decode('utf-8', errors='replace')
+            index += 1
+
+    urls = job['urls']
+    infos = [return_scratch_project_identifier(url) for url in urls]
+    valid = [i for i, info in enumerate(infos) if info['platform'] != 'error']
+    for i, info in enumerate(infos):
+        if info['platform'] == 'error':
+            yield index + i, urls[i], urls[i], {'Error': 'id_error'}
+    for position, xml, error in get_snap_client().fetch_many([infos[i] for i in valid]):
+        i = valid[position]
+        yield index + i, urls[i], urls[i], xml if error is None else {'Error': 'no_exists'}
+
+
+def api_line(index: int, result: dict) -> dict:
+    """ Resultado compacto de un proyecto, con las claves de mastery sin traducir """
+    error = result.get('Error')
+    line = {
+        'index': index,
+        'url': result.get('url'),
+        'filename': result.get('filename'),
+        'content_hash': result.get('content_hash'),
+        'error': None if error in (None, 'None') else error,
+    }
+    if line['error'] is None:
+        extended = result.get('extended') or {}
+        vanilla = result.get('vanilla') or {}
+        line.update({
+            'points': extended.get('total_points'),
+            'competence': extended.get('competence'),
+            'total_blocks': extended.get('total_blocks'),
+            'mastery': {skill: extended[skill] for skill in SKILLS if skill in extended},
+            'vanilla': {skill: vanilla[skill] for skill in SKILLS if skill in vanilla},
+            'smells': {smell: (result.get(smell) or {}).get('number', 0) for smell in SMELLS},
+        })
+        if 'recomenderSystem' in result:
+            line['recommender'] = result['recomenderSystem']
+    return line
+
+
+def ndjson(data: dict) -> bytes:
+    return (json.dumps(data, cls=DjangoJSONEncoder) + '\n').encode('utf-8')
+
+# ==============================================================================
+# 3. RESPUESTA EN STREAMING
+# ==============================================================================
+
+def stream_api_analysis(context, skill_points: dict, job: dict):
+    """
+    Genera una línea NDJSON por proyecto según termina su análisis y una línea
+    final con el resumen. Descarga y análisis van en un hilo productor con una
+    cola acotada: si el cliente lee despacio el productor espera, y si se
+    desconecta el productor para. context es la petición de api_request_context.
+    """
+    lines = queue.Queue(maxsize=settings.API_STREAM_BUFFER)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                lines.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def analyse(content, filename, url):
+        # Con el servidor saturado el stream va más despacio, pero no pierde proyectos
+        while not cancelled.is_set():
+            try:
+                return cached_project_analysis(context, skill_points, content, filename, url)[0]
+            except AnalysisBusy as e:
+                cancelled.wait(e.retry_after)
+        return None
+
+    def produce():
+        try:
+            for index, filename, url, content in iter_api_projects(job):
+                result = analyse(content, filename, url)
+                if result is None or not put(api_line(index, result)):
+                    return
+        except Exception as e:
+            put({'error': f'analysis stopped: {e}'})
+        finally:
+            put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    projects = errors = 0
+    try:
+        while True:
+            line = lines.get()
+            if line is None:
+                break
+            if 'index' in line:
+                projects += 1
+                errors += line['error'] is not None
+            yield ndjson(line)
+        yield ndjson({'done': True, 'version': API_VERSION, 'projects': projects, 'errors': errors})
+    finally:
+        cancelled.set()
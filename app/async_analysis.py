@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from app.analyzer import return_scratch_project_identifier
+from app.scratchclient import get_async_snap_client
+
+# ==============================================================================
+# 1. EJECUTOR ACOTADO PARA EL ANÁLISIS (CPU)
+# ==============================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_analysis_executor() -> ThreadPoolExecutor:
+    """
+    Hilos compartidos por proceso para el parseo y el análisis de las vistas async.
+    Acotan cuántos análisis corren a la vez sin bloquear el bucle de eventos.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_ANALYSIS_WORKERS,
+                                           thread_name_prefix='analysis')
+        return _executor
+
+
+def _run_with_connections(func, *args, **kwargs):
+    # Los hilos del ejecutor se reutilizan: cierran las conexiones a la BD caducadas
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_analysis(func, *args, **kwargs):
+    """
+    Ejecuta código síncrono (ORM, sesión, plantillas, análisis) en el ejecutor
+    acotado, conservando el contexto de la petición (idioma activo).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _run_with_connections, func, *args, **kwargs)
+    return await loop.run_in_executor(get_analysis_executor(), call)
+
+# ==============================================================================
+# 2. DESCARGA NO BLOQUEANTE
+# ==============================================================================
+
+def dashboard_project_url(post) -> str:
+    """ URL del proyecto si el formulario pide analizar uno solo por URL """
+    if post.get('dashboard_mode') == 'Comparison' or '_upload' in post:
+        return None
+    if '_url_recom' in post:
+        return (post.get('urlProject_recom') or '').strip() or None
+    if '_url' in post:
+        return (post.get('urlProject') or '').strip() or None
+    return None
+
+
+async def fetch_project_xml(url: str) -> str:
+    """
+    Descarga el XML de un proyecto de Snap! sin bloquear. Devuelve None si la URL
+    no identifica un proyecto (el análisis síncrono ya da ese error).
+    """
+    info_project = return_scratch_project_identifier(url)
+    if info_project['platform'] == 'error':
+        return None
+    return await get_async_snap_client().get_project_xml(info_project['username'], info_project['projectname'])
+
@@ -1,11 +1,18 @@
 import csv
+import heapq
 import os
 import shutil
 import uuid
+import time
 import re
 from datetime import datetime
 from zipfile import ZipFile
-from .models import BatchCSV
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Sum
+from django.utils import timezone
+from .models import BatchCSV, BatchProject
+from .exception import DrScratchException
 
 # ==============================================================================
 # FUNCIONES AUXILIARES (TRADUCCIÓN)
@@ -23,235 +30,470 @@ def skills_translation(request) -> dict:
     return dic
 
 # ==============================================================================
-# FUNCIONES GENERADORAS DE CSV INDIVIDUALES
+# INGESTA DE ZIP EN MEMORIA (SIN EXTRAER A DISCO)
 # ==============================================================================
 
-def create_csv_main(request, d: dict, folder_path: str) -> str:
-    csv_name = "main.csv"
-    csv_filepath = os.path.join(folder_path, csv_name)
-    
-    headers = [
-        'url', 'filename', 'points', 
-        'Abstraction', 'Parallelism', 'Logic', 'Synchronization',
-        'Flow control', 'User interactivity', 'Data representation',
-        'Math operators', 'Motion operators', 'DuplicateScripts',
-        'DeadCode', 'SpriteNaming', 'BackdropNaming', 
-        'Error', 'dashboard_mode'
-    ]
-    vanilla_headers = ['Van points','Van Abstraction','Van Parallelism', 'Van Logic', 'Van Synchronization', 'Van Flow control', 'Van User interactivity', 'Van Data representation']
-    global_headers = headers + vanilla_headers + ['tot_blocks']
-
-    keys_map = {
-        'Abstraction': 'Abstraction', 'Parallelism': 'Parallelization', 'Logic': 'Logic',
-        'Synchronization': 'Synchronization', 'Flow control': 'FlowControl',
-        'User interactivity': 'UserInteractivity', 'Data representation': 'DataRepresentation',
-        'Math operators': 'MathOperators', 'Motion operators': 'MotionOperators'
-    }
+MAX_EXTRACT_SIZE = 100 * 1024 * 1024  # 100 MB descomprimido
+MAX_FILES_IN_ZIP = 500
+
+def scan_batch_zip(zip_file: ZipFile) -> list:
+    """
+    Una sola pasada por el directorio central del ZIP (sin descomprimir nada):
+    límites anti Zip Bomb, protección Zip Slip y selección de los proyectos .xml.
+    zipfile nunca entrega más bytes que el tamaño declarado de cada miembro, así
+    que la suma de tamaños declarados acota también lo que se leerá después.
+    """
+    members = []
+    extracted_size = 0
+    for file_count, zip_info in enumerate(zip_file.infolist(), 1):
+        if file_count > MAX_FILES_IN_ZIP:
+            raise DrScratchException("Error de seguridad: ZIP con demasiados archivos.")
+        extracted_size += zip_info.file_size
+        if extracted_size > MAX_EXTRACT_SIZE:
+            raise DrScratchException(
+                "Error de seguridad: ZIP rechazado, supera el límite de tamaño descomprimido (posible Zip Bomb)."
+            )
+
+        # Saltar directorios, archivos ocultos y del sistema
+        name = zip_info.filename
+        if zip_info.is_dir() or name.startswith('__') or name.startswith('.'):
+            continue
+
+        # Solo procesar XML (proyectos Snap!)
+        if not name.lower().endswith('.xml'):
+            continue
+
+        # Zip Slip: solo se usa el nombre base, nunca la ruta del miembro
+        if not os.path.basename(name):
+            continue
+        members.append(zip_info)
+    return members
+
+def iter_zip_sources(zip_file: ZipFile, members: list):
+    """
+    Genera las fuentes del lote leyendo cada miembro del ZIP solo cuando el pipeline lo pide.
+    """
+    for zip_info in members:
+        yield {'filename': os.path.basename(zip_info.filename), 'content': zip_file.read(zip_info), 'origin': "ZIP Upload"}
+
+def list_zip_sources(zip_path: str) -> list:
+    """
+    Fuentes de un ZIP guardado en disco (modo Celery): solo referencias a los
+    miembros; el pipeline los lee del ZIP al analizarlos.
+    """
+    with ZipFile(zip_path, 'r') as zip_file:
+        return [
+            {'zip': zip_path, 'member': zip_info.filename,
+             'filename': os.path.basename(zip_info.filename), 'origin': "ZIP Upload",
+             'size': zip_info.file_size}
+            for zip_info in scan_batch_zip(zip_file)
+        ]
 
-    with open(csv_filepath, 'w', newline='') as csv_file:
-        writer_csv = csv.DictWriter(csv_file, fieldnames=global_headers)
-        writer_csv.writeheader()
-
-        for project in d.values():
-            row = {}
-            # Datos básicos
-            row['url'] = project.get('url', 'Upload')
-            row['filename'] = re.sub(r"[\;\"\,\n\r]", "", str(project.get('filename', '')))
-            row['Error'] = project.get('Error', 'None')
-            
-            # Bloques
-            try: row['tot_blocks'] = project['block_sprite_usage']['result']['total_blocks']
-            except: row['tot_blocks'] = 'N/A'
-
-            # Puntos Extended (Buscamos en 'extended', 'mastery' o raíz)
-            mastery = project.get('extended') or project.get('mastery') or project
-            pts = mastery.get('total_points') or mastery.get('points') or [0]
-            row['points'] = pts[0] if isinstance(pts, list) else pts
-
-            for csv_k, dict_k in keys_map.items():
-                val = mastery.get(dict_k, [0])
-                row[csv_k] = f"{val[0]}/{val[1]}" if isinstance(val, list) and len(val)>1 else val
-
-            # Puntos Vanilla
-            vanilla = project.get('vanilla') or project.get('mastery_vanilla') or {}
-            pts_van = vanilla.get('total_points') or vanilla.get('points') or [0]
-            row['Van points'] = pts_van[0] if isinstance(pts_van, list) else pts_van
-
-            for csv_k, dict_k in keys_map.items():
-                if csv_k not in ['Math operators', 'Motion operators']:
-                    val = vanilla.get(dict_k, [0])
-                    row[f"Van {csv_k}"] = f"{val[0]}/{val[1]}" if isinstance(val, list) and len(val)>1 else val
-
-            # Bad Smells (Con protección .get segura)
-            row['DuplicateScripts'] = project.get('duplicateScript', {}).get('number', 0)
-            row['DeadCode'] = project.get('deadCode', {}).get('number', 0)
-            row['SpriteNaming'] = project.get('spriteNaming', {}).get('number', 0)
-            row['BackdropNaming'] = project.get('backdropNaming', {}).get('number', 0)
-
-            writer_csv.writerow(row)
-    return csv_filepath
-
-def create_csv_dups(d: dict, folder_path: str):
-    csv_name = "duplicateScript.csv"
-    csv_filepath = os.path.join(folder_path, csv_name)
-    headers = ['url', 'filename', 'number']
-
-    max_dup_scripts = 0
-    for project in d.values():
-        dups = project.get('duplicateScript', {}).get('csv_format', [])
-        count = len(dups) if dups else 0
-        if count > max_dup_scripts: 
-            max_dup_scripts = count
-    
-    for i in range(1, max_dup_scripts + 1):
-        headers.append(f'duplicateScript_{i}')
-
-    with open(csv_filepath, 'w', newline='', encoding='utf-8') as csv_file:
-        writer_csv = csv.DictWriter(csv_file, fieldnames=headers)
-        writer_csv.writeheader()
-
-        for project in d.values():
-            row = {
-                'url': project.get('url', ''),
-                'filename': project.get('filename', ''),
-                'number': project.get('duplicateScript', {}).get('number', 0)
-            }
-            dups = project.get('duplicateScript', {}).get('csv_format', [])
-            idx = 1
-            if dups:
-                for script in dups:
-                    row[f'duplicateScript_{idx}'] = script
-                    idx += 1
-            writer_csv.writerow(row)
-
-def create_csv_sprites(d: dict, folder_path: str):
-    csv_name = "spriteNaming.csv"
-    csv_filepath = os.path.join(folder_path, csv_name)
-    headers = ['url', 'filename', 'number']
-
-    max_sprites = 0
-    for p in d.values():
-        sprites = p.get('spriteNaming', {}).get('sprite', [])
-        if len(sprites) > max_sprites: max_sprites = len(sprites)
-    
-    headers.extend(f'spriteNaming{i}' for i in range(1, max_sprites+1))
-    
-    with open(csv_filepath, 'w', newline='') as csv_file:
-        writer_csv = csv.DictWriter(csv_file, fieldnames=headers)
-        writer_csv.writeheader()
-
-        for project in d.values():
-            row = {
-                'url': project.get('url', ''),
-                'filename': project.get('filename', ''),
-                'number': project.get('spriteNaming', {}).get('number', 0)
-            }
-            sprites = project.get('spriteNaming', {}).get('sprite', [])
-            for i, name in enumerate(sprites, 1):
-                row[f'spriteNaming{i}'] = name
-            writer_csv.writerow(row)
-
-def create_csv_backdrops(d: dict, folder_path: str):
-    csv_name = "backdropNaming.csv"
-    csv_filepath = os.path.join(folder_path, csv_name)
-    headers = ['url', 'filename', 'number']
-
-    max_b = 0
-    for p in d.values():
-        b = p.get('backdropNaming', {}).get('backdrop', [])
-        if len(b) > max_b: max_b = len(b)
-    
-    headers.extend(f'backdropNaming{i}' for i in range(1, max_b+1))
-    
-    with open(csv_filepath, 'w', newline='') as csv_file:
-        writer_csv = csv.DictWriter(csv_file, fieldnames=headers)
-        writer_csv.writeheader()
-
-        for project in d.values():
-            row = {
-                'url': project.get('url', ''),
-                'filename': project.get('filename', ''),
-                'number': project.get('backdropNaming', {}).get('number', 0)
-            }
-            backdrops = project.get('backdropNaming', {}).get('backdrop', [])
-            for i, name in enumerate(backdrops, 1):
-                row[f'backdropNaming{i}'] = name
-            writer_csv.writerow(row)
-
-def create_csv_deadcode(d: dict, folder_path: str):
-    csv_name = "deadCode.csv"
-    csv_filepath = os.path.join(folder_path, csv_name)
-    headers = ['url', 'filename', 'number', 'sprite']
-    
-    # Calcular columnas maximas
-    max_cols = 0
-    for p in d.values():
-        dc_data = p.get('deadCode', {})
-        for k, v in dc_data.items():
-            if k not in ['number', 'deadCode'] and isinstance(v, list):
-                if len(v) > max_cols: max_cols = len(v)
-    
-    headers.extend(f'deadCode{i}' for i in range(1, max_cols+1))
-        
-    with open(csv_filepath, 'w', newline='') as csv_file:
-        writer_csv = csv.DictWriter(csv_file, fieldnames=headers)
-        writer_csv.writeheader()
-
-        for project in d.values():
-            dc_data = project.get('deadCode', {})
-            # Iteramos por sprites dentro de deadCode
-            for sprite_name, blocks in dc_data.items():
-                if sprite_name not in ['number', 'deadCode']:
-                    row = {
-                        'url': project.get('url', ''),
-                        'filename': project.get('filename', ''),
-                        'number': dc_data.get('number', 0),
-                        'sprite': sprite_name
-                    }
-                    for i, block in enumerate(blocks, 1):
-                        row[f'deadCode{i}'] = block
-                    writer_csv.writerow(row)
+# ==============================================================================
+# ESCRITURA EN STREAMING DE LOS CSV
+# ==============================================================================
+
+MAIN_HEADERS = [
+    'url', 'filename', 'points',
+    'Abstraction', 'Parallelism', 'Logic', 'Synchronization',
+    'Flow control', 'User interactivity', 'Data representation',
+    'Math operators', 'Motion operators', 'DuplicateScripts',
+    'DeadCode', 'SpriteNaming', 'BackdropNaming',
+    'Error', 'dashboard_mode'
+]
+VANILLA_HEADERS = ['Van points','Van Abstraction','Van Parallelism', 'Van Logic', 'Van Synchronization', 'Van Flow control', 'Van User interactivity', 'Van Data representation']
+GLOBAL_HEADERS = MAIN_HEADERS + VANILLA_HEADERS + ['tot_blocks']
+
+# Formato largo: una fila por hallazgo (no hace falta calcular columnas máximas)
+FINDINGS_HEADERS = ['project', 'url', 'filename', 'smell', 'sprite', 'position', 'value']
+
+KEYS_MAP = {
+    'Abstraction': 'Abstraction', 'Parallelism': 'Parallelization', 'Logic': 'Logic',
+    'Synchronization': 'Synchronization', 'Flow control': 'FlowControl',
+    'User interactivity': 'UserInteractivity', 'Data representation': 'DataRepresentation',
+    'Math operators': 'MathOperators', 'Motion operators': 'MotionOperators'
+}
+
+def main_csv_row(project: dict) -> dict:
+    row = {}
+    # Datos básicos
+    row['url'] = project.get('url', 'Upload')
+    row['filename'] = re.sub(r"[\;\"\,\n\r]", "", str(project.get('filename', '')))
+    row['Error'] = project.get('Error', 'None')
+    row['dashboard_mode'] = project.get('dashboard_mode', '')
+
+    # Bloques
+    try: row['tot_blocks'] = project['block_sprite_usage']['result']['total_blocks']
+    except: row['tot_blocks'] = 'N/A'
+
+    # Puntos Extended (Buscamos en 'extended', 'mastery' o raíz)
+    mastery = project.get('extended') or project.get('mastery') or project
+    pts = mastery.get('total_points') or mastery.get('points') or [0]
+    row['points'] = pts[0] if isinstance(pts, list) else pts
+
+    for csv_k, dict_k in KEYS_MAP.items():
+        val = mastery.get(dict_k, [0])
+        row[csv_k] = f"{val[0]}/{val[1]}" if isinstance(val, list) and len(val)>1 else val
+
+    # Puntos Vanilla
+    vanilla = project.get('vanilla') or project.get('mastery_vanilla') or {}
+    pts_van = vanilla.get('total_points') or vanilla.get('points') or [0]
+    row['Van points'] = pts_van[0] if isinstance(pts_van, list) else pts_van
+
+    for csv_k, dict_k in KEYS_MAP.items():
+        if csv_k not in ['Math operators', 'Motion operators']:
+            val = vanilla.get(dict_k, [0])
+            row[f"Van {csv_k}"] = f"{val[0]}/{val[1]}" if isinstance(val, list) and len(val)>1 else val
+
+    # Bad Smells (Con protección .get segura)
+    row['DuplicateScripts'] = project.get('duplicateScript', {}).get('number', 0)
+    row['DeadCode'] = project.get('deadCode', {}).get('number', 0)
+    row['SpriteNaming'] = project.get('spriteNaming', {}).get('number', 0)
+    row['BackdropNaming'] = project.get('backdropNaming', {}).get('number', 0)
+    return row
+
+def findings_csv_rows(index: int, project: dict):
+    base = {'project': index, 'url': project.get('url', ''), 'filename': project.get('filename', '')}
+
+    for i, script in enumerate(project.get('duplicateScript', {}).get('csv_format', None) or [], 1):
+        yield dict(base, smell='duplicateScript', sprite='', position=i, value=script)
+    for i, name in enumerate(project.get('spriteNaming', {}).get('sprite', []), 1):
+        yield dict(base, smell='spriteNaming', sprite='', position=i, value=name)
+    for i, name in enumerate(project.get('backdropNaming', {}).get('backdrop', []), 1):
+        yield dict(base, smell='backdropNaming', sprite='', position=i, value=name)
+    for sprite_name, blocks in project.get('deadCode', {}).items():
+        if sprite_name not in ['number', 'deadCode']:
+            for i, block in enumerate(blocks, 1):
+                yield dict(base, smell='deadCode', sprite=sprite_name, position=i, value=block)
+
+
+# Lo que se guarda de cada proyecto en BatchProject.result (las listas de hallazgos no)
+CHECKPOINT_KEYS = ['url', 'filename', 'Error', 'dashboard_mode', 'duplicate', 'findings_of']
+SMELL_KEYS = ['duplicateScript', 'deadCode', 'spriteNaming', 'backdropNaming']
+
+def checkpoint_result(project: dict) -> dict:
+    """
+    Versión reducida de un resultado: lo justo para su fila de main.csv, el
+    resumen del lote y reutilizarlo si el proyecto se repite en otra subtarea.
+    Sus hallazgos solo se escriben en los ficheros parciales de la subtarea.
+    """
+    compact = {key: project[key] for key in CHECKPOINT_KEYS if key in project}
+    mastery = project.get('extended') or project.get('mastery')
+    if mastery:
+        compact['extended'] = mastery
+    vanilla = project.get('vanilla') or project.get('mastery_vanilla')
+    if vanilla:
+        compact['vanilla'] = vanilla
+    for smell in SMELL_KEYS:
+        if smell in project:
+            compact[smell] = {'number': (project[smell] or {}).get('number', 0)}
+    try:
+        compact['block_sprite_usage'] = {'result': {'total_blocks': project['block_sprite_usage']['result']['total_blocks']}}
+    except (KeyError, TypeError):
+        pass
+    return compact
+
+PART_INDEX = 'index'
+
+class BatchPartWriter:
+    """
+    Ficheros parciales de un intento de una subtarea: las filas de cada proyecto
+    se añaden en cuanto termina su análisis, en orden de llegada y con su índice
+    en el lote. merge_batch_parts los une al final en main.csv y findings.csv.
+    """
+
+    def __init__(self, folder_path: str, chunk: int):
+        parts_path = os.path.join(folder_path, 'parts')
+        os.makedirs(parts_path, exist_ok=True)
+        # Un par de ficheros por intento: un reintento nunca pisa lo ya escrito y,
+        # ordenados por nombre, los intentos de una subtarea quedan en orden de inicio
+        name = '{:06d}-{:020d}-{}'.format(chunk, time.time_ns(), uuid.uuid4().hex[:8])
+        self.main_file = open(os.path.join(parts_path, name + '.main.csv'), 'w', newline='', encoding='utf-8')
+        self.findings_file = open(os.path.join(parts_path, name + '.findings.csv'), 'w', newline='', encoding='utf-8')
+        self.main_writer = csv.DictWriter(self.main_file, fieldnames=[PART_INDEX] + GLOBAL_HEADERS)
+        self.findings_writer = csv.DictWriter(self.findings_file, fieldnames=FINDINGS_HEADERS)
+        self.main_writer.writeheader()
+        self.findings_writer.writeheader()
+
+    def write(self, index: int, project: dict):
+        self.main_writer.writerow(dict(main_csv_row(project), **{PART_INDEX: index}))
+        self.findings_writer.writerows(findings_csv_rows(index, project))
+        self.main_file.flush()
+        self.findings_file.flush()
+
+    def close(self):
+        self.main_file.close()
+        self.findings_file.close()
+
+def sort_part(path: str, key: str) -> str:
+    """ Copia de un fichero parcial ordenada por índice (cabe en memoria: es una subtarea) """
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        fieldnames = reader.fieldnames
+    # sort es estable: los hallazgos de un proyecto conservan su orden
+    rows.sort(key=lambda row: int(row[key]))
+    sorted_path = path + '.sorted'
+    with open(sorted_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return sorted_path
+
+def iter_part(path: str, key: str, part: int):
+    """ (índice, parte, posición, fila) de un fichero parcial ya ordenado """
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        for position, row in enumerate(csv.DictReader(f)):
+            yield int(row[key]), part, position, row
+
+def merge_batch_parts(folder_path: str, copies: dict = None):
+    """
+    Une los ficheros parciales de las subtareas en main.csv y findings.csv, en
+    el orden del lote, con una mezcla en streaming. Si un proyecto se escribió
+    en dos intentos vale el primero. copies ({índice: índice del original}) son
+    los proyectos repetidos en otra subtarea, que reciben los hallazgos de su
+    original. Si ya se unieron (no quedan parciales) no hace nada.
+    """
+    parts_path = os.path.join(folder_path, 'parts')
+    if not os.path.isdir(parts_path):
+        if os.path.exists(os.path.join(folder_path, 'main.csv')):
+            return
+        # Ninguna subtarea llegó a escribir filas: CSV solo con las cabeceras
+        os.makedirs(parts_path)
+    copies = copies or {}
+    names = sorted(name[:-len('.main.csv')] for name in os.listdir(parts_path) if name.endswith('.main.csv'))
+    main_parts = [sort_part(os.path.join(parts_path, name + '.main.csv'), PART_INDEX) for name in names]
+    findings_parts = [sort_part(os.path.join(parts_path, name + '.findings.csv'), 'project') for name in names]
+
+    def findings_stream():
+        return heapq.merge(*[iter_part(path, 'project', part) for part, path in enumerate(findings_parts)])
+
+    # Primera pasada (solo si hay copias): hallazgos de los originales
+    originals = set(copies.values())
+    copied, source_part = {}, {}
+    if originals:
+        for index, part, _, row in findings_stream():
+            if index in originals and source_part.setdefault(index, part) == part:
+                copied.setdefault(index, []).append(row)
+
+    # Segunda pasada: main.csv y findings.csv a la vez, proyecto a proyecto
+    with open(os.path.join(folder_path, 'main.csv'), 'w', newline='', encoding='utf-8') as main_file, \
+            open(os.path.join(folder_path, 'findings.csv'), 'w', newline='', encoding='utf-8') as findings_file:
+        main_writer = csv.DictWriter(main_file, fieldnames=GLOBAL_HEADERS)
+        findings_writer = csv.DictWriter(findings_file, fieldnames=FINDINGS_HEADERS)
+        main_writer.writeheader()
+        findings_writer.writeheader()
+
+        findings = findings_stream()
+        finding = next(findings, None)
+        ordinal, last = 0, None
+        mains = heapq.merge(*[iter_part(path, PART_INDEX, part) for part, path in enumerate(main_parts)])
+        for index, part, _, row in mains:
+            if index == last:
+                continue
+            last = index
+            del row[PART_INDEX]
+            main_writer.writerow(row)
+
+            # Los hallazgos de create_wide_csvs se numeran por fila de main.csv
+            while finding is not None and finding[0] < index:
+                finding = next(findings, None)
+            while finding is not None and finding[0] == index:
+                if finding[1] == part:
+                    findings_writer.writerow(dict(finding[3], project=ordinal))
+                finding = next(findings, None)
+            for copy in copied.get(copies.get(index), []):
+                findings_writer.writerow(dict(copy, project=ordinal, url=row['url'], filename=row['filename']))
+            ordinal += 1
+
+    shutil.rmtree(parts_path)
+
+
+# ==============================================================================
+# CSV EN FORMATO ANCHO (POST-PROCESADO OPCIONAL)
+# ==============================================================================
+
+def iter_project_findings(findings_path: str):
+    """ Agrupa las filas consecutivas de findings.csv por proyecto """
+    with open(findings_path, 'r', newline='', encoding='utf-8') as f:
+        current, rows = None, []
+        for row in csv.DictReader(f):
+            if row['project'] != current and rows:
+                yield int(current), rows
+                rows = []
+            current = row['project']
+            rows.append(row)
+        if rows:
+            yield int(current), rows
+
+def create_wide_csvs(folder_path: str):
+    """
+    Genera duplicateScript.csv, spriteNaming.csv, backdropNaming.csv y deadCode.csv
+    (una columna por hallazgo) a partir de main.csv y findings.csv, en dos pasadas
+    sobre disco en lugar de mantener el lote en memoria.
+    """
+    main_path = os.path.join(folder_path, 'main.csv')
+    findings_path = os.path.join(folder_path, 'findings.csv')
+
+    # Primera pasada: número máximo de columnas de cada tipo
+    max_cols = {'duplicateScript': 0, 'spriteNaming': 0, 'backdropNaming': 0, 'deadCode': 0}
+    for index, rows in iter_project_findings(findings_path):
+        counts = {}
+        for row in rows:
+            key = (row['smell'], row['sprite'])
+            counts[key] = counts.get(key, 0) + 1
+        for (smell, sprite), count in counts.items():
+            max_cols[smell] = max(max_cols[smell], count)
+
+    files = {
+        'duplicateScript': ('duplicateScript.csv', ['url', 'filename', 'number'] + [f'duplicateScript_{i}' for i in range(1, max_cols['duplicateScript'] + 1)]),
+        'spriteNaming': ('spriteNaming.csv', ['url', 'filename', 'number'] + [f'spriteNaming{i}' for i in range(1, max_cols['spriteNaming'] + 1)]),
+        'backdropNaming': ('backdropNaming.csv', ['url', 'filename', 'number'] + [f'backdropNaming{i}' for i in range(1, max_cols['backdropNaming'] + 1)]),
+        'deadCode': ('deadCode.csv', ['url', 'filename', 'number', 'sprite'] + [f'deadCode{i}' for i in range(1, max_cols['deadCode'] + 1)]),
+    }
+    number_column = {'duplicateScript': 'DuplicateScripts', 'spriteNaming': 'SpriteNaming', 'backdropNaming': 'BackdropNaming', 'deadCode': 'DeadCode'}
+    column_prefix = {'duplicateScript': 'duplicateScript_', 'spriteNaming': 'spriteNaming', 'backdropNaming': 'backdropNaming', 'deadCode': 'deadCode'}
+
+    handles = {}
+    writers = {}
+    for smell, (csv_name, headers) in files.items():
+        handles[smell] = open(os.path.join(folder_path, csv_name), 'w', newline='', encoding='utf-8')
+        writers[smell] = csv.DictWriter(handles[smell], fieldnames=headers)
+        writers[smell].writeheader()
+
+    # Segunda pasada: main.csv y findings.csv están en el mismo orden de proyectos
+    try:
+        findings = iter_project_findings(findings_path)
+        next_findings = next(findings, None)
+        with open(main_path, 'r', newline='', encoding='utf-8') as f:
+            for ordinal, main_row in enumerate(csv.DictReader(f)):
+                rows = []
+                if next_findings and next_findings[0] == ordinal:
+                    rows = next_findings[1]
+                    next_findings = next(findings, None)
+
+                url = rows[0]['url'] if rows else main_row['url']
+                filename = rows[0]['filename'] if rows else main_row['filename']
+                for smell in ['duplicateScript', 'spriteNaming', 'backdropNaming']:
+                    row = {'url': url, 'filename': filename, 'number': main_row[number_column[smell]]}
+                    for finding in rows:
+                        if finding['smell'] == smell:
+                            row[column_prefix[smell] + finding['position']] = finding['value']
+                    writers[smell].writerow(row)
+
+                dead_code = {}
+                for finding in rows:
+                    if finding['smell'] == 'deadCode':
+                        dead_code.setdefault(finding['sprite'], {})[column_prefix['deadCode'] + finding['position']] = finding['value']
+                for sprite_name, blocks in dead_code.items():
+                    row = {'url': url, 'filename': filename, 'number': main_row[number_column['deadCode']], 'sprite': sprite_name}
+                    row.update(blocks)
+                    writers['deadCode'].writerow(row)
+    finally:
+        for handle in handles.values():
+            handle.close()
 
 # ==============================================================================
 # FUNCIONES DE RESUMEN Y BASE DE DATOS
 # ==============================================================================
 
-def create_summary(request, d: dict) -> dict:
-    summary = {}
-    skills = ['Abstraction', 'Parallelization', 'Logic', 'Synchronization', 'FlowControl', 
+class BatchSummary:
+    """
+    Resumen del lote calculado con sumas parciales: se actualiza proyecto a
+    proyecto (memoria constante), se puede consultar a mitad del lote y se
+    puede combinar entre subtareas. Los máximos salen de la rúbrica con la
+    que se analizó cada proyecto, no de la rúbrica por defecto.
+    """
+
+    SKILLS = ['Abstraction', 'Parallelization', 'Logic', 'Synchronization', 'FlowControl',
               'UserInteractivity', 'DataRepresentation', 'MathOperators', 'MotionOperators']
-    
-    for s in skills: summary[s] = 0
-    summary['Points'] = 0
-    summary['num_projects'] = len(d)
-
-    total_max = 21
-    
-    for p in d.values():
-        m = p.get('extended') or p.get('mastery') or p
+
+    def __init__(self, data: dict = None):
+        data = data or {}
+        self.num_projects = data.get('num_projects', 0)
+        self.duplicates = data.get('duplicates', 0)
+        # Proyectos con puntuación (los errores no tienen máximo de rúbrica)
+        self.scored = data.get('scored', 0)
+        self.points = data.get('points', 0)
+        self.max_points = data.get('max_points', 0)
+        self.skills = {s: data.get('skills', {}).get(s, 0) for s in self.SKILLS}
+        self.skill_max = {s: data.get('skill_max', {}).get(s, 0) for s in self.SKILLS}
+        # Histograma de puntuaciones por dimensión: {dimensión: {puntos: nº de proyectos}}
+        self.histograms = {s: dict(data.get('histograms', {}).get(s, {})) for s in self.SKILLS}
+        self.competences = dict(data.get('competences', {}))
+
+    def add(self, project: dict):
+        self.num_projects += 1
+        if project.get('duplicate'):
+            self.duplicates += 1
+        m = project.get('extended') or project.get('mastery') or project
         pts = m.get('total_points') or m.get('points') or [0]
-        val_points = pts[0] if isinstance(pts, list) else pts
-        summary['Points'] += val_points
+        self.points += pts[0] if isinstance(pts, list) else pts
+        if isinstance(pts, list) and len(pts) > 1:
+            self.scored += 1
+            self.max_points += pts[1]
 
-        for s in skills:
+        for s in self.SKILLS:
             val = m.get(s, [0])
             score = val[0] if isinstance(val, list) else val
-            summary[s] += score
-            
+            self.skills[s] += score
             if isinstance(val, list) and len(val) > 1:
-                 pass 
-
-    n = len(d) if len(d) > 0 else 1
-    summary['Points'] = [round(summary['Points']/n, 2), total_max]
-    for s in skills:
-        summary[s] = [round(summary[s]/n, 2), 3]
-
-    avg = summary['Points'][0]
-    if avg >= 15: summary['Mastery'] = 'Master'
-    elif avg > 7: summary['Mastery'] = 'Developing'
-    else: summary['Mastery'] = 'Basic'
-
-    return summary
+                self.skill_max[s] += val[1]
+                histogram = self.histograms[s]
+                histogram[str(score)] = histogram.get(str(score), 0) + 1
+
+        if m.get('competence'):
+            self.competences[m['competence']] = self.competences.get(m['competence'], 0) + 1
+
+    def merge(self, other: 'BatchSummary'):
+        self.num_projects += other.num_projects
+        self.duplicates += other.duplicates
+        self.scored += other.scored
+        self.points += other.points
+        self.max_points += other.max_points
+        for s in self.SKILLS:
+            self.skills[s] += other.skills[s]
+            self.skill_max[s] += other.skill_max[s]
+            for score, count in other.histograms[s].items():
+                self.histograms[s][score] = self.histograms[s].get(score, 0) + count
+        for competence, count in other.competences.items():
+            self.competences[competence] = self.competences.get(competence, 0) + count
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            'num_projects': self.num_projects, 'duplicates': self.duplicates, 'scored': self.scored,
+            'points': self.points, 'max_points': self.max_points,
+            'skills': dict(self.skills), 'skill_max': dict(self.skill_max),
+            'histograms': {s: dict(h) for s, h in self.histograms.items()},
+            'competences': dict(self.competences),
+        }
+
+    @staticmethod
+    def mastery_level(points: float, max_points: float) -> str:
+        """ Mismos umbrales que la competencia de cada proyecto (plugin Mastery) """
+        if max_points and points > max_points * 27 / 45: return 'Advanced'
+        if max_points and points > max_points * 18 / 45: return 'Master'
+        if max_points and points > max_points * 9 / 45: return 'Developing'
+        return 'Basic'
+
+    def finalize(self) -> dict:
+        summary = {}
+        summary['num_projects'] = self.num_projects
+
+        n = self.num_projects if self.num_projects > 0 else 1
+        # Medias y máximos sobre los mismos proyectos: los errores no puntúan
+        scored = self.scored if self.scored > 0 else 1
+        # Fracción de proyectos que no se analizaron por ser copia de otro del lote
+        summary['dedup_ratio'] = round(self.duplicates/n, 4)
+        summary['Points'] = [round(self.points/scored, 2), round(self.max_points/scored, 2)]
+        for s in self.SKILLS:
+            summary[s] = [round(self.skills[s]/scored, 2), round(self.skill_max[s]/scored, 2)]
+
+        summary['Mastery'] = self.mastery_level(*summary['Points'])
+        summary['histograms'] = {s: dict(h) for s, h in self.histograms.items()}
+        summary['competences'] = dict(self.competences)
+        return summary
 
 def create_obj(data: dict, csv_filepath: str) -> uuid.UUID:
     cs_data = BatchCSV.objects.create(
@@ -277,7 +519,8 @@ def create_obj(data: dict, csv_filepath: str) -> uuid.UUID:
         max_math_operators=data['MathOperators'][1],
         motion_operators=data['MotionOperators'][0],
         max_motion_operators=data['MotionOperators'][1],
-        mastery=data['Mastery']
+        mastery=data['Mastery'],
+        dedup_ratio=data.get('dedup_ratio', 0)
     )
     return cs_data.id
 
@@ -295,23 +538,118 @@ def zip_folder(folder_path: str):
 # FUNCIÓN PRINCIPAL DE ENTRADA
 # ==============================================================================
 
-def create_csv(request, d: dict) -> uuid.UUID:
+def create_batch_folder() -> str:
     now = datetime.now()
     folder_name = str(uuid.uuid4()) + '_' + now.strftime("%Y%m%d%H%M%S")
     base_dir = os.getcwd()
     folder_path = os.path.join(base_dir, 'csvs', 'Dr.Scratch', folder_name)
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
-    
-    create_csv_main(request, d, folder_path)
-    create_csv_dups(d, folder_path)
-    create_csv_sprites(d, folder_path)
-    create_csv_backdrops(d, folder_path)
-    create_csv_deadcode(d, folder_path)
-    
-    summary = create_summary(request, d) 
-    
+    return folder_path
+
+def finish_csv(folder_path: str, summary: BatchSummary) -> uuid.UUID:
+    """
+    Cierra un lote ya escrito en streaming: CSV anchos (opcionales), ZIP y BatchCSV.
+    """
+    if settings.BATCH_WIDE_CSV:
+        create_wide_csvs(folder_path)
+
     csv_filepath = zip_folder(folder_path)
-    id = create_obj(summary, csv_filepath)
-    
-    return id
\ No newline at end of file
+    return create_obj(summary.finalize(), csv_filepath)
+
+# ==============================================================================
+# PROGRESO Y ETA DEL LOTE
+# ==============================================================================
+
+def stage_stats_key(job_id, chunk: int) -> str:
+    return f'batch-stats:{job_id}:{chunk}'
+
+def summary_key(job_id, chunk: int) -> str:
+    return f'batch-summary:{job_id}:{chunk}'
+
+def merge_summaries(chunk_summaries) -> BatchSummary:
+    """ Resumen parcial del lote a partir del de cada subtarea """
+    summary = BatchSummary()
+    for data in chunk_summaries:
+        summary.merge(BatchSummary(data))
+    return summary
+
+def fit_project_time() -> tuple:
+    """
+    Ajusta por mínimos cuadrados segundos = a + b * bytes con los últimos
+    proyectos analizados (de este y de lotes anteriores).
+    """
+    history = list(
+        BatchProject.objects.filter(elapsed__isnull=False, size__isnull=False)
+        .order_by('-id').values_list('size', 'elapsed')[:settings.BATCH_ETA_HISTORY]
+    )
+    if not history:
+        return settings.BATCH_ETA_DEFAULT_SECONDS, 0.0
+
+    n = len(history)
+    mean_size = sum(size for size, _ in history) / n
+    mean_time = sum(elapsed for _, elapsed in history) / n
+    var = sum((size - mean_size) ** 2 for size, _ in history)
+    if var == 0:
+        return mean_time, 0.0
+
+    b = sum((size - mean_size) * (elapsed - mean_time) for size, elapsed in history) / var
+    b = max(b, 0.0)
+    return max(mean_time - b * mean_size, 0.0), b
+
+def predicted_seconds(projects, a: float, b: float, default_size: float) -> float:
+    """ Tiempo previsto para un conjunto de proyectos (sin tamaño conocido -> tamaño medio) """
+    agg = projects.aggregate(n=Count('id'), sized=Count('size'), total_size=Sum('size'))
+    total_size = (agg['total_size'] or 0) + (agg['n'] - agg['sized']) * default_size
+    return a * agg['n'] + b * total_size
+
+def merge_stage_stats(chunk_stats: list) -> dict:
+    stages = {}
+    for stats in chunk_stats:
+        for name, stage in stats.items():
+            total = stages.setdefault(name, {'workers': 0, 'queue_depth': 0, 'processed': 0, 'throughput': 0.0})
+            for key in total:
+                total[key] += stage.get(key, 0)
+    for stage in stages.values():
+        stage['throughput'] = round(stage['throughput'], 3)
+    return stages
+
+def batch_progress(job) -> dict:
+    """
+    Estado de un lote en curso: proyectos hechos, fallidos y pendientes,
+    rendimiento por etapa y ETA estimada a partir del tamaño de lo que falta.
+    """
+    counts = dict(job.projects.values_list('state').annotate(n=Count('id')))
+    done, failed, pending = counts.get('done', 0), counts.get('error', 0), counts.get('pending', 0)
+
+    stats = cache.get_many([stage_stats_key(job.id, chunk) for chunk in job.chunks])
+    summaries = cache.get_many([summary_key(job.id, chunk) for chunk in job.chunks])
+    progress = {
+        'job': str(job.id),
+        'state': job.state,
+        'total': done + failed + pending,
+        'done': done,
+        'failed': failed,
+        'remaining': pending,
+        'stages': merge_stage_stats(stats.values()),
+        'summary': merge_summaries(summaries.values()).finalize() if summaries else None,
+        'csv': str(job.csv_id) if job.csv_id else None,
+        'eta_seconds': 0,
+    }
+    if job.state == 'done' or not pending:
+        return progress
+
+    a, b = fit_project_time()
+    default_size = job.projects.aggregate(avg=Avg('size'))['avg'] or 0
+    remaining = predicted_seconds(job.projects.filter(state='pending'), a, b, default_size)
+
+    # Ritmo real del lote: segundos de trabajo previstos que se completan por segundo de reloj
+    wall = (timezone.now() - job.created).total_seconds()
+    finished = predicted_seconds(job.projects.exclude(state='pending'), a, b, default_size)
+    if done + failed and wall > 0 and finished > 0:
+        rate = finished / wall
+    else:
+        rate = max(1, min(len(job.chunks), settings.BATCH_ORG_MAX_RUNNING_CHUNKS)) * settings.BATCH_ANALYZE_WORKERS
+
+    progress['eta_seconds'] = round(remaining / rate, 1)
+    return progress
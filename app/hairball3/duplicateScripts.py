@@ -1,9 +1,7 @@
 from app.hairball3.plugin import Plugin
 import logging
-import coloredlogs
 
 logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG', logger=logger)
 
 class DuplicateScripts(Plugin):
     """
@@ -2,10 +2,8 @@ import json
 from app.hairball3.plugin import Plugin
 import app.consts_drscratch as consts
 import logging
-import coloredlogs
 
 logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG', logger=logger)
 
 
 class Mastery(Plugin):
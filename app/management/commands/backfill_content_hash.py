@@ -0,0 +1,97 @@
+import ast
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.analyzer import project_content_hash
+from app.models import File
+
+
+class Command(BaseCommand):
+    help = ("Fill File.content_hash for rows analysed before the column existed, from "
+            "directories with the original project files, matched by file name. Useful "
+            "sources are the project folders or zips that were sent to batch mode (their "
+            "rows store each project's file name) and error_analyzing/. Interactive uploads "
+            "store the uploaded name, but the app kept them as uploads/<uuid>_<timestamp>.sb2 "
+            "and File.time only holds the date, so those copies cannot be matched to a row; "
+            "their rows only get a hash if the original file is supplied under its own name. "
+            "Names found in several files with different contents cannot be told apart: their "
+            "rows are left without a hash and the names are reported. "
+            "Rows are read and updated in short primary-key batches, so the table is never locked.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('projects_dirs', nargs='+', help="Directories with the original project files")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help="Seconds to wait between batches to leave room for live traffic")
+
+    def index_projects(self, projects_dir: str) -> dict:
+        """ filename -> paths of every project file with that name under projects_dir """
+        paths = {}
+        for root, dirs, files in os.walk(projects_dir):
+            for name in files:
+                paths.setdefault(name, []).append(os.path.join(root, name))
+        return paths
+
+    def name_hash(self, paths: list):
+        """ Hash of the files with one name, or None if their contents differ """
+        hashes = set()
+        for path in paths:
+            with open(path, 'rb') as f:
+                hashes.add(project_content_hash(f.read()))
+        return hashes.pop() if len(hashes) == 1 else None
+
+    def row_name(self, filename: str) -> str:
+        """
+        File name of a row. Uploads were saved with the repr of the encoded name
+        ("b'project.xml'"), which is turned back into the name.
+        """
+        if filename.startswith(("b'", 'b"')):
+            try:
+                filename = ast.literal_eval(filename).decode('utf-8', 'ignore')
+            except (ValueError, SyntaxError):
+                filename = filename[2:].rstrip(filename[1])
+        return os.path.basename(filename)
+
+    def handle(self, *args, **options):
+        paths = {}
+        for projects_dir in options['projects_dirs']:
+            for name, name_paths in self.index_projects(projects_dir).items():
+                paths.setdefault(name, []).extend(name_paths)
+        hashes = {}
+        ambiguous = set()
+        last_pk = 0
+        updated = scanned = 0
+
+        while True:
+            rows = list(File.objects.filter(pk__gt=last_pk, content_hash__isnull=True)
+                        .order_by('pk').only('pk', 'filename')[:options['batch_size']])
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+            scanned += len(rows)
+
+            changed = []
+            for row in rows:
+                name = self.row_name(row.filename)
+                if name not in paths:
+                    continue
+                if name not in hashes:
+                    hashes[name] = self.name_hash(paths[name])
+                if hashes[name] is None:
+                    ambiguous.add(name)
+                    continue
+                row.content_hash = hashes[name]
+                changed.append(row)
+
+            with transaction.atomic():
+                File.objects.bulk_update(changed, ['content_hash'])
+            updated += len(changed)
+            self.stdout.write(f"{scanned} rows scanned, {updated} hashed")
+            time.sleep(options['sleep'])
+
+        for name in sorted(ambiguous):
+            self.stdout.write(f"Skipped {name}: several files with different contents")
+        self.stdout.write(f"Done: {updated} of {scanned} rows hashed")
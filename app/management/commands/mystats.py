@@ -1,103 +1,88 @@
 from django.core.management.base import BaseCommand
-from app.models import Stats, File
+from app.models import DailyStats, Stats, File
 from app.views import date_range
-from datetime import datetime, timedelta, date
-from django.db.models import Avg
+from datetime import datetime, date
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+
+SKILLS = ['abstraction', 'parallelization', 'logic', 'synchronization', 'flowControl',
+          'userInteractivity', 'dataRepresentation']
+SMELLS = ['deadCode', 'duplicateScript', 'spriteNaming', 'initialization']
 
 
 class Command(BaseCommand):
 
+    def update_rollup(self):
+        """ Aggregate File by day into DailyStats, only from the last stored day on """
+        last_day = DailyStats.objects.aggregate(last=Max('day'))['last']
+        files = File.objects.all()
+        if last_day is not None:
+            # The last stored day may have been incomplete, so it is computed again
+            files = files.filter(time__gte=last_day)
+
+        sums = {field: Sum(field) for field in SKILLS + SMELLS}
+        days = (files.values('time')
+                .annotate(projects=Count('id'), score_sum=Sum('score'),
+                          basic=Count('id', filter=Q(score__lte=7)),
+                          development=Count('id', filter=Q(score__gt=7, score__lt=15)),
+                          master=Count('id', filter=Q(score__gte=15)),
+                          **sums)
+                .order_by('time'))
+
+        rows = [
+            DailyStats(day=row['time'], projects=row['projects'], score=row['score_sum'] or 0,
+                       basic=row['basic'], development=row['development'], master=row['master'],
+                       **{field: row[field] or 0 for field in SKILLS + SMELLS})
+            for row in days
+        ]
+        with transaction.atomic():
+            if last_day is not None:
+                DailyStats.objects.filter(day__gte=last_day).delete()
+            DailyStats.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+
     def handle(self, *args, **options):
         """ Initializing variables """
-        daily_rate = []
-        daily_projects = []
-        point_list = []
         start = date(2015,8,1)
-        end = datetime.today()
-        y = end.year
-        m = end.month
-        d = end.day
-        end = date(y,m,d)
+        end = datetime.today().date()
         dateList = date_range(start, end)
 
+        """ Daily rollup: one GROUP BY over the new days only """
+        new_days = self.update_rollup()
+
         """ Recolect data for daily_rate & daily_projects """
+        by_day = {}
+        totals = {field: 0 for field in ['projects', 'score', 'basic', 'development', 'master'] + SKILLS + SMELLS}
+        for day in DailyStats.objects.all().iterator():
+            by_day[day.day] = day
+            for field in totals:
+                totals[field] += getattr(day, field)
 
+        daily_rate = []
+        daily_projects = []
         for n in dateList:
-            #mydates.append(n.strftime("%d/%m")) #used for x axis in stats
-            files = File.objects.filter(time=n)
-            daily_rate.append(files.aggregate(Avg("score"))["score__avg"])
-            for k in daily_rate:
-                if k == None:
-                    daily_rate[daily_rate.index(k)]= 0
-
-            for i in files:
-                #mastery_list.append(i.score)
-                point_list.append(i.score)
-            daily_projects.append(len(files))
+            day = by_day.get(n)
+            daily_rate.append(day.score / day.projects if day and day.projects else 0)
+            daily_projects.append(day.projects if day else 0)
+
         """ Stats by CT level """
+        totalProjects = totals['projects'] or 1
+        basic = totals['basic']*100/totalProjects
+        development = totals['development']*100/totalProjects
+        master = totals['master']*100/totalProjects
+
+        """ Average score by programming skill and by code smell, from the same rollup """
+        averages = {field: int(totals[field] / totalProjects) for field in SKILLS + SMELLS}
 
-        master = 0
-        development = 0
-        basic = 0
-
-        totalProjects = File.objects.count()
-        for i in point_list:
-            if i >= 15:
-                master = master + 1
-            elif i > 7:
-                development = development + 1
-            else:
-                basic = basic + 1
-        basic = basic*100/totalProjects
-        development=development*100/totalProjects
-        master=master*100/totalProjects
-        """This section calculates the average score by programming skill """
-
-        parallelism = File.objects.all().aggregate(Avg("parallelization"))
-        parallelism = int(parallelism["parallelization__avg"])
-        abstraction = File.objects.all().aggregate(Avg("abstraction"))
-        abstraction = int(abstraction["abstraction__avg"])
-        logic = File.objects.all().aggregate(Avg("logic"))
-        logic = int(logic["logic__avg"])
-        synchronization = File.objects.all().aggregate(Avg("synchronization"))
-        synchronization = int(synchronization["synchronization__avg"])
-        flowControl = File.objects.all().aggregate(Avg("flowControl"))
-        flowControl = int(flowControl["flowControl__avg"])
-        userInteractivity = File.objects.all().aggregate(Avg("userInteractivity"))
-        userInteractivity = int(userInteractivity["userInteractivity__avg"])
-        dataRepresentation = File.objects.all().aggregate(Avg("dataRepresentation"))
-        dataRepresentation = int(dataRepresentation["dataRepresentation__avg"])
-
-        """This section calculates the average score by code smell"""
-        deadCode = File.objects.all().aggregate(Avg("deadCode"))
-        deadCode = int(deadCode["deadCode__avg"])
-        duplicateScript = File.objects.all().aggregate(Avg("duplicateScript"))
-        duplicateScript = int(duplicateScript["duplicateScript__avg"])
-        spriteNaming = File.objects.all().aggregate(Avg("spriteNaming"))
-        spriteNaming = int(spriteNaming["spriteNaming__avg"])
-        initialization = File.objects.all().aggregate(Avg("initialization"))
-        initialization = int(initialization["initialization__avg"])
-
-        """This section calculates the average score by code smell"""
-
-        self.stdout.write("Doing all the stats!")
+        self.stdout.write(f"Doing all the stats! ({new_days} days aggregated)")
 
         stats_today = Stats(daily_score=daily_rate,
-                            basic= basic,
-                            development = development,
-                            master = master,
+                            basic=basic,
+                            development=development,
+                            master=master,
                             daily_projects=daily_projects,
-                            parallelism=parallelism,
-                            abstraction = abstraction,
-                            logic = logic,
-                            synchronization = synchronization,
-                            flowControl = flowControl,
-                            userInteractivity = userInteractivity,
-                            dataRepresentation = dataRepresentation,
-                            deadCode = deadCode,
-                            duplicateScript = duplicateScript,
-                            spriteNaming = spriteNaming,
-                            initialization = initialization
+                            **averages
                             )
 
         stats_today.save()
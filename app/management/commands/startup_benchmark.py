@@ -0,0 +1,67 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What each kind of process imports before it can serve its first request or task
+TARGETS = {
+    'wsgi': "import drScratch.wsgi",
+    'asgi': "import drScratch.asgi",
+    'celery': "from drScratch.celery import app; app.loader.import_default_modules()",
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure the cold import time of the web entry points (drScratch.wsgi, "
+            "drScratch.asgi) and of the Celery app with its task modules. Every run uses "
+            "a fresh interpreter, so nothing is shared with this process. The slowest "
+            "packages are taken from python -X importtime.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', help=f"Entry points to measure: {', '.join(TARGETS)} (default: all)")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per target; the median is reported")
+        parser.add_argument('--top', type=int, default=10, help="Slowest packages to list per target")
+
+    def run_python(self, code: str):
+        """ (wall seconds, -X importtime report) of `code` in a new interpreter """
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'drScratch.settings'))
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=settings.BASE_DIR,
+                                 env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise CommandError(f"'{code}' failed:\n{process.stderr[-2000:]}")
+        return elapsed, process.stderr
+
+    def slowest_packages(self, report: str) -> list:
+        """ Self import time (ms) summed per top-level package, slowest first """
+        packages = defaultdict(float)
+        for line in report.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(self_us) / 1000
+        return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+    def handle(self, *args, **options):
+        targets = options['targets'] or list(TARGETS)
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"Unknown targets: {', '.join(sorted(unknown))}")
+        repeat = max(1, options['repeat'])
+        interpreter = statistics.median(self.run_python('pass')[0] for _ in range(repeat))
+        self.stdout.write(f"Interpreter startup: {interpreter * 1000:.0f} ms (subtracted below)")
+
+        for target in targets:
+            runs = [self.run_python(TARGETS[target]) for _ in range(repeat)]
+            times = sorted(elapsed - interpreter for elapsed, _ in runs)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"\n{target}: median {statistics.median(times) * 1000:.0f} ms, "
+                f"min {times[0] * 1000:.0f} ms, max {times[-1] * 1000:.0f} ms ({repeat} runs)"))
+            for package, ms in self.slowest_packages(runs[-1][1])[:options['top']]:
+                self.stdout.write(f"  {ms:8.1f} ms  {package}")
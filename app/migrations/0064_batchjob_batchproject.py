@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-19 15:25
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0063_featuresuggestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('state', models.CharField(default='running', max_length=20)),
+                ('sources', models.JSONField(default=list)),
+                ('folder_path', models.CharField(max_length=255)),
+                ('batch_path', models.CharField(blank=True, default='', max_length=255)),
+                ('created', models.DateTimeField(default=datetime.datetime.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('csv', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.batchcsv')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BatchProject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('state', models.CharField(default='pending', max_length=20)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='projects', to='app.batchjob')),
+            ],
+            options={
+                'unique_together': {('job', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-19 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0064_batchjob_batchproject'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='chunks',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='batchproject',
+            name='blocks',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batchproject',
+            name='elapsed',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batchproject',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-19 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0065_batch_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchcsv',
+            name='dedup_ratio',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batchproject',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='batchproject',
+            index=models.Index(fields=['job', 'content_hash'], name='app_batchpr_job_id_b5f0da_idx'),
+        ),
+    ]
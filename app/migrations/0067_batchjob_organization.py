@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0066_batch_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='organization',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+    ]
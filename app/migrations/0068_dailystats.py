@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0067_batchjob_organization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('projects', models.IntegerField(default=0)),
+                ('score', models.BigIntegerField(default=0)),
+                ('basic', models.IntegerField(default=0)),
+                ('development', models.IntegerField(default=0)),
+                ('master', models.IntegerField(default=0)),
+                ('abstraction', models.BigIntegerField(default=0)),
+                ('parallelization', models.BigIntegerField(default=0)),
+                ('logic', models.BigIntegerField(default=0)),
+                ('synchronization', models.BigIntegerField(default=0)),
+                ('flowControl', models.BigIntegerField(default=0)),
+                ('userInteractivity', models.BigIntegerField(default=0)),
+                ('dataRepresentation', models.BigIntegerField(default=0)),
+                ('deadCode', models.BigIntegerField(default=0)),
+                ('duplicateScript', models.BigIntegerField(default=0)),
+                ('spriteNaming', models.BigIntegerField(default=0)),
+                ('initialization', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
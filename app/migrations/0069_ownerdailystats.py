@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-19 16:20
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+FIELDS = ['score', 'abstraction', 'parallelization', 'logic', 'synchronization',
+          'flowControl', 'userInteractivity', 'dataRepresentation']
+
+
+def backfill_owner_stats(apps, schema_editor):
+    File = apps.get_model('app', 'File')
+    OwnerDailyStats = apps.get_model('app', 'OwnerDailyStats')
+    totals = {}
+    for owner_field in ('organization', 'coder'):
+        rows = (File.objects.exclude(**{owner_field: 'drscratch'})
+                .values(owner_field, 'time')
+                .annotate(projects=Count('id'), **{f'{field}_sum': Sum(field) for field in FIELDS}))
+        for row in rows:
+            key = (row[owner_field], row['time'])
+            current = totals.setdefault(key, {'projects': 0, **{field: 0 for field in FIELDS}})
+            current['projects'] += row['projects']
+            for field in FIELDS:
+                current[field] += row[f'{field}_sum'] or 0
+    OwnerDailyStats.objects.bulk_create(
+        [OwnerDailyStats(owner=owner, day=day, **values) for (owner, day), values in totals.items() if owner],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0068_dailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('projects', models.IntegerField(default=0)),
+                ('score', models.BigIntegerField(default=0)),
+                ('abstraction', models.BigIntegerField(default=0)),
+                ('parallelization', models.BigIntegerField(default=0)),
+                ('logic', models.BigIntegerField(default=0)),
+                ('synchronization', models.BigIntegerField(default=0)),
+                ('flowControl', models.BigIntegerField(default=0)),
+                ('userInteractivity', models.BigIntegerField(default=0)),
+                ('dataRepresentation', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('owner', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_owner_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0070_file_indexes_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='request_data',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='batchjob',
+            name='skill_points',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='batchjob',
+            name='inflight',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batchjob',
+            name='cursor',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0071_batchjob_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='retries',
+            field=models.IntegerField(default=0),
+        ),
+    ]
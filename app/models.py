@@ -24,6 +24,16 @@ class File(models.Model):
     initialization = models.IntegerField()
     deadCode = models.IntegerField()
     duplicateScript = models.IntegerField()
+    # SHA-256 del contenido del proyecto analizado (None en filas antiguas sin contenido)
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization', 'time']),
+            models.Index(fields=['coder', 'time']),
+            models.Index(fields=['time']),
+            models.Index(fields=['content_hash']),
+        ]
 
 class BatchCSV(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -51,8 +61,43 @@ class BatchCSV(models.Model):
     max_motion_operators = models.FloatField()
     motion_operators = models.FloatField()
     mastery = models.CharField(max_length=50)
+    dedup_ratio = models.FloatField(default=0)
     date = models.DateTimeField(default=datetime.datetime.now)
 
+class BatchJob(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    state = models.CharField(max_length=20, default='running')
+    sources = models.JSONField(default=list)
+    folder_path = models.CharField(max_length=255)
+    batch_path = models.CharField(max_length=255, blank=True, default='')
+    chunks = models.JSONField(default=list)
+    organization = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    request_data = models.JSONField(default=dict)
+    skill_points = models.JSONField(default=dict)
+    # Dispatch state: chunk tasks in flight, first project index not yet dispatched and
+    # times the projects of failed chunks were dispatched again
+    inflight = models.IntegerField(default=0)
+    cursor = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    csv = models.ForeignKey(BatchCSV, null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(default=datetime.datetime.now)
+    finished = models.DateTimeField(null=True, blank=True)
+
+
+class BatchProject(models.Model):
+    job = models.ForeignKey(BatchJob, related_name='projects', on_delete=models.CASCADE)
+    index = models.IntegerField()
+    state = models.CharField(max_length=20, default='pending')
+    result = models.JSONField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    blocks = models.IntegerField(null=True, blank=True)
+    elapsed = models.FloatField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        unique_together = ('job', 'index')
+        indexes = [models.Index(fields=['job', 'content_hash'])]
+
 class CSVs(models.Model):
     filename = models.CharField(max_length=100)
     directory = models.CharField(max_length=100)
@@ -115,6 +160,50 @@ class Stats(models.Model):
     initialization = models.IntegerField(default=int(0))
 
 
+class DailyStats(models.Model):
+    """
+    Rollup diario de la tabla File (sumas, no medias, para poder combinar días).
+    """
+    day = models.DateField(unique=True)
+    projects = models.IntegerField(default=0)
+    score = models.BigIntegerField(default=0)
+    basic = models.IntegerField(default=0)
+    development = models.IntegerField(default=0)
+    master = models.IntegerField(default=0)
+    abstraction = models.BigIntegerField(default=0)
+    parallelization = models.BigIntegerField(default=0)
+    logic = models.BigIntegerField(default=0)
+    synchronization = models.BigIntegerField(default=0)
+    flowControl = models.BigIntegerField(default=0)
+    userInteractivity = models.BigIntegerField(default=0)
+    dataRepresentation = models.BigIntegerField(default=0)
+    deadCode = models.BigIntegerField(default=0)
+    duplicateScript = models.BigIntegerField(default=0)
+    spriteNaming = models.BigIntegerField(default=0)
+    initialization = models.BigIntegerField(default=0)
+
+
+class OwnerDailyStats(models.Model):
+    """
+    Agregados diarios de los análisis de cada organización o coder; se actualizan
+    al guardar cada fila File (página de estadísticas del usuario).
+    """
+    owner = models.CharField(max_length=100)
+    day = models.DateField()
+    projects = models.IntegerField(default=0)
+    score = models.BigIntegerField(default=0)
+    abstraction = models.BigIntegerField(default=0)
+    parallelization = models.BigIntegerField(default=0)
+    logic = models.BigIntegerField(default=0)
+    synchronization = models.BigIntegerField(default=0)
+    flowControl = models.BigIntegerField(default=0)
+    userInteractivity = models.BigIntegerField(default=0)
+    dataRepresentation = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner', 'day')
+
+
 class Student(models.Model):
     #student = models.ForeignKey(User, unique=True)
     student = models.OneToOneField(User, on_delete=models.CASCADE)
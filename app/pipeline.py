@@ -0,0 +1,393 @@
+import hashlib
+import itertools
+import os
+import queue
+import threading
+import time
+import logging
+from collections import OrderedDict
+from zipfile import ZipFile
+
+from django.conf import settings
+from django.db import connection
+
+from app.analyzer import FileBuffer, analysis_by_parsed_project, return_scratch_project_identifier, split_xml
+from app.exception import DrScratchException
+from app.sandbox import LIMIT_ERRORS, get_analysis_pool, save_failed_project
+from app.scratchclient import get_snap_client
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# 1. PIPELINE GENÉRICO POR ETAPAS
+# ==============================================================================
+
+class Stage:
+    """
+    Etapa del pipeline: una función aplicada por 'workers' hilos a cada elemento.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = None
+        self.processed = 0
+        self.busy_time = 0.0
+        self._alive = self.workers
+        self._lock = threading.Lock()
+
+
+class Pipeline:
+    """
+    Pipeline con colas acotadas entre etapas. Cada etapa tiene sus propios hilos,
+    así el rendimiento lo limita la etapa más lenta y no la suma de todas.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages, queue_size=None, on_error=None, on_stats=None, stats_interval=5):
+        self.stages = stages
+        self.queue_size = queue_size or settings.BATCH_QUEUE_SIZE
+        self.on_error = on_error
+        self.on_stats = on_stats
+        self.stats_interval = stats_interval
+        self.started = None
+        self._cancelled = threading.Event()
+
+    def _put(self, q, item):
+        while not self._cancelled.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while not self._cancelled.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return self._DONE
+
+    def _feed(self, items, first_queue):
+        try:
+            for item in items:
+                if self._cancelled.is_set():
+                    break
+                self._put(first_queue, item)
+        except Exception as e:
+            logger.error(f"Error reading pipeline input: {e}")
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._put(first_queue, self._DONE)
+
+    def _work(self, stage, in_queue, out_queue, next_workers):
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is self._DONE:
+                    break
+
+                begin = time.monotonic()
+                try:
+                    item = stage.func(item)
+                except Exception as e:
+                    item = self.on_error(stage, item, e) if self.on_error else None
+                    if item is None:
+                        logger.error(f"Pipeline stage '{stage.name}' dropped an item: {e}")
+                with stage._lock:
+                    stage.processed += 1
+                    stage.busy_time += time.monotonic() - begin
+
+                if item is not None:
+                    self._put(out_queue, item)
+        finally:
+            # Cada hilo usa su propia conexión a la BD
+            connection.close()
+            with stage._lock:
+                stage._alive -= 1
+                last = stage._alive == 0
+            if last:
+                for _ in range(next_workers):
+                    self._put(out_queue, self._DONE)
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-6) if self.started else 1e-6
+        return {
+            stage.name: {
+                'workers': stage.workers,
+                'queue_depth': stage.queue.qsize() if stage.queue else 0,
+                'processed': stage.processed,
+                'throughput': round(stage.processed / elapsed, 3),
+                'busy_time': round(stage.busy_time, 3),
+            }
+            for stage in self.stages
+        }
+
+    def run(self, items):
+        """
+        Genera la salida de la última etapa según va terminando cada elemento.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        for stage, q in zip(self.stages, queues):
+            stage.queue = q
+
+        self.started = time.monotonic()
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], queues[i + 1], next_workers), daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = queues[-1].get(timeout=0.5)
+                except queue.Empty:
+                    item = None
+                if item is self._DONE:
+                    break
+                if item is not None:
+                    yield item
+
+                if self.on_stats and time.monotonic() - last_report >= self.stats_interval:
+                    self.on_stats(self.stats())
+                    last_report = time.monotonic()
+        finally:
+            self._cancelled.set()
+            for thread in threads:
+                thread.join()
+            if self.on_stats:
+                self.on_stats(self.stats())
+
+# ==============================================================================
+# 2. PIPELINE DEL MODO BATCH: fetch → parse → analyse → persist
+# ==============================================================================
+
+class BatchItem:
+
+    def __init__(self, index, source):
+        self.index = index
+        self.source = source
+        self.url = source.get('url')
+        self.origin = source.get('origin', self.url)
+        self.filename = source.get('filename') or self.url or os.path.basename(source.get('path', ''))
+        self.content = None
+        self.project = None
+        self.result = None
+        self.size = None
+        self.elapsed = 0.0
+        self.content_hash = None
+        self.duplicate_of = None
+
+    @property
+    def pending(self) -> bool:
+        """ Hay que parsearlo y analizarlo (no es un duplicado ni tiene ya resultado) """
+        return self.result is None and self.duplicate_of is None
+
+
+class BatchPipeline:
+    """
+    Analiza un lote (o un trozo de un lote) solapando descargas, parseo,
+    análisis y guardado de resultados. Los proyectos con el mismo contenido
+    (mismo hash) se analizan una sola vez y el resultado se copia a cada fila.
+    """
+
+    def __init__(self, request, skill_points: dict, persist=None, on_stats=None, lookup=None):
+        self.request = request
+        self.skill_points = skill_points
+        self.dashboard_mode = request.POST.get('dashboard_mode', 'Default')
+        # Con aislamiento cada proyecto se parsea y analiza en un proceso hijo con límites
+        self.isolated = settings.BATCH_ISOLATION
+        self.request_data = self._request_data(request) if self.isolated else None
+        self.results = {}
+        self.persist = persist or self._collect
+        # lookup(hash) -> resultado ya guardado fuera de este pipeline (p. ej. otra subtarea del lote)
+        self.lookup = lookup
+        self.analysed = OrderedDict()   # hash -> resultado (LRU acotado)
+        self.inflight = {}              # hash -> índice del proyecto que se está analizando
+        self.waiting = {}               # hash -> duplicados esperando a ese análisis
+        self._dedup_lock = threading.Lock()
+        # Filas File del lote: se insertan en bloque en lugar de una por proyecto
+        self.files = FileBuffer(settings.BATCH_DB_BUFFER)
+        self.pipeline = Pipeline([
+            Stage('fetch', self.fetch, settings.BATCH_FETCH_WORKERS),
+            Stage('parse', self.parse, settings.BATCH_PARSE_WORKERS),
+            Stage('analyse', self.analyse, settings.BATCH_ANALYZE_WORKERS),
+            Stage('persist', self.save, 1),
+        ], on_error=self.on_error, on_stats=on_stats)
+
+    def _collect(self, index, result):
+        self.results[index] = result
+
+    @staticmethod
+    def _request_data(request) -> dict:
+        """ Lo que el análisis necesita de la petición, serializable para el proceso hijo """
+        user = getattr(request, 'user', None)
+        return {
+            'POST': dict(request.POST.items()),
+            'LANGUAGE_CODE': request.LANGUAGE_CODE,
+            'user': {
+                'is_authenticated': bool(getattr(user, 'is_authenticated', False)),
+                'username': getattr(user, 'username', None),
+            },
+        }
+
+    def fetch(self, item):
+        source = item.source
+        if source.get('Error'):
+            item.result = {'Error': source['Error'], 'mastery': {'points': 0}}
+        elif item.url:
+            info_project = return_scratch_project_identifier(item.url)
+            if info_project['platform'] == 'error':
+                item.result = {'Error': 'id_error'}
+            else:
+                item.content = get_snap_client().get_project_xml(info_project['username'], info_project['projectname'])
+        elif 'member' in source:
+            with ZipFile(source['zip'], 'r') as zip_file:
+                item.content = zip_file.read(source['member'])
+        elif 'path' in source:
+            with open(source['path'], 'rb') as f:
+                item.content = f.read()
+        else:
+            item.content = source.get('content')
+        if item.content is not None:
+            data = item.content if isinstance(item.content, bytes) else item.content.encode('utf-8')
+            item.size = len(data)
+            item.content_hash = hashlib.sha256(data).hexdigest()
+            self.dedup(item)
+        return item
+
+    def dedup(self, item):
+        """
+        Decide si el proyecto se analiza o reutiliza el resultado de otro con el mismo contenido.
+        """
+        with self._dedup_lock:
+            cached = self.analysed.get(item.content_hash)
+            if cached is not None:
+                self.analysed.move_to_end(item.content_hash)
+                item.result = dict(cached, duplicate=True)
+            elif item.content_hash in self.inflight:
+                item.duplicate_of = self.inflight[item.content_hash]
+            else:
+                self.inflight[item.content_hash] = item.index
+
+        if item.pending and self.lookup:
+            previous = self.lookup(item.content_hash)
+            if previous is not None:
+                item.result = dict(previous, duplicate=True)
+
+        if not item.pending:
+            item.content = None
+
+    def parse(self, item):
+        if item.pending and not self.isolated:
+            begin = time.monotonic()
+            content = item.content
+            if isinstance(content, bytes):
+                content = content.decode('utf-8', errors='replace')
+            item.project = split_xml(self.request, content)
+            item.elapsed += time.monotonic() - begin
+        return item
+
+    def analyse(self, item):
+        if item.pending and self.isolated:
+            begin = time.monotonic()
+            item.result, files = get_analysis_pool().analyse(
+                self.request_data, self.skill_points, item.content, item.filename, item.url, item.content_hash
+            )
+            item.elapsed += time.monotonic() - begin
+            for file_obj in files:
+                self.files.add(file_obj)
+            if item.result.get('Error') in LIMIT_ERRORS:
+                path = save_failed_project(item.filename, item.content)
+                logger.warning(f"Batch project {item.filename} exceeded limits ({item.result['Error']}), saved in {path}")
+        elif item.pending:
+            begin = time.monotonic()
+            item.result = analysis_by_parsed_project(
+                self.request, self.skill_points, item.project, item.filename, item.url, self.files,
+                item.content_hash
+            )
+            item.elapsed += time.monotonic() - begin
+        # Liberar memoria en cuanto el proyecto está analizado
+        item.content = None
+        item.project = None
+        return item
+
+    def save(self, item):
+        if item.result is None:
+            # Duplicado cuyo original aún no ha terminado: se guarda cuando termine
+            with self._dedup_lock:
+                cached = self.analysed.get(item.content_hash)
+                if cached is None:
+                    self.waiting.setdefault(item.content_hash, []).append(item)
+                    return item
+            item.result = dict(cached, duplicate=True)
+
+        try:
+            self._persist(item)
+        finally:
+            if item.content_hash and self.inflight.get(item.content_hash) == item.index:
+                self._release(item)
+        return item
+
+    def _persist(self, item):
+        item.result.update({
+            'url': item.origin,
+            'filename': item.filename,
+            'dashboard_mode': self.dashboard_mode,
+            # Tamaño y tiempo de CPU (parseo + análisis) para estimar la ETA de otros lotes
+            'size': item.size,
+            'elapsed': round(item.elapsed, 4) if item.elapsed else None,
+            'content_hash': item.content_hash,
+        })
+        self.persist(item.index, item.result)
+
+    def _release(self, item):
+        """ El original ya está guardado: se guardan sus duplicados en espera """
+        with self._dedup_lock:
+            del self.inflight[item.content_hash]
+            self.analysed[item.content_hash] = item.result
+            while len(self.analysed) > settings.BATCH_DEDUP_CACHE:
+                self.analysed.popitem(last=False)
+            waiting = self.waiting.pop(item.content_hash, [])
+        for duplicate in waiting:
+            duplicate.result = dict(item.result, duplicate=True)
+            self._persist(duplicate)
+
+    def on_error(self, stage, item, error):
+        logger.error(f"Batch {stage.name} error on {item.filename}: {error}")
+        if stage.name == 'persist':
+            return None
+        item.result = {'Error': 'critical_error' if isinstance(error, DrScratchException) else 'analyzing'}
+        item.content = None
+        item.project = None
+        return item
+
+    def run(self, sources, start: int = 0, indices=None) -> dict:
+        """
+        Los índices son consecutivos desde 'start' salvo que se indiquen
+        explícitamente (p. ej. al reanudar un lote con huecos).
+        """
+        indices = indices if indices is not None else itertools.count(start)
+        items = (BatchItem(index, source) for index, source in zip(indices, sources))
+        try:
+            for _ in self.pipeline.run(items):
+                pass
+        finally:
+            self.files.flush()
+
+        # Duplicados cuyo original no llegó a guardarse
+        for duplicate in itertools.chain.from_iterable(self.waiting.values()):
+            duplicate.result = {'Error': 'analyzing'}
+            self._persist(duplicate)
+        self.waiting.clear()
+        logger.info(f"Batch pipeline stages: {self.pipeline.stats()}")
+        return dict(sorted(self.results.items()))
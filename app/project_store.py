@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# 1. LECTURA DE SUBIDAS
+# ==============================================================================
+
+def read_upload(upload) -> bytes:
+    """
+    Contenido de un fichero subido sin copiarlo a uploads/. Las subidas grandes
+    que Django ya dejó en un fichero temporal se leen de él de una vez. La subida
+    queda rebobinada para quien la lea después (p. ej. la validación del tipo).
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        with open(upload.temporary_file_path(), 'rb') as f:
+            return f.read()
+    upload.seek(0)
+    content = upload.read()
+    upload.seek(0)
+    return content
+
+# ==============================================================================
+# 2. ALMACÉN DIRECCIONADO POR CONTENIDO
+# ==============================================================================
+
+def store_dir() -> str:
+    return settings.PROJECT_STORE_DIR
+
+
+def project_path(content_hash: str) -> str:
+    """ Ruta de un proyecto en el almacén: <dir>/<2 primeros>/<sha256>.xml """
+    return os.path.join(store_dir(), content_hash[:2], content_hash + '.xml')
+
+
+def store_project(content: bytes, content_hash: str = None) -> str:
+    """
+    Guarda una copia del proyecto (solo cuando debe persistir, p. ej. para la
+    comparación) y devuelve su ruta. Si ya estaba, solo se renueva su fecha.
+    """
+    content_hash = content_hash or hashlib.sha256(content).hexdigest()
+    path = project_path(content_hash)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escritura atómica: otro proceso nunca ve el fichero a medias
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    maybe_evict()
+    return path
+
+
+def load_stored_project(path: str) -> str:
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+# ==============================================================================
+# 3. DESALOJO POR TAMAÑO Y ANTIGÜEDAD
+# ==============================================================================
+
+_last_eviction = 0.0
+_eviction_lock = threading.Lock()
+
+
+def stored_entries(folder: str, suffix: str) -> list:
+    """ (mtime, tamaño, ruta) de los ficheros de folder que acaban en suffix """
+    entries = []
+    for entry in os.scandir(folder):
+        if not entry.is_file() or not entry.name.endswith(suffix):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def stored_projects() -> list:
+    """
+    (mtime, tamaño, ruta) de cada proyecto del almacén, y de las copias antiguas
+    uploads/<uuid>_<fecha>.sb2 que se guardaban antes de él, que caducan igual
+    """
+    root = store_dir()
+    if not os.path.isdir(root):
+        return []
+    entries = stored_entries(root, '.sb2')
+    for folder in os.scandir(root):
+        # Solo las carpetas del almacén (<2 hex>); el README, batch_mode/ y demás no se tocan
+        if folder.is_dir() and len(folder.name) == 2:
+            entries.extend(stored_entries(folder.path, '.xml'))
+    return entries
+
+
+def evict_projects(now: float = None) -> int:
+    """
+    Borra los proyectos más antiguos que PROJECT_STORE_MAX_AGE y, si aún se pasa
+    de PROJECT_STORE_MAX_MB, los menos usados recientemente. Devuelve cuántos borró.
+    """
+    now = now or time.time()
+    max_age = settings.PROJECT_STORE_MAX_AGE
+    max_bytes = settings.PROJECT_STORE_MAX_MB * 1024 * 1024
+
+    entries = sorted(stored_projects())
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    if removed:
+        logger.info(f"Project store: {removed} projects evicted ({total} bytes left)")
+    return removed
+
+
+def maybe_evict() -> None:
+    """ Desalojo como mucho cada PROJECT_STORE_EVICT_INTERVAL segundos por proceso """
+    global _last_eviction
+    now = time.time()
+    with _eviction_lock:
+        if now - _last_eviction < settings.PROJECT_STORE_EVICT_INTERVAL:
+            return
+        _last_eviction = now
+    try:
+        evict_projects(now)
+    except OSError as e:
+        logger.error(f"Project store eviction failed: {e}")
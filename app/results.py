@@ -0,0 +1,86 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+# Resultados, permalinks y proyectos parseados van a su propia caché (alias 'analysis'),
+# que puede desalojar por LRU sin tocar los resultados de Celery ni el progreso de lotes
+cache = ConnectionProxy(caches, 'analysis')
+
+# ==============================================================================
+# ALMACÉN DE RESULTADOS DE ANÁLISIS
+# ==============================================================================
+
+RESULT_PREFIX = 'analysis-result:'
+
+
+def save_result(result: dict, key: str = None) -> str:
+    """
+    Guarda un resultado de análisis en la caché compartida y devuelve su clave;
+    la sesión solo guarda esa clave, no el resultado entero.
+    """
+    key = key or uuid.uuid4().hex
+    cache.set(RESULT_PREFIX + key, result, settings.ANALYSIS_RESULT_TTL)
+    return key
+
+
+def load_result(key: str):
+    """ Resultado guardado con save_result, o None si no existe o ha caducado """
+    if not key:
+        return None
+    return cache.get(RESULT_PREFIX + key)
+
+
+def result_exists(key: str) -> bool:
+    """ Si el resultado sigue guardado, sin traerlo del almacén """
+    return bool(key) and cache.has_key(RESULT_PREFIX + key)
+
+
+# ==============================================================================
+# PERMALINKS: RESULTADOS POR CONTENIDO, RÚBRICA Y MODO
+# ==============================================================================
+
+def rubric_code(skill_points: dict) -> str:
+    """ Rúbrica como cadena de dígitos (mismo orden que generate_rubric) """
+    return ''.join(str(points) for points in skill_points.values())
+
+
+def permalink_key(content_hash: str, rubric: str, mode: str) -> str:
+    return f'{content_hash}:{rubric}:{mode}'
+
+
+def permalink_etag(content_hash: str, rubric: str, mode: str, language: str) -> str:
+    """
+    El resultado solo depende del contenido, la rúbrica y el modo; el HTML además del idioma.
+    """
+    return hashlib.sha256(f'{permalink_key(content_hash, rubric, mode)}:{language}'.encode()).hexdigest()[:32]
+
+
+
+# ==============================================================================
+# CACHÉ POR PROYECTO: RESULTADO Y PROYECTO PARSEADO
+# ==============================================================================
+
+PARSED_PREFIX = 'parsed-project:'
+
+
+def project_result_key(content_hash: str, rubric: str, mode: str, language: str) -> str:
+    """ Resultado de un proyecto para una rúbrica y modo; las claves de mastery van traducidas """
+    return f'project:{content_hash}:{rubric}:{mode}:{language}'
+
+
+def save_parsed(content_hash: str, project: dict) -> None:
+    """
+    Proyecto ya parseado por split_xml, por contenido (no depende de rúbrica ni idioma).
+    Ocupa mucho más que un resultado, así que caduca antes (ANALYSIS_PARSED_TTL).
+    """
+    if content_hash and project:
+        cache.set(PARSED_PREFIX + content_hash, project, settings.ANALYSIS_PARSED_TTL)
+
+
+def load_parsed(content_hash: str):
+    if not content_hash:
+        return None
+    return cache.get(PARSED_PREFIX + content_hash)
@@ -0,0 +1,192 @@
+import os
+import signal
+import threading
+import time
+import uuid
+import _thread
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+
+from billiard.einfo import ExceptionWithTraceback
+from billiard.exceptions import TimeLimitExceeded, WorkerLostError
+from billiard.pool import Pool
+from django.conf import settings
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+# Errores de los proyectos que superan algún límite (se guardan como fila de error)
+LIMIT_ERRORS = ('timeout', 'too_large')
+
+# ==============================================================================
+# 1. LÍMITES DENTRO DEL PROCESO HIJO
+# ==============================================================================
+
+class ProjectLimitExceeded(BaseException):
+    """
+    Hereda de BaseException para que los 'except Exception' del analizador no la oculten.
+    """
+
+
+# Tarea en curso en este hijo: límites y motivo si se ha superado alguno
+_task = {'active': False, 'cpu_start': 0.0, 'reason': None}
+
+
+def current_rss() -> int:
+    """ Memoria residente actual del proceso, en bytes """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _on_limit(signum, frame):
+    if _task['active']:
+        _task['active'] = False
+        raise ProjectLimitExceeded(_task['reason'])
+
+
+def _watchdog(cpu_limit: float, max_rss: int, interval: float = 0.1):
+    """
+    Vigila el tiempo de CPU y la memoria de la tarea en curso e interrumpe el hilo
+    principal del hijo cuando se pasa de alguno.
+    """
+    while True:
+        time.sleep(interval)
+        if not _task['active']:
+            continue
+        if cpu_limit and time.process_time() - _task['cpu_start'] > cpu_limit:
+            _task['reason'] = 'timeout'
+        elif max_rss and current_rss() > max_rss:
+            _task['reason'] = 'too_large'
+        else:
+            continue
+        _thread.interrupt_main(signal.SIGXCPU)
+
+
+def _init_child(cpu_limit: float, max_rss: int):
+    # La conexión a la BD heredada del padre no se usa en el hijo: abre la suya si la necesita
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+    threading.Thread(target=_watchdog, args=(cpu_limit, max_rss), daemon=True).start()
+
+
+def analyse_isolated(request_data: dict, skill_points: dict, content, filename: str, url=None, content_hash=None):
+    """
+    Parseo y análisis de un proyecto dentro del hijo. Devuelve el resultado y las
+    filas File preparadas (el padre las guarda en bloque).
+    """
+    from app.analyzer import FileBuffer, analysis_by_parsed_project, split_xml
+
+    request = SimpleNamespace(
+        POST=request_data['POST'],
+        LANGUAGE_CODE=request_data['LANGUAGE_CODE'],
+        user=SimpleNamespace(**request_data['user']),
+        session={},
+    )
+    files = FileBuffer(1 << 30)
+    # billiard instala sus manejadores de señales después del initializer (SIGUSR1 es su
+    # límite blando), así que el del watchdog se instala al empezar cada tarea
+    signal.signal(signal.SIGXCPU, _on_limit)
+
+    _task['reason'] = None
+    _task['cpu_start'] = time.process_time()
+    _task['active'] = True
+    try:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        project = split_xml(request, content)
+        result = analysis_by_parsed_project(request, skill_points, project, filename, url, files, content_hash)
+        if _task['reason']:
+            # El límite saltó en un punto que el analizador capturó como error propio
+            return {'Error': _task['reason']}, []
+        return result, files.pending
+    except ProjectLimitExceeded as e:
+        return {'Error': str(e) or 'timeout'}, []
+    except MemoryError:
+        return {'Error': 'too_large'}, []
+    finally:
+        _task['active'] = False
+
+# ==============================================================================
+# 2. POOL DE PROCESOS (PADRE)
+# ==============================================================================
+
+class AnalysisPool:
+    """
+    Pool de procesos pre-creados para analizar proyectos de uno en uno con límites
+    de tiempo de reloj (el pool mata al hijo), CPU y memoria residente.
+    """
+
+    def __init__(self, processes=None):
+        # Los hijos no deben heredar la conexión a la BD de este hilo
+        connection.close()
+        self.timeout = settings.BATCH_PROJECT_TIMEOUT
+        self.pool = Pool(
+            processes=processes or settings.BATCH_ANALYZE_WORKERS,
+            initializer=_init_child,
+            initargs=(settings.BATCH_PROJECT_CPU_LIMIT, settings.BATCH_PROJECT_MAX_RSS_MB * 1024 * 1024),
+            maxtasksperchild=settings.BATCH_CHILD_MAX_TASKS,
+            max_memory_per_child=settings.BATCH_PROJECT_MAX_RSS_MB * 1024,
+            enable_timeouts=True,
+        )
+
+    def analyse(self, request_data: dict, skill_points: dict, content, filename: str, url=None, content_hash=None):
+        job = self.pool.apply_async(
+            analyse_isolated, (request_data, skill_points, content, filename, url, content_hash), timeout=self.timeout
+        )
+        try:
+            # Margen extra por si el hijo muere sin que el pool lo detecte
+            return job.get(timeout=self.timeout + 10)
+        except TimeLimitExceeded:
+            return {'Error': 'timeout'}, []
+        except ExceptionWithTraceback as e:
+            if isinstance(e.exc, TimeLimitExceeded):
+                return {'Error': 'timeout'}, []
+            if isinstance(e.exc, WorkerLostError):
+                logger.error(f"Analysis child lost on {filename}: {e.exc!r}")
+                return {'Error': 'too_large'}, []
+            raise e.exc
+        except Exception as e:
+            # Hijo muerto (p. ej. por el OOM killer) o sin respuesta
+            logger.error(f"Analysis child lost on {filename}: {e!r}")
+            return {'Error': 'too_large'}, []
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+_analysis_pool = None
+_analysis_pool_pid = None
+_analysis_pool_lock = threading.Lock()
+
+
+def get_analysis_pool() -> AnalysisPool:
+    """
+    Pool compartido por proceso (se crea de nuevo tras un fork).
+    """
+    global _analysis_pool, _analysis_pool_pid
+    with _analysis_pool_lock:
+        if _analysis_pool is None or _analysis_pool_pid != os.getpid():
+            _analysis_pool = AnalysisPool()
+            _analysis_pool_pid = os.getpid()
+        return _analysis_pool
+
+
+def save_failed_project(filename: str, content) -> str:
+    """
+    Copia el XML original de un proyecto que superó los límites a error_analyzing/.
+    """
+    folder = os.path.join(settings.BASE_DIR, 'error_analyzing')
+    os.makedirs(folder, exist_ok=True)
+    name = os.path.basename(str(filename or 'project')).replace(os.sep, '_')[:80]
+    path = os.path.join(folder, '{}_{}_{}'.format(datetime.now().strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex[:8], name))
+    if not path.endswith('.xml'):
+        path += '.xml'
+    with open(path, 'wb') as f:
+        f.write(content if isinstance(content, bytes) else str(content).encode('utf-8'))
+    return path
@@ -1,6 +1,18 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
 import requests
 import app.consts_drscratch as consts
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import quote, urlparse
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from lxml import etree
+from app.exception import DrScratchException
 
 
 class Project:
@@ -100,4 +112,202 @@ class ScratchSession:
             #requests.get(f'{consts.URL_SNAP_API}/{project.get("projectname")}', proxies=self.proxies).json()
         
 
-   
\ No newline at end of file
+   
+
+
+class SnapClient:
+    """
+    Cliente de la API de Snap! con un pool de conexiones compartido, límite de
+    peticiones simultáneas por host y reintentos con backoff aleatorio.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url=None, pool_size=None, max_per_host=None, retries=None, backoff=None, timeout=None):
+        self.base_url = (base_url or settings.SNAP_API_URL).rstrip('/')
+        self.pool_size = pool_size or settings.SNAP_FETCH_WORKERS
+        self.max_per_host = max_per_host or settings.SNAP_MAX_PER_HOST
+        self.retries = settings.SNAP_FETCH_RETRIES if retries is None else retries
+        self.backoff = settings.SNAP_FETCH_BACKOFF if backoff is None else backoff
+        self.timeout = timeout or settings.SNAP_FETCH_TIMEOUT
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Añadido HEADER para evitar bloqueo de Snap
+        self.session.headers.update({'User-Agent': 'DrSnap-Analyzer/1.0', 'Accept': 'application/json'})
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: evita que todos los reintentos lleguen a la vez
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, url) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                with self._host_limit(url):
+                    response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in self.RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.HTTPError as e:
+                # 4xx: el proyecto no existe o no es público, no se reintenta
+                raise DrScratchException(f"Could not download project: {e}")
+
+            if attempt < self.retries:
+                self._sleep_before_retry(attempt)
+
+        raise DrScratchException(f"Could not download project: {error}")
+
+    def get_project_xml(self, username, projectname) -> str:
+        url = f"{self.base_url}/{quote(username)}/{quote(projectname)}"
+        response = self.get(url)
+        try:
+            data = response.json()
+            if 'xml' in data: return data['xml']
+            if 'code' in data: return data['code']
+            return response.text
+        except (json.JSONDecodeError, ValueError, TypeError):
+            return response.text
+
+    def fetch_many(self, projects, max_workers=None):
+        """
+        Descarga concurrente de proyectos ({'username', 'projectname'}).
+        Genera (index, xml, error) según terminan, con como mucho
+        2 * max_workers descargas en vuelo para no acumular resultados.
+        """
+        max_workers = max_workers or self.pool_size
+        projects = iter(enumerate(projects))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+
+            def submit_next():
+                for index, project in projects:
+                    future = executor.submit(self.get_project_xml, project['username'], project['projectname'])
+                    in_flight[future] = index
+                    return True
+                return False
+
+            for _ in range(2 * max_workers):
+                if not submit_next():
+                    break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    try:
+                        yield index, future.result(), None
+                    except Exception as e:
+                        yield index, None, e
+                    submit_next()
+
+
+_snap_client = None
+_snap_client_pid = None
+_snap_client_lock = threading.Lock()
+
+
+def get_snap_client() -> SnapClient:
+    """
+    Cliente compartido por proceso. Se vuelve a crear tras un fork (workers de
+    Celery/gunicorn) para no compartir sockets entre procesos.
+    """
+    global _snap_client, _snap_client_pid
+    with _snap_client_lock:
+        if _snap_client is None or _snap_client_pid != os.getpid():
+            _snap_client = SnapClient()
+            _snap_client_pid = os.getpid()
+        return _snap_client
+
+
+class AsyncSnapClient:
+    """
+    Variante asíncrona de SnapClient para las vistas async: mientras Snap! responde
+    se libera el bucle de eventos en lugar de un worker. Mismos límites por host,
+    reintentos y backoff que la versión síncrona.
+    """
+
+    RETRY_STATUS = SnapClient.RETRY_STATUS
+
+    def __init__(self, base_url=None, pool_size=None, max_per_host=None, retries=None, backoff=None, timeout=None):
+        self.base_url = (base_url or settings.SNAP_API_URL).rstrip('/')
+        self.max_per_host = max_per_host or settings.SNAP_MAX_PER_HOST
+        self.retries = settings.SNAP_FETCH_RETRIES if retries is None else retries
+        self.backoff = settings.SNAP_FETCH_BACKOFF if backoff is None else backoff
+        self.timeout = timeout or settings.SNAP_FETCH_TIMEOUT
+
+        # httpx solo lo usan las vistas async: ni Celery ni el servicio WSGI lo cargan
+        import httpx
+        pool_size = pool_size or settings.SNAP_FETCH_WORKERS
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={'User-Agent': 'DrSnap-Analyzer/1.0', 'Accept': 'application/json'},
+            # Como requests en el cliente síncrono: Snap! puede redirigir a la URL canónica
+            follow_redirects=True,
+        )
+        self._host_limits = {}
+
+    def _host_limit(self, url) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host]
+
+    async def get(self, url):
+        import httpx
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._host_limit(url):
+                    response = await self.client.get(url)
+                if response.status_code not in self.RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = f"{response.status_code} for {url}"
+            except httpx.TransportError as e:
+                error = e
+            except httpx.HTTPStatusError as e:
+                # 4xx: el proyecto no existe o no es público, no se reintenta
+                raise DrScratchException(f"Could not download project: {e}")
+
+            if attempt < self.retries:
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+        raise DrScratchException(f"Could not download project: {error}")
+
+    async def get_project_xml(self, username, projectname) -> str:
+        url = f"{self.base_url}/{quote(username)}/{quote(projectname)}"
+        response = await self.get(url)
+        try:
+            data = response.json()
+            if 'xml' in data: return data['xml']
+            if 'code' in data: return data['code']
+            return response.text
+        except (json.JSONDecodeError, ValueError, TypeError):
+            return response.text
+
+
+# Un cliente por bucle de eventos: las conexiones de httpx no se comparten entre bucles
+_async_snap_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_snap_client() -> AsyncSnapClient:
+    loop = asyncio.get_running_loop()
+    client = _async_snap_clients.get(loop)
+    if client is None:
+        client = _async_snap_clients[loop] = AsyncSnapClient()
+    return client
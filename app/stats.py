@@ -0,0 +1,96 @@
+from collections import defaultdict
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from app.models import File, OwnerDailyStats
+
+# Usuario por defecto de los análisis anónimos: no tiene página de estadísticas
+DEFAULT_OWNER = 'drscratch'
+
+OWNER_FIELDS = ['score', 'abstraction', 'parallelization', 'logic', 'synchronization',
+                'flowControl', 'userInteractivity', 'dataRepresentation']
+SMELLS = ['deadCode', 'duplicateScript', 'spriteNaming', 'initialization']
+
+SMELLS_KEY = 'stats:global-smells'
+
+# ==============================================================================
+# 1. ESTADÍSTICAS DIARIAS POR USUARIO (MATERIALIZADAS)
+# ==============================================================================
+
+def file_day(file_obj):
+    return file_obj.time.date() if isinstance(file_obj.time, datetime) else file_obj.time
+
+
+def file_owners(file_obj) -> set:
+    return {owner for owner in (file_obj.organization, file_obj.coder) if owner and owner != DEFAULT_OWNER}
+
+
+def record_file_stats(files) -> None:
+    """
+    Suma las filas File recién guardadas a los agregados diarios de su dueño
+    (organización o coder) y a las medias globales de code smells en caché.
+    """
+    groups = defaultdict(lambda: {'projects': 0, **{field: 0 for field in OWNER_FIELDS}})
+    for file_obj in files:
+        for owner in file_owners(file_obj):
+            totals = groups[(owner, file_day(file_obj))]
+            totals['projects'] += 1
+            for field in OWNER_FIELDS:
+                totals[field] += int(getattr(file_obj, field) or 0)
+
+    for (owner, day), totals in groups.items():
+        increments = {field: F(field) + value for field, value in totals.items()}
+        if OwnerDailyStats.objects.filter(owner=owner, day=day).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                OwnerDailyStats.objects.create(owner=owner, day=day, **totals)
+        except IntegrityError:
+            # Otro proceso creó la fila a la vez
+            OwnerDailyStats.objects.filter(owner=owner, day=day).update(**increments)
+
+    add_global_smells(files)
+
+
+def owner_daily_stats(username: str) -> dict:
+    """ Filas diarias de un usuario indexadas por día (una sola consulta) """
+    return {row.day: row for row in OwnerDailyStats.objects.filter(owner=username)}
+
+# ==============================================================================
+# 2. MEDIAS GLOBALES DE CODE SMELLS (CACHÉ)
+# ==============================================================================
+
+def smell_keys() -> list:
+    return [f'{SMELLS_KEY}:count'] + [f'{SMELLS_KEY}:{smell}' for smell in SMELLS]
+
+
+def add_global_smells(files) -> None:
+    """ Actualiza las sumas en caché; si no están, se recalculan en la siguiente lectura """
+    files = list(files)
+    increments = [len(files)] + [sum(int(getattr(f, smell) or 0) for f in files) for smell in SMELLS]
+    try:
+        for key, value in zip(smell_keys(), increments):
+            cache.incr(key, value)
+    except ValueError:
+        cache.delete_many(smell_keys())
+
+
+def global_smell_averages() -> dict:
+    """
+    Media de cada code smell sobre todos los análisis. Solo recorre la tabla File
+    cuando la caché está vacía.
+    """
+    keys = smell_keys()
+    values = cache.get_many(keys)
+    if len(values) < len(keys):
+        totals = File.objects.aggregate(count=Count('id'), **{smell: Sum(smell) for smell in SMELLS})
+        values = {keys[0]: totals['count'] or 0}
+        for key, smell in zip(keys[1:], SMELLS):
+            values[key] = totals[smell] or 0
+        cache.set_many(values, None)
+
+    count = values[keys[0]] or 1
+    return {smell: int(values[key] / count) for key, smell in zip(keys[1:], SMELLS)}
@@ -1,80 +1,161 @@
 from drScratch.celery import app
-from .analyzer import analysis_by_url, analysis_by_upload
+from .pipeline import BatchItem, BatchPipeline
 import os
-import types
-import requests
 import shutil
-import tempfile
-from zipfile import ZipFile
-from .batch import create_csv, create_summary
+from .batch import checkpoint_result, create_batch_folder, finish_csv, list_zip_sources, merge_batch_parts, stage_stats_key, summary_key, BatchPartWriter, BatchSummary
 from django.core.mail import EmailMessage
-from django.core.mail import EmailMessage as DjangoEmailMessage
 from django.shortcuts import get_object_or_404
 from django.conf import settings
-from uuid import UUID
-from .models import BatchCSV
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+import logging
+from django.utils import timezone
+from uuid import UUID, uuid4
+from .models import BatchCSV, BatchJob, BatchProject
 from datetime import datetime
 from django.template.loader import render_to_string
-from css_inline import inline
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from types import SimpleNamespace
-from io import BytesIO
 
+logger = logging.getLogger(__name__)
 
-def proccess_url(request_data_obj: object, skill_points: dict) -> dict:
-    # Obtain request data
-    projects_file = request_data_obj.POST['urlsFile']
-    dashboard_mode = request_data_obj.POST['dashboard_mode']
+
+def list_batch_projects(projects_file) -> list:
+    """
+    Return the ordered list of sources that make up a batch: {'zip': ..., 'member': ...}
+    for an uploaded ZIP (read in place, never extracted), {'path': ...} for files in a
+    directory or {'url': ...} for project URLs.
+    """
+    if (type(projects_file) != list) and os.path.isfile(projects_file):
+        return list_zip_sources(projects_file)
 
     if (type(projects_file) != list):
         # projects_file is path of the batch
-        
-        dict_metrics = {}
+        sources = []
         for root, dirs, files in os.walk(projects_file):
-            for i, file in enumerate(files):
-                file_path = os.path.join(root, file)
-                if os.path.exists(file_path):
-                    try:
-                        with open(file_path, 'rb') as f:
-                            file_name = os.path.basename(file_path)
-                            file_data = BytesIO(f.read())
-
-                            # Intance InMemoryUploadedFile (necessary for analysis_by_upload)
-                            inmemory_file = InMemoryUploadedFile(
-                                file=file_data,
-                                field_name=None,
-                                name=file_name,
-                                content_type='application/octet-stream',
-                                size=file_data.getbuffer().nbytes,
-                                charset=None,
-                            )
-                            request_data_obj.user = SimpleNamespace(is_authenticated=True, username=None)
-                            request_data_obj.session = {}
-
-                            dict_metrics[i] = analysis_by_upload(request_data_obj, skill_points, inmemory_file)
-                    except Exception as e:
-                        print(f"Error processing file {file_path}: {e}")
-                else:
-                    print(f"File not found: {file_path}")
-        if os.path.exists(projects_file):
-            shutil.rmtree(projects_file)
-    else:
-        # projects_file is a list of urls
-        # Initialize dicts for metrics
-        dict_metrics = {} 
-
-        # Proccess each URL of the list
-        for i, url in enumerate(projects_file):
-            #if i >= 10:
-            #   break 
-            url = url.decode('utf-8').strip()
-            dict_metrics[i] = analysis_by_url(request_data_obj, url, skill_points)
-            dict_metrics[i].update({
-                'url': url,
-                'filename': url,
-                'dashboard_mode': dashboard_mode,
-            })
+            for file in sorted(files):
+                sources.append({'path': os.path.join(root, file)})
+        return sources
+
+    # projects_file is a list of urls (or of sources already built by the web view)
+    return [
+        url if isinstance(url, dict) else {'url': url.decode('utf-8').strip() if isinstance(url, bytes) else url.strip()}
+        for url in projects_file
+    ]
+
+
+def analyze_batch_sources(request_data_obj: object, skill_points: dict, sources: list, start: int = 0, persist=None, indices=None, on_stats=None, lookup=None) -> dict:
+    """
+    Analyse a slice of the batch through the staged pipeline
+    (fetch -> parse -> analyse -> persist). Keys are the global index of each project.
+    With a persist callback results are handed over as they finish instead of being kept.
+    """
+    request_data_obj.user = SimpleNamespace(is_authenticated=True, username=None)
+    request_data_obj.session = {}
+
+    pipeline = BatchPipeline(request_data_obj, skill_points, persist=persist, on_stats=on_stats, lookup=lookup)
+    return pipeline.run(sources, start, indices)
+
+
+def split_batch(indices: list) -> list:
+    """
+    Split the project indices of a batch in chunks of BATCH_CHUNK_SIZE projects. The size
+    is fixed whatever the batch size, so a chunk holds a worker slot for a bounded time.
+    """
+    chunk_size = max(1, settings.BATCH_CHUNK_SIZE)
+    return [indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size)]
+
+
+def batch_queue(num_projects: int) -> str:
+    """
+    Celery queue for a batch of this size, so small batches are not stuck behind bulk uploads.
+    """
+    return 'batch_small' if num_projects <= settings.BATCH_SMALL_MAX_PROJECTS else 'batch_bulk'
+
+
+def organization_backlog(organization: str) -> int:
+    """
+    Projects still waiting in the running batches of an organization.
+    """
+    return BatchProject.objects.filter(job__organization=organization, job__state='running', state='pending').count()
+
+
+def fair_share_priorities(chunks: list, backlog: int) -> list:
+    """
+    Priority of each chunk from the projects the same organization has waiting ahead of it:
+    the chunks of an organization with a small backlog run before those of a large upload.
+    """
+    priorities = []
+    ahead = backlog
+    for chunk in chunks:
+        priorities.append(max(0, settings.BATCH_TOP_PRIORITY - ahead // settings.BATCH_FAIR_SHARE_STEP))
+        ahead += len(chunk)
+    return priorities
+
+
+def pending_indices(job: BatchJob) -> list:
+    """
+    Indices of the projects of the job that have no checkpointed result yet.
+    """
+    return list(job.projects.filter(state='pending').order_by('index').values_list('index', flat=True))
+
+
+def checkpoint_project(job_id: UUID, index: int, result: dict) -> None:
+    """
+    Persist one finished project so a retried task does not analyse it again.
+    Only the compact result is stored: its CSV rows are already in the chunk's part files.
+    """
+    state = 'error' if result.get('Error') not in (None, 'None') else 'done'
+    try:
+        blocks = result['block_sprite_usage']['result']['total_blocks']
+    except (KeyError, TypeError):
+        blocks = None
+
+    # Failed projects are not timed, so they do not skew the ETA model
+    elapsed = result.get('elapsed') if state == 'done' else None
+    BatchProject.objects.filter(job_id=job_id, index=index).update(
+        state=state, result=checkpoint_result(result), size=result.get('size'), blocks=blocks, elapsed=elapsed,
+        content_hash=result.get('content_hash') or ''
+    )
+
+
+def find_analysed_project(job_id: UUID, content_hash: str):
+    """
+    Result of a project of the same batch with identical content, if another chunk already analysed it.
+    Its findings are in that chunk's part files, so the copy points to the original and
+    merge_batch_parts copies them over.
+    """
+    found = (BatchProject.objects.filter(job_id=job_id, content_hash=content_hash, state='done')
+             .values_list('index', 'result').first())
+    if found is None:
+        return None
+    index, result = found
+    return dict(result, findings_of=result.get('findings_of', index))
+
+
+def source_size(source: dict):
+    """
+    Size in bytes known before fetching (ZIP members and files, not URLs).
+    """
+    if source.get('size') is not None:
+        return source['size']
+    if 'path' in source and os.path.exists(source['path']):
+        return os.path.getsize(source['path'])
+    return None
+
+
+def proccess_url(request_data_obj: object, skill_points: dict) -> dict:
+    # Whole batch analysed in the current process
+    projects_file = request_data_obj.POST['urlsFile']
+    sources = list_batch_projects(projects_file)
+
+    dict_metrics = analyze_batch_sources(request_data_obj, skill_points, sources)
+
+    if (type(projects_file) != list) and os.path.isdir(projects_file):
+        shutil.rmtree(projects_file)
+    elif (type(projects_file) != list) and os.path.exists(projects_file):
+        os.remove(projects_file)
     return dict_metrics
 
 def mk_url(csv_id: UUID) -> str:
@@ -100,7 +181,8 @@ def get_csv_sum(csv) -> dict:
         'Abstraction': [csv.abstraction, csv.max_abstraction],
         'Math operators': [csv.math_operators, csv.max_math_operators],
         'Motion operators': [csv.motion_operators, csv.max_motion_operators],
-        'Mastery': csv.mastery
+        'Mastery': csv.mastery,
+        'Dedup ratio': csv.dedup_ratio
     }
     return summary
 
@@ -117,6 +199,7 @@ def mk_html(csv_id: UUID, url: str) -> str:
         }
 
         html_message = render_to_string('main' + '/dashboard-bulk-emailv.html', context)
+        from css_inline import inline
         inline_html = inline(html_message)
         return inline_html
     except ObjectDoesNotExist:
@@ -135,26 +218,216 @@ def send_mail(email: str, csv_id: UUID) -> None:
         print(f"Error seding mail: {email}")
 
 def register_timestamp(csv_id: UUID, start_time, end_endtime: datetime) -> None:
-    timestamp = (end_endtime - start_time).total_seconds() + 60
+    timestamp = (end_endtime - start_time).total_seconds()
 
     obj = get_object_or_404(BatchCSV, id=csv_id)
     obj.task_time = timestamp
     obj.save()
 
-@app.task(bind=True)
-def init_batch(self, request_data, skill_points):
-    # Start task counter for ETA
-    start_time = datetime.now()
+@app.task(bind=True, acks_late=True)
+def analyze_batch_chunk(self, request_data, skill_points, job_id, indices):
     request_data_obj = SimpleNamespace(**request_data)
-    re_email = request_data_obj.POST ['email']
+    job = BatchJob.objects.get(id=job_id)
 
-    dict_metrics = proccess_url(request_data_obj, skill_points)
-    csv_id = create_csv(request_data_obj, dict_metrics) 
-    send_mail(re_email, csv_id)
+    chunk = indices[0]
 
-    # Stop and register time for ETA
-    end_time = datetime.now()
-    register_timestamp(csv_id, start_time, end_time)
-    
+    # A redelivered chunk only analyses the projects that were not checkpointed
+    todo = set(pending_indices(job))
+    indices = [index for index in indices if index in todo]
+    sources = [job.sources[index] for index in indices]
 
-        
+    # Per-stage throughput and running summary of this chunk for the progress endpoint.
+    # A redelivered chunk keeps adding to the summary of its previous attempt
+    stats_key = stage_stats_key(job.id, chunk)
+    chunk_summary_key = summary_key(job.id, chunk)
+    summary = BatchSummary(cache.get(chunk_summary_key))
+    writer = BatchPartWriter(job.folder_path, chunk)
+
+    def persist(index, result):
+        # Rows first, checkpoint second: a crash in between repeats a project, never loses its rows
+        writer.write(index, result)
+        checkpoint_project(job.id, index, result)
+        summary.add(result)
+        cache.set(chunk_summary_key, summary.to_dict(), 24 * 3600)
+
+    try:
+        analyze_batch_sources(
+            request_data_obj, skill_points, sources, indices=indices,
+            persist=persist,
+            on_stats=lambda stats: cache.set(stats_key, stats, 24 * 3600),
+            lookup=lambda content_hash: find_analysed_project(job.id, content_hash)
+        )
+    finally:
+        writer.close()
+        release_batch_chunk(job.id)
+    return len(indices)
+
+@app.task(bind=True, acks_late=True)
+def finish_batch(self, job_id):
+    job = BatchJob.objects.get(id=job_id)
+    if job.state == 'done':
+        return str(job.csv_id)
+    re_email = job.request_data.get('POST', {}).get('email')
+
+    # The summary comes from the compact checkpoints; the CSVs from merging the part
+    # files the chunks streamed while they ran
+    summary = BatchSummary()
+    copies = {}
+    finished = job.projects.exclude(state='pending').order_by('index').values_list('index', 'result')
+    for index, result in finished.iterator():
+        summary.add(result)
+        if result.get('findings_of') is not None:
+            copies[index] = result['findings_of']
+
+    try:
+        os.makedirs(job.folder_path, exist_ok=True)
+        merge_batch_parts(job.folder_path, copies)
+        csv_id = finish_csv(job.folder_path, summary)
+    except Exception:
+        # Not retried: the job is marked so its client stops waiting for it
+        logger.exception(f"Batch {job.id}: could not build its CSVs")
+        BatchJob.objects.filter(id=job.id).update(state='failed', finished=timezone.now())
+        raise
+
+    # Stop and register time for ETA (measured from the first attempt)
+    end_time = timezone.now()
+    job.csv_id = csv_id
+    job.state = 'done'
+    job.finished = end_time
+    job.save(update_fields=['csv', 'state', 'finished'])
+
+    # Web batches are downloaded from the status page, the email is optional
+    if re_email:
+        try:
+            send_mail(re_email, csv_id)
+        except Exception as e:
+            print(f"Error sending batch mail: {e}")
+
+    if job.batch_path and os.path.isdir(job.batch_path):
+        shutil.rmtree(job.batch_path)
+    elif job.batch_path and os.path.exists(job.batch_path):
+        os.remove(job.batch_path)
+
+    register_timestamp(csv_id, job.created, end_time)
+    return str(csv_id)
+
+def dispatch_batch_chunks(organization: str) -> None:
+    """
+    Enqueue chunks of the organization's running batches, oldest batch first, until it
+    has BATCH_ORG_MAX_RUNNING_CHUNKS in flight. Runs when a batch starts and whenever one
+    of its chunks ends, so a large upload never holds more worker slots than that and
+    other organizations' chunks always find room. Projects a failed chunk left pending are
+    dispatched again up to BATCH_MAX_RETRIES times and then get an error row. Batches with
+    nothing left to dispatch or running are handed to finish_batch.
+    """
+    # Projects waiting ahead of the chunks sent now (counted before they are dispatched)
+    backlog = organization_backlog(organization)
+    dispatch, finish = [], []
+    with transaction.atomic():
+        jobs = list(BatchJob.objects.select_for_update()
+                    .filter(organization=organization, state='running').order_by('created'))
+        running = sum(job.inflight for job in jobs)
+        for job in jobs:
+            free = max(0, settings.BATCH_ORG_MAX_RUNNING_CHUNKS - running)
+            chunks = next_chunks(job, free)
+            if not chunks and job.inflight == 0 and job.projects.filter(state='pending').exists():
+                # Every chunk ended but some projects were not checkpointed: their chunk failed
+                if job.retries < settings.BATCH_MAX_RETRIES:
+                    job.retries += 1
+                    job.cursor = 0
+                    chunks = next_chunks(job, free)
+                else:
+                    abandon_pending_projects(job)
+            if chunks:
+                job.cursor = chunks[-1][-1] + 1
+                job.inflight += len(chunks)
+                job.chunks = sorted(set(job.chunks) | {chunk[0] for chunk in chunks})
+                running += len(chunks)
+                dispatch.extend((job, chunk) for chunk in chunks)
+            elif job.inflight == 0 and not job.projects.filter(state='pending').exists():
+                job.state = 'finishing'
+                finish.append(job)
+            job.save(update_fields=['cursor', 'inflight', 'chunks', 'state', 'retries'])
+
+    # Tasks are sent once the dispatch state is committed
+    priorities = fair_share_priorities([chunk for _, chunk in dispatch], backlog)
+    for (job, chunk), priority in zip(dispatch, priorities):
+        analyze_batch_chunk.apply_async(
+            args=(job.request_data, job.skill_points, str(job.id), chunk),
+            queue=batch_queue(len(job.sources)), priority=priority
+        )
+    for job in finish:
+        finish_batch.apply_async(args=(str(job.id),), queue=batch_queue(len(job.sources)),
+                                 priority=settings.BATCH_TOP_PRIORITY)
+
+
+def next_chunks(job: BatchJob, free: int) -> list:
+    """
+    Chunks of the pending projects from the job's cursor that fit in 'free' worker slots.
+    """
+    indices = list(job.projects.filter(state='pending', index__gte=job.cursor).order_by('index')
+                   .values_list('index', flat=True)[:free * settings.BATCH_CHUNK_SIZE])
+    return split_batch(indices)
+
+
+def abandon_pending_projects(job: BatchJob) -> None:
+    """
+    Give up on the projects still pending after the last retry: they get the error row of
+    a project that could not be analysed, so the batch can finish with the rest.
+    """
+    indices = pending_indices(job)
+    logger.error(f"Batch {job.id}: giving up on {len(indices)} projects after {job.retries} retries")
+    writer = BatchPartWriter(job.folder_path, indices[0])
+    try:
+        for index in indices:
+            item = BatchItem(index, job.sources[index])
+            result = {'Error': 'analyzing', 'url': item.origin, 'filename': item.filename,
+                      'dashboard_mode': job.request_data.get('POST', {}).get('dashboard_mode', 'Default')}
+            writer.write(index, result)
+            checkpoint_project(job.id, index, result)
+    finally:
+        writer.close()
+
+
+def release_batch_chunk(job_id: UUID) -> None:
+    """
+    A chunk of the job ended (or failed): free its slot and dispatch the next ones.
+    """
+    BatchJob.objects.filter(id=job_id, inflight__gt=0).update(inflight=F('inflight') - 1)
+    job = BatchJob.objects.filter(id=job_id).only('organization').first()
+    if job is not None:
+        dispatch_batch_chunks(job.organization)
+
+@app.task(bind=True, acks_late=True)
+def init_batch(self, request_data, skill_points, organization=''):
+    """
+    Idempotent: the job is keyed by this task's id, so a retried or redelivered
+    task resumes the existing job and only dispatches the unfinished projects.
+    Chunks go to the small or bulk queue by batch size and are dispatched a few at a
+    time per organization (see dispatch_batch_chunks).
+    """
+    job_id = self.request.id or uuid4()
+    job = BatchJob.objects.filter(id=job_id).first()
+
+    if job is None:
+        projects_file = request_data['POST']['urlsFile']
+        batch_path = projects_file if (type(projects_file) != list) else ''
+        sources = list_batch_projects(projects_file)
+        job = BatchJob.objects.create(
+            id=job_id, sources=sources, folder_path=create_batch_folder(), batch_path=batch_path,
+            organization=organization or '', request_data=request_data, skill_points=skill_points
+        )
+        BatchProject.objects.bulk_create(
+            [BatchProject(job=job, index=index, size=source_size(source)) for index, source in enumerate(sources)],
+            batch_size=500, ignore_conflicts=True
+        )
+    elif job.state == 'done':
+        return str(job.csv_id)
+    else:
+        # Resumed: the chunks of the previous attempt are no longer running
+        job.state, job.inflight, job.cursor, job.retries = 'running', 0, 0, 0
+        job.save(update_fields=['state', 'inflight', 'cursor', 'retries'])
+
+    dispatch_batch_chunks(job.organization)
+    job.refresh_from_db()
+    return str(job.csv_id) if job.state == 'done' else str(job.id)
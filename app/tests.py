@@ -1,3 +1,1242 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from zipfile import ZipFile
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+
+from drScratch.celery import app as celery_app
+from app import analyzer, tasks
+from app.admission import (AdmissionController, AnalysisBusy, admission_metrics, register_process,
+                           registered_processes)
+from app import batch as batch_utils
+from app.analyzer import project_content_hash
+from app.batch import (BatchPartWriter, BatchSummary, checkpoint_result, findings_csv_rows, list_zip_sources,
+                       main_csv_row, merge_batch_parts, scan_batch_zip)
+from app.exception import DrScratchException
+from app.management.commands.startup_benchmark import Command as StartupBenchmark
+from app.models import BatchJob, File
+from app.pipeline import BatchPipeline, Pipeline, Stage
+from app.project_store import (evict_projects, load_stored_project, project_path, read_upload, store_project,
+                               stored_projects)
+from app.results import cache as analysis_cache, load_result, save_result
+from app.sandbox import AnalysisPool, save_failed_project
+from app.scratchclient import AsyncSnapClient, SnapClient
+from app.tasks import fair_share_priorities, split_batch
+
+SKILLS = ['Abstraction', 'Parallelization', 'Logic', 'Synchronization', 'FlowControl',
+          'UserInteractivity', 'DataRepresentation', 'MathOperators', 'MotionOperators']
+
+# Proyecto Snap! mínimo: 8 bloques, Developing con la rúbrica por defecto
+PROJECT_XML = (
+    '<project name="demo" app="Snap! 9" version="2"><notes></notes>'
+    '<stage name="Stage" width="480" height="360"><costumes><list></list></costumes><scripts>'
+    '<script x="10" y="10"><block s="receiveGo"/><block s="doForever"><script>'
+    '<block s="forward"><l>10</l></block><block s="doIf"><block s="reportLessThan"><l>1</l><l>2</l></block>'
+    '<script><block s="turn"><l>15</l></block></script></block></script></block></script></scripts>'
+    '<sprites><sprite name="Sprite" x="0" y="0"><costumes><list></list></costumes><scripts>'
+    '<script x="1" y="1"><block s="receiveKey"><l><option>space</option></l></block>'
+    '<block s="doSayFor"><l>Hello!</l><l>2</l></block></script>'
+    '<script><block s="forward"><l>5</l></block></script></scripts></sprite></sprites></stage></project>'
+)
+
+
+def project_variant(n: int) -> str:
+    """ Mismo proyecto con otro contenido (otro hash) """
+    return PROJECT_XML.replace('<notes></notes>', f'<notes>{n}</notes>')
+
+
+# ==============================================================================
+# SERVIDOR SNAP! DE PRUEBA
+# ==============================================================================
+
+class SnapStandIn:
+    """
+    Sustituto local de la API de Snap! (/<usuario>/<proyecto>). Según el nombre del
+    proyecto: 'missing' da 404, 'flaky' un 503 la primera vez, 'slow' tarda 0,1 s,
+    'moved' redirige con 302 a 'demo' y 'uniq' devuelve un contenido propio.
+    """
+
+    def __init__(self):
+        self.hits = {}
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.hits[self.path] = stand_in.hits.get(self.path, 0) + 1
+                    stand_in.active += 1
+                    stand_in.peak = max(stand_in.peak, stand_in.active)
+                try:
+                    self.respond(stand_in.hits[self.path])
+                finally:
+                    with stand_in.lock:
+                        stand_in.active -= 1
+
+            def respond(self, hits):
+                name = self.path.rsplit('/', 1)[-1]
+                if 'slow' in name:
+                    time.sleep(0.1)
+                if name == 'missing' or (name == 'flaky' and hits == 1):
+                    self.send_response(404 if name == 'missing' else 503)
+                    self.end_headers()
+                    return
+                if name == 'moved':
+                    self.send_response(302)
+                    self.send_header('Location', self.path.rsplit('/', 1)[0] + '/demo')
+                    self.end_headers()
+                    return
+                xml = project_variant(name) if 'uniq' in name else PROJECT_XML
+                body = json.dumps({'xml': xml}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/v1/projects'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapStandInMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.snap = SnapStandIn()
+        self.addCleanup(self.snap.close)
+        settings_override = override_settings(SNAP_API_URL=self.snap.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # El cliente compartido se crea de nuevo, ya con la URL del sustituto
+        shared_client = mock.patch('app.scratchclient._snap_client', None)
+        shared_client.start()
+        self.addCleanup(shared_client.stop)
+
+
+def snap_url(projectname: str) -> str:
+    return f'https://snap.berkeley.edu/project?username=alice&projectname={projectname}'
+
+
+def batch_request(mode: str = 'Default') -> SimpleNamespace:
+    """ Petición mínima de un lote, como la que reconstruye analyze_batch_sources """
+    return SimpleNamespace(POST={'dashboard_mode': mode}, LANGUAGE_CODE='en', session={},
+                           user=SimpleNamespace(is_authenticated=True, username=None))
+
+
+# ==============================================================================
+# LOTES: BASE COMÚN
+# ==============================================================================
+
+@override_settings(BATCH_ISOLATION=False)
+class BatchTestCase(TransactionTestCase):
+    """
+    Lotes con Celery en modo eager, en un directorio de trabajo temporal (los CSV
+    van a ./csvs) y con los proyectos en una carpeta propia.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.workdir)
+        self.addCleanup(os.chdir, cwd)
+        eager = {'task_always_eager': celery_app.conf.task_always_eager,
+                 'task_eager_propagates': celery_app.conf.task_eager_propagates}
+        celery_app.conf.update(task_always_eager=True, task_eager_propagates=False)
+        self.addCleanup(celery_app.conf.update, **eager)
+
+    def project_folder(self, contents: list) -> str:
+        folder = tempfile.mkdtemp(dir=self.workdir)
+        for n, content in enumerate(contents):
+            with open(os.path.join(folder, f'p{n:02d}.xml'), 'w') as f:
+                f.write(content)
+        return folder
+
+    def run_batch(self, contents, organization: str = '', task_id: str = None) -> BatchJob:
+        """ contents: contenidos de los proyectos, o la ruta de una carpeta o un ZIP ya preparados """
+        projects = contents if isinstance(contents, str) else self.project_folder(contents)
+        request_data = {'POST': {'dashboard_mode': 'Default', 'email': '', 'urlsFile': projects},
+                        'LANGUAGE_CODE': 'en'}
+        result = tasks.init_batch.apply(args=(request_data, {s: 4 for s in SKILLS}, organization), task_id=task_id)
+        return BatchJob.objects.get(id=result.id)
+
+
+# ==============================================================================
+# user-026: REPARTO DE UN LOTE EN SUBTAREAS
+# ==============================================================================
+
+@override_settings(BATCH_CHUNK_SIZE=2)
+class BatchFanOutTests(BatchTestCase):
+
+    def test_every_chunk_is_analysed_and_the_batch_finishes(self):
+        job = self.run_batch([project_variant(n) for n in range(5)])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(sorted(job.chunks), [0, 2, 4])
+        self.assertEqual(list(job.projects.values_list('state', flat=True).distinct()), ['done'])
+        self.assertEqual(job.csv.num_projects, 5)
+        self.assertTrue(os.path.exists(job.csv.filepath))
+
+
+# ==============================================================================
+# user-027: CLIENTE SNAP! CON POOL, LÍMITE POR HOST Y REINTENTOS
+# ==============================================================================
+
+class SnapClientTests(SnapStandInMixin, SimpleTestCase):
+
+    def snap_client(self, **options) -> SnapClient:
+        return SnapClient(base_url=self.snap.url, backoff=0, **options)
+
+    def test_downloads_the_project_xml(self):
+        self.assertEqual(self.snap_client().get_project_xml('alice', 'demo'), PROJECT_XML)
+
+    def test_retries_transient_errors(self):
+        self.assertEqual(self.snap_client(retries=2).get_project_xml('alice', 'flaky'), PROJECT_XML)
+        self.assertEqual(self.snap.hits['/api/v1/projects/alice/flaky'], 2)
+
+    def test_does_not_retry_missing_projects(self):
+        with self.assertRaises(DrScratchException):
+            self.snap_client(retries=3).get_project_xml('alice', 'missing')
+        self.assertEqual(self.snap.hits['/api/v1/projects/alice/missing'], 1)
+
+    def test_gives_up_after_the_last_retry(self):
+        client = self.snap_client(retries=0)
+        with self.assertRaises(DrScratchException):
+            client.get_project_xml('alice', 'flaky')
+
+    def test_fetch_many_yields_every_project_within_the_host_limit(self):
+        projects = [{'username': 'alice', 'projectname': f'slow-uniq{n}'} for n in range(6)]
+        projects.append({'username': 'alice', 'projectname': 'missing'})
+        results = {index: (xml, error) for index, xml, error in
+                   self.snap_client(max_per_host=2).fetch_many(projects, max_workers=6)}
+        self.assertEqual(sorted(results), list(range(7)))
+        self.assertEqual(results[0], (project_variant('slow-uniq0'), None))
+        self.assertIsInstance(results[6][1], DrScratchException)
+        self.assertLessEqual(self.snap.peak, 2)
+
+    def test_follows_redirects(self):
+        self.assertEqual(self.snap_client().get_project_xml('alice', 'moved'), PROJECT_XML)
+
+
+# ==============================================================================
+# user-028: PIPELINE POR ETAPAS
+# ==============================================================================
+
+class PipelineTests(SimpleTestCase):
+
+    def test_every_item_goes_through_every_stage(self):
+        pipeline = Pipeline([Stage('double', lambda n: n * 2, 3), Stage('add', lambda n: n + 1, 2)], queue_size=2)
+        self.assertEqual(sorted(pipeline.run(range(20))), [n * 2 + 1 for n in range(20)])
+        stats = pipeline.stats()
+        self.assertEqual((stats['double']['processed'], stats['add']['processed']), (20, 20))
+
+    def test_stages_overlap(self):
+        def slow(n):
+            time.sleep(0.05)
+            return n
+
+        start = time.monotonic()
+        pipeline = Pipeline([Stage('first', slow), Stage('second', slow)], queue_size=4)
+        self.assertEqual(len(list(pipeline.run(range(10)))), 10)
+        # En serie serían 20 x 0,05 s; solapadas, poco más de la mitad
+        self.assertLess(time.monotonic() - start, 0.8)
+
+    def test_errors_go_to_on_error_or_drop_the_item(self):
+        def fail_on_three(n):
+            if n == 3:
+                raise ValueError(n)
+            return n
+
+        recovered = Pipeline([Stage('check', fail_on_three)], on_error=lambda stage, item, error: -item)
+        self.assertEqual(sorted(recovered.run(range(5))), [-3, 0, 1, 2, 4])
+        dropped = Pipeline([Stage('check', fail_on_three)])
+        self.assertEqual(sorted(dropped.run(range(5))), [0, 1, 2, 4])
+
+
+@override_settings(BATCH_ISOLATION=False)
+class BatchPipelineTests(TransactionTestCase):
+
+    def test_results_are_keyed_by_global_index(self):
+        sources = [{'content': project_variant(n), 'filename': f'p{n}.xml'} for n in range(3)]
+        sources.append({'url': 'https://example.com/not-a-snap-project'})
+        results = BatchPipeline(batch_request(), {s: 4 for s in SKILLS}).run(sources, start=10)
+        self.assertEqual(sorted(results), [10, 11, 12, 13])
+        self.assertEqual(results[10]['filename'], 'p0.xml')
+        self.assertEqual(results[10]['extended']['total_points'], [8, 36])
+        self.assertEqual(results[13]['Error'], 'id_error')
+
+    def test_persist_receives_each_result_as_it_finishes(self):
+        persisted = []
+        sources = [{'content': project_variant(n), 'filename': f'p{n}.xml'} for n in range(4)]
+        results = BatchPipeline(batch_request(), {s: 4 for s in SKILLS},
+                                persist=lambda index, result: persisted.append(index)).run(sources)
+        self.assertEqual(sorted(persisted), [0, 1, 2, 3])
+        self.assertEqual(results, {})
+
+
+# ==============================================================================
+# user-029: FILAS DE LOS CSV DEL LOTE
+# ==============================================================================
+
+class BatchCSVRowTests(SimpleTestCase):
+
+    project = {
+        'url': 'https://snap.berkeley.edu/project?username=alice&projectname=demo',
+        'filename': 'demo;"1".xml', 'Error': 'None', 'dashboard_mode': 'Recommender',
+        'extended': dict({s: [2, 4] for s in SKILLS}, total_points=[18, 36]),
+        'vanilla': dict({s: [1, 3] for s in SKILLS}, total_points=[7, 21]),
+        'block_sprite_usage': {'result': {'total_blocks': 42}},
+        'duplicateScript': {'number': 1, 'csv_format': ['when flag clicked...']},
+        'deadCode': {'number': 2, 'Sprite': ['forward', 'turn']},
+        'spriteNaming': {'number': 1, 'sprite': ['Sprite']},
+        'backdropNaming': {'number': 0, 'backdrop': []},
+    }
+
+    def test_main_row(self):
+        row = main_csv_row(self.project)
+        self.assertEqual(row['filename'], 'demo1.xml')
+        self.assertEqual(row['dashboard_mode'], 'Recommender')
+        self.assertEqual((row['points'], row['Logic'], row['Van points'], row['Van Logic']), (18, '2/4', 7, '1/3'))
+        self.assertEqual((row['DuplicateScripts'], row['DeadCode'], row['tot_blocks']), (1, 2, 42))
+
+    def test_one_findings_row_per_finding(self):
+        rows = list(findings_csv_rows(5, self.project))
+        self.assertEqual([(row['smell'], row['sprite'], row['position']) for row in rows], [
+            ('duplicateScript', '', 1), ('spriteNaming', '', 1), ('deadCode', 'Sprite', 1), ('deadCode', 'Sprite', 2),
+        ])
+        self.assertTrue(all(row['project'] == 5 for row in rows))
+
+
+# ==============================================================================
+# user-030: LOTES CON PUNTOS DE CONTROL Y REANUDABLES
+# ==============================================================================
+
+def read_csv(path: str) -> list:
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+class BatchPartsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, True)
+
+    def project(self, name: str) -> dict:
+        return dict(BatchCSVRowTests.project, filename=name,
+                    spriteNaming={'number': 1, 'sprite': [f'{name}-sprite']})
+
+    def write_part(self, chunk: int, projects: dict):
+        writer = BatchPartWriter(self.folder, chunk)
+        for index, project in projects.items():
+            writer.write(index, project)
+        writer.close()
+
+    def test_merge_orders_rows_and_keeps_the_first_attempt(self):
+        self.write_part(2, {3: self.project('p3'), 2: self.project('p2')})
+        self.write_part(0, {1: self.project('p1'), 0: self.project('p0')})
+        # Reintento de la primera subtarea: sus filas repetidas no cuentan
+        self.write_part(0, {1: self.project('p1-retry')})
+        merge_batch_parts(self.folder)
+
+        self.assertEqual([row['filename'] for row in read_csv(os.path.join(self.folder, 'main.csv'))],
+                         ['p0', 'p1', 'p2', 'p3'])
+        findings = [(row['project'], row['value']) for row in read_csv(os.path.join(self.folder, 'findings.csv'))
+                    if row['smell'] == 'spriteNaming']
+        self.assertEqual(findings, [('0', 'p0-sprite'), ('1', 'p1-sprite'), ('2', 'p2-sprite'), ('3', 'p3-sprite')])
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'parts')))
+
+    def test_copies_get_the_findings_of_their_original(self):
+        self.write_part(0, {0: self.project('p0')})
+        self.write_part(1, {1: dict(checkpoint_result(self.project('copy')), duplicate=True)})
+        merge_batch_parts(self.folder, copies={1: 0})
+        findings = [(row['project'], row['filename'], row['value'])
+                    for row in read_csv(os.path.join(self.folder, 'findings.csv')) if row['smell'] == 'spriteNaming']
+        self.assertEqual(findings, [('0', 'p0', 'p0-sprite'), ('1', 'copy', 'p0-sprite')])
+
+    def test_checkpoints_keep_counts_not_findings(self):
+        compact = checkpoint_result(self.project('p0'))
+        self.assertEqual(compact['spriteNaming'], {'number': 1})
+        self.assertEqual(compact['deadCode'], {'number': 2})
+        self.assertEqual(compact['block_sprite_usage'], {'result': {'total_blocks': 42}})
+        self.assertEqual(main_csv_row(compact), main_csv_row(self.project('p0')))
+
+
+@override_settings(BATCH_CHUNK_SIZE=2)
+class BatchResumeTests(BatchTestCase):
+
+    def test_a_finished_batch_is_not_analysed_again(self):
+        job = self.run_batch([project_variant(n) for n in range(3)], task_id='6b1c8a52-64a4-4d1a-9d3c-0f1b1b9ad001')
+        analysed = []
+        original = tasks.analyze_batch_sources
+
+        def spy(*args, **kwargs):
+            analysed.extend(kwargs.get('indices') or [])
+            return original(*args, **kwargs)
+
+        tasks.analyze_batch_sources = spy
+        self.addCleanup(setattr, tasks, 'analyze_batch_sources', original)
+        again = self.run_batch([project_variant(n) for n in range(3)], task_id=str(job.id))
+        self.assertEqual(analysed, [])
+        self.assertEqual(again.csv_id, job.csv_id)
+
+    def test_resume_only_analyses_pending_projects(self):
+        job = self.run_batch([project_variant(n) for n in range(4)])
+        job.projects.filter(index__in=[1, 2]).update(state='pending', result=None)
+        BatchJob.objects.filter(id=job.id).update(state='running')
+        analysed = []
+        original = tasks.analyze_batch_sources
+
+        def spy(*args, **kwargs):
+            analysed.extend(kwargs.get('indices') or [])
+            return original(*args, **kwargs)
+
+        tasks.analyze_batch_sources = spy
+        self.addCleanup(setattr, tasks, 'analyze_batch_sources', original)
+        tasks.init_batch.apply(args=(job.request_data, job.skill_points, job.organization), task_id=str(job.id))
+        job.refresh_from_db()
+        self.assertEqual(sorted(analysed), [1, 2])
+        self.assertEqual(job.state, 'done')
+
+
+class BatchJobAccessTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user('alice', password='secret')
+        User.objects.create_user('bob', password='secret')
+        self.job = BatchJob.objects.create(organization='alice', state='running', folder_path='/nonexistent')
+
+    def get(self, name: str):
+        return self.client.get(reverse(name, args=[self.job.id]))
+
+    def test_only_the_owner_sees_the_status(self):
+        self.client.login(username='bob', password='secret')
+        self.assertEqual(self.get('batch_status').status_code, 404)
+        self.client.login(username='alice', password='secret')
+        response = self.get('batch_status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['state'], 'running')
+
+    def test_only_the_owner_downloads(self):
+        self.client.login(username='bob', password='secret')
+        self.assertEqual(self.get('batch_download').status_code, 404)
+        self.client.login(username='alice', password='secret')
+        self.assertEqual(self.get('batch_download').status_code, 409)
+
+    def test_anonymous_jobs_belong_to_their_session(self):
+        self.assertEqual(self.get('batch_status').status_code, 404)
+        BatchJob.objects.filter(id=self.job.id).update(organization=f'anon:{self.client.session.session_key}')
+        self.assertEqual(self.get('batch_status').status_code, 200)
+
+
+# ==============================================================================
+# user-032: LOTES DESDE UN ZIP SIN EXTRAERLO
+# ==============================================================================
+
+def make_zip(path: str, members: dict) -> str:
+    with ZipFile(path, 'w') as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return path
+
+
+class BatchZipTests(BatchTestCase):
+
+    def test_only_project_files_are_selected(self):
+        path = make_zip(os.path.join(self.workdir, 'batch.zip'), {
+            'class/a.xml': PROJECT_XML, 'b.XML': PROJECT_XML, 'notes.txt': 'hi', '.hidden.xml': PROJECT_XML,
+            '__MACOSX/class/._a.xml': 'x', 'empty/': '',
+        })
+        with ZipFile(path) as zip_file:
+            self.assertEqual([info.filename for info in scan_batch_zip(zip_file)], ['class/a.xml', 'b.XML'])
+
+    def test_member_paths_never_reach_the_disk(self):
+        path = make_zip(os.path.join(self.workdir, 'slip.zip'), {
+            'class/../../escaped.xml': project_variant(1), '../skipped.xml': project_variant(3), '/abs/rooted.xml': project_variant(2),
+        })
+        self.assertEqual([source['filename'] for source in list_zip_sources(path)], ['escaped.xml', 'rooted.xml'])
+        job = self.run_batch(path)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.csv.num_projects, 2)
+        for parent in (self.workdir, os.path.dirname(self.workdir), '/abs'):
+            self.assertFalse(os.path.exists(os.path.join(parent, 'escaped.xml')))
+        self.assertFalse(os.path.exists('/abs/rooted.xml'))
+
+    def test_zip_bombs_are_rejected_from_the_declared_sizes(self):
+        path = make_zip(os.path.join(self.workdir, 'bomb.zip'), {'a.xml': 'x' * 2000, 'b.xml': 'x' * 2000})
+        with ZipFile(path) as zip_file, mock.patch.object(batch_utils, 'MAX_EXTRACT_SIZE', 3000):
+            with self.assertRaises(DrScratchException):
+                scan_batch_zip(zip_file)
+        with ZipFile(path) as zip_file, mock.patch.object(batch_utils, 'MAX_FILES_IN_ZIP', 1):
+            with self.assertRaises(DrScratchException):
+                scan_batch_zip(zip_file)
+
+
+# ==============================================================================
+# user-033: PROYECTOS REPETIDOS DENTRO DE UN LOTE
+# ==============================================================================
+
+@override_settings(BATCH_ISOLATION=False)
+class BatchDedupTests(BatchTestCase):
+
+    def test_identical_projects_are_analysed_once(self):
+        sources = [{'content': content, 'filename': f'p{n}.xml'}
+                   for n, content in enumerate([PROJECT_XML, project_variant(1), PROJECT_XML, PROJECT_XML])]
+        results = BatchPipeline(batch_request(), {s: 4 for s in SKILLS}).run(sources)
+        copies = sorted(index for index, result in results.items() if result.get('duplicate'))
+        self.assertEqual(copies, [2, 3])
+        self.assertEqual(results[2]['extended'], results[0]['extended'])
+        # Cada copia conserva su propio nombre en los CSV
+        self.assertEqual(results[3]['filename'], 'p3.xml')
+
+    @override_settings(BATCH_CHUNK_SIZE=2)
+    def test_copies_in_other_chunks_reuse_the_checkpoint(self):
+        job = self.run_batch([PROJECT_XML, project_variant(1), PROJECT_XML])
+        copy = job.projects.get(index=2)
+        self.assertTrue(copy.result['duplicate'])
+        self.assertEqual(copy.result['findings_of'], 0)
+        self.assertEqual(copy.content_hash, job.projects.get(index=0).content_hash)
+        with ZipFile(job.csv.filepath) as zip_file:
+            rows = list(csv.DictReader(zip_file.read('main.csv').decode('utf-8').splitlines()))
+        self.assertEqual([row['filename'] for row in rows], ['p00.xml', 'p01.xml', 'p02.xml'])
+        self.assertEqual(rows[2]['points'], rows[0]['points'])
+
+
+# ==============================================================================
+# user-036: ANÁLISIS AISLADO CON LÍMITES
+# ==============================================================================
+
+def spin_cpu(*args, **kwargs):
+    deadline = time.process_time() + 5
+    while time.process_time() < deadline:
+        pass
+
+
+def sleep_long(*args, **kwargs):
+    time.sleep(5)
+
+
+class AnalysisPoolTests(TransactionTestCase):
+
+    request_data = {'POST': {'dashboard_mode': 'Default'}, 'LANGUAGE_CODE': 'en',
+                    'user': {'is_authenticated': True, 'username': None}}
+
+    def analyse(self, **limits) -> dict:
+        # Los hijos se crean con fork: heredan el parche del analizador del padre
+        with override_settings(**limits):
+            pool = AnalysisPool(processes=1)
+        self.addCleanup(pool.close)
+        result, files = pool.analyse(self.request_data, {s: 4 for s in SKILLS}, PROJECT_XML, 'p.xml')
+        return result
+
+    def test_analyses_in_a_child_process(self):
+        result = self.analyse()
+        self.assertEqual(result['extended']['total_points'], [8, 36])
+
+    @override_settings(BATCH_PROJECT_CPU_LIMIT=0.3)
+    def test_cpu_limit(self):
+        with mock.patch('app.analyzer.split_xml', spin_cpu):
+            self.assertEqual(self.analyse(BATCH_PROJECT_TIMEOUT=30), {'Error': 'timeout'})
+
+    def test_wall_clock_limit(self):
+        with mock.patch('app.analyzer.split_xml', sleep_long):
+            self.assertEqual(self.analyse(BATCH_PROJECT_TIMEOUT=1), {'Error': 'timeout'})
+
+    def test_failed_projects_are_kept_for_inspection(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, True)
+        with override_settings(BASE_DIR=folder):
+            path = save_failed_project('../class/slow', b'<project/>')
+        self.assertEqual(os.path.dirname(path), os.path.join(folder, 'error_analyzing'))
+        self.assertTrue(path.endswith('_slow.xml'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'<project/>')
+
+
+# ==============================================================================
+# user-037: SUBTAREAS POR ORGANIZACIÓN, REINTENTOS Y FALLOS
+# ==============================================================================
+
+@override_settings(BATCH_CHUNK_SIZE=3, BATCH_TOP_PRIORITY=8, BATCH_FAIR_SHARE_STEP=10)
+class BatchDispatchTests(SimpleTestCase):
+
+    def test_split_batch_uses_a_fixed_chunk_size(self):
+        self.assertEqual(split_batch(list(range(7))), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(split_batch([]), [])
+        chunks = split_batch(list(range(5000)))
+        self.assertEqual(len(chunks), 1667)
+        self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+
+    def test_fair_share_lowers_priority_with_the_backlog_ahead(self):
+        chunks = [[0, 1, 2, 3, 4]] * 4
+        self.assertEqual(fair_share_priorities(chunks, 0), [8, 8, 7, 7])
+        self.assertEqual(fair_share_priorities(chunks, 25), [6, 5, 5, 4])
+        self.assertEqual(fair_share_priorities(chunks, 1000), [0, 0, 0, 0])
+
+
+@override_settings(BATCH_CHUNK_SIZE=2, BATCH_MAX_RETRIES=2)
+class BatchFailureTests(BatchTestCase):
+
+    def fail_chunk(self, first_index: int, times: int):
+        """ La subtarea que empieza en first_index lanza una excepción sus primeras 'times' veces """
+        calls = []
+        original = tasks.analyze_batch_sources
+
+        def flaky(*args, **kwargs):
+            indices = kwargs.get('indices') or []
+            calls.append(list(indices))
+            if indices and indices[0] == first_index and calls.count(list(indices)) <= times:
+                raise RuntimeError('worker crashed')
+            return original(*args, **kwargs)
+
+        tasks.analyze_batch_sources = flaky
+        self.addCleanup(setattr, tasks, 'analyze_batch_sources', original)
+        return calls
+
+    def test_a_failed_chunk_is_dispatched_again(self):
+        calls = self.fail_chunk(2, times=1)
+        job = self.run_batch([project_variant(n) for n in range(5)])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(calls.count([2, 3]), 2)
+        self.assertEqual(job.retries, 1)
+        self.assertFalse(job.projects.exclude(state='done').exists())
+
+    def test_projects_of_a_chunk_that_keeps_failing_get_an_error_row(self):
+        calls = self.fail_chunk(2, times=10)
+        job = self.run_batch([project_variant(n) for n in range(5)])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(calls.count([2, 3]), 3)
+        self.assertEqual(list(job.projects.filter(state='error').values_list('index', flat=True)), [2, 3])
+        self.assertEqual(job.csv.num_projects, 5)
+        with ZipFile(job.csv.filepath) as zip_file:
+            rows = list(csv.DictReader(zip_file.read('main.csv').decode('utf-8').splitlines()))
+        self.assertEqual([(row['filename'], row['Error']) for row in rows][1:4],
+                         [('p01.xml', 'None'), ('p02.xml', 'analyzing'), ('p03.xml', 'analyzing')])
+
+    def test_a_project_that_could_not_be_saved_is_analysed_again(self):
+        original = tasks.checkpoint_project
+        failed = []
+
+        def checkpoint_once(job_id, index, result):
+            if index == 1 and not failed:
+                failed.append(index)
+                raise OSError('database gone')
+            return original(job_id, index, result)
+
+        tasks.checkpoint_project = checkpoint_once
+        self.addCleanup(setattr, tasks, 'checkpoint_project', original)
+        job = self.run_batch([project_variant(n) for n in range(3)])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.projects.get(index=1).state, 'done')
+
+    @override_settings(BATCH_WIDE_CSV=True)
+    def test_a_batch_of_errors_finishes(self):
+        job = self.run_batch(['not a project', '<project/>'])
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.csv.num_projects, 2)
+
+    def test_a_batch_whose_csvs_cannot_be_built_is_marked_failed(self):
+        with mock.patch.object(tasks, 'finish_csv', side_effect=OSError('disk full')):
+            job = self.run_batch([project_variant(n) for n in range(3)])
+        self.assertEqual(job.state, 'failed')
+        self.assertIsNotNone(job.finished)
+
+
+# ==============================================================================
+# user-038: RESUMEN DEL LOTE CON SUMAS PARCIALES
+# ==============================================================================
+
+def mastery_result(logic: int, competence: str = 'Developing', duplicate: bool = False) -> dict:
+    extended = {skill: [0, 4] for skill in BatchSummary.SKILLS}
+    extended.update(Logic=[logic, 4], total_points=[logic, 36], competence=competence)
+    return {'extended': extended, 'duplicate': duplicate}
+
+
+class BatchSummaryTests(SimpleTestCase):
+
+    def test_add(self):
+        summary = BatchSummary()
+        summary.add(mastery_result(2))
+        summary.add(mastery_result(4, 'Master', duplicate=True))
+        summary.add({'Error': 'no_exists'})
+        data = summary.to_dict()
+        self.assertEqual((data['num_projects'], data['scored'], data['duplicates']), (3, 2, 1))
+        self.assertEqual((data['points'], data['max_points']), (6, 72))
+        self.assertEqual(data['histograms']['Logic'], {'2': 1, '4': 1})
+        self.assertEqual(data['competences'], {'Developing': 1, 'Master': 1})
+
+    def test_errors_do_not_lower_the_averages(self):
+        summary = BatchSummary()
+        for project in [mastery_result(2), mastery_result(4, 'Master', duplicate=True), {'Error': 'no_exists'}]:
+            summary.add(project)
+        final = summary.finalize()
+        self.assertEqual(final['num_projects'], 3)
+        self.assertEqual(final['Logic'], [3.0, 4.0])
+        self.assertEqual(final['Points'], [3.0, 36.0])
+        self.assertEqual(final['dedup_ratio'], round(1 / 3, 4))
+
+    def test_a_batch_of_errors(self):
+        summary = BatchSummary()
+        summary.add({'Error': 'analyzing'})
+        final = summary.finalize()
+        self.assertEqual((final['Points'], final['Mastery']), ([0.0, 0.0], 'Basic'))
+
+    def test_merge_matches_a_single_summary(self):
+        projects = [mastery_result(1), mastery_result(3, 'Master'), mastery_result(4, 'Master', True)]
+        whole = BatchSummary()
+        for project in projects:
+            whole.add(project)
+
+        first, second = BatchSummary(), BatchSummary()
+        first.add(projects[0])
+        for project in projects[1:]:
+            second.add(project)
+        # Como entre subtareas: cada parte llega serializada
+        merged = BatchSummary(first.to_dict()).merge(BatchSummary(second.to_dict()))
+        self.assertEqual(merged.to_dict(), whole.to_dict())
+        self.assertEqual(merged.finalize(), whole.finalize())
+
+
+# ==============================================================================
+# user-041: HUELLA DEL CONTENIDO DE LAS FILAS ANTIGUAS
+# ==============================================================================
+
+SCORE_FIELDS = ['score', 'abstraction', 'parallelization', 'logic', 'synchronization', 'flowControl',
+                'userInteractivity', 'dataRepresentation', 'spriteNaming', 'initialization', 'deadCode',
+                'duplicateScript']
+
+
+class BackfillContentHashTests(TestCase):
+
+    def setUp(self):
+        self.dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        for folder in self.dirs:
+            self.addCleanup(shutil.rmtree, folder, True)
+
+    def write(self, folder: int, name: str, content: str):
+        with open(os.path.join(self.dirs[folder], name), 'w') as f:
+            f.write(content)
+
+    def row(self, filename: str) -> File:
+        return File.objects.create(filename=filename, method='batch', time='2024-01-01',
+                                   **{field: 0 for field in SCORE_FIELDS})
+
+    def backfill(self) -> str:
+        out = StringIO()
+        call_command('backfill_content_hash', *self.dirs, sleep=0, stdout=out)
+        return out.getvalue()
+
+    def test_rows_sharing_a_name_get_its_hash(self):
+        self.write(0, 'demo.xml', PROJECT_XML)
+        rows = [self.row('demo.xml'), self.row("b'demo.xml'")]
+        self.backfill()
+        for row in rows:
+            row.refresh_from_db()
+            self.assertEqual(row.content_hash, project_content_hash(PROJECT_XML.encode()))
+
+    def test_names_of_different_files_are_skipped_and_reported(self):
+        self.write(0, 'same.xml', PROJECT_XML)
+        self.write(1, 'same.xml', PROJECT_XML)
+        self.write(0, 'demo.xml', project_variant(1))
+        self.write(1, 'demo.xml', project_variant(2))
+        for name in ['demo.xml', 'demo.xml', 'same.xml']:
+            self.row(name)
+        out = self.backfill()
+        self.assertEqual([row.content_hash for row in File.objects.order_by('pk')],
+                         [None, None, project_content_hash(PROJECT_XML.encode())])
+        self.assertIn('Skipped demo.xml', out)
+        self.assertIn('Done: 1 of 3 rows hashed', out)
+
+
+# ==============================================================================
+# user-042: RESULTADOS EN LA CACHÉ COMPARTIDA, SOLO SU CLAVE EN LA SESIÓN
+# ==============================================================================
+
+def upload(name: str, content: str = PROJECT_XML, mode: str = 'Default') -> dict:
+    # Con declaración XML, para que is_safe_file lo reconozca como text/xml
+    data = ('<?xml version="1.0"?>\n' + content).encode()
+    return {'_upload': '', 'dashboard_mode': mode, 'zipFile': SimpleUploadedFile(name, data)}
+
+
+class DashboardTestCase(TransactionTestCase):
+    """
+    Análisis desde las vistas. Transaccional: las vistas async usan la BD (sesión
+    incluida) desde los hilos del ejecutor de análisis.
+    """
+
+    def setUp(self):
+        analysis_cache.clear()
+        store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store, True)
+        store_override = override_settings(PROJECT_STORE_DIR=store)
+        store_override.enable()
+        self.addCleanup(store_override.disable)
+
+
+class AnalysisResultTests(DashboardTestCase):
+
+    def test_save_and_load(self):
+        key = save_result({'filename': 'demo.xml'})
+        self.assertEqual(load_result(key), {'filename': 'demo.xml'})
+        self.assertEqual(save_result({'filename': 'demo.xml'}, 'fixed'), 'fixed')
+        self.assertIsNone(load_result('missing'))
+        self.assertIsNone(load_result(None))
+
+    def test_the_session_only_keeps_the_key(self):
+        response = self.client.post(reverse('show_dashboard'), upload('demo.xml'))
+        self.assertEqual(response.status_code, 200)
+        session = self.client.session
+        self.assertEqual(set(session.keys()) & {'last_analysis', 'last_analysis_key'}, {'last_analysis_key'})
+        self.assertEqual(load_result(session['last_analysis_key'])['filename'], 'demo.xml')
+
+        # F5: el dashboard se pinta de nuevo desde el almacén, hasta que caduca
+        self.assertContains(self.client.get(reverse('show_dashboard')), 'demo.xml')
+        analysis_cache.clear()
+        self.assertRedirects(self.client.get(reverse('show_dashboard')), '/', fetch_redirect_response=False)
+
+
+# ==============================================================================
+# user-043: PANEL DEL DASHBOARD EN CACHÉ
+# ==============================================================================
+
+class DashboardFragmentTests(DashboardTestCase):
+
+    def test_the_same_project_under_another_name_shows_its_own_name(self):
+        first = self.client.post(reverse('show_dashboard'), upload('first.xml'))
+        second = self.client.post(reverse('show_dashboard'), upload('second.xml'))
+        self.assertContains(first, 'value="first.xml"')
+        self.assertContains(second, 'value="second.xml"')
+        self.assertNotContains(second, 'first.xml')
+
+    def fragments(self) -> int:
+        return sum('template.cache.dashboard_panel' in key for key in analysis_cache._cache)
+
+    def test_one_panel_per_name(self):
+        self.client.post(reverse('show_dashboard'), upload('demo.xml'))
+        self.assertEqual(self.fragments(), 1)
+        self.client.post(reverse('show_dashboard'), upload('demo.xml'))
+        self.assertEqual(self.fragments(), 1)
+        self.client.post(reverse('show_dashboard'), upload('other.xml'))
+        self.assertEqual(self.fragments(), 2)
+
+
+# ==============================================================================
+# user-044: DESCARGA ASÍNCRONA DESDE SNAP!
+# ==============================================================================
+
+class AsyncSnapClientTests(SnapStandInMixin, SimpleTestCase):
+
+    def fetch(self, projectname: str, **options) -> str:
+        async def get_project_xml():
+            client = AsyncSnapClient(base_url=self.snap.url, backoff=0, **options)
+            try:
+                return await client.get_project_xml('alice', projectname)
+            finally:
+                await client.client.aclose()
+        return asyncio.run(get_project_xml())
+
+    def test_downloads_the_project_xml(self):
+        self.assertEqual(self.fetch('demo'), PROJECT_XML)
+
+    def test_follows_redirects_like_the_sync_client(self):
+        self.assertEqual(self.fetch('moved'), PROJECT_XML)
+        self.assertEqual(self.snap.hits['/api/v1/projects/alice/demo'], 1)
+
+    def test_retries_transient_errors_but_not_missing_projects(self):
+        self.assertEqual(self.fetch('flaky', retries=2), PROJECT_XML)
+        self.assertEqual(self.snap.hits['/api/v1/projects/alice/flaky'], 2)
+        with self.assertRaises(DrScratchException):
+            self.fetch('missing', retries=3)
+        self.assertEqual(self.snap.hits['/api/v1/projects/alice/missing'], 1)
+
+    def test_concurrent_downloads_respect_the_host_limit(self):
+        async def fetch_all():
+            client = AsyncSnapClient(base_url=self.snap.url, max_per_host=2, backoff=0)
+            try:
+                return await asyncio.gather(*[client.get_project_xml('alice', f'slow-uniq{n}') for n in range(6)])
+            finally:
+                await client.client.aclose()
+        self.assertEqual(asyncio.run(fetch_all())[3], project_variant('slow-uniq3'))
+        self.assertLessEqual(self.snap.peak, 2)
+
+
+# ==============================================================================
+# user-045: ALMACÉN DE PROYECTOS POR CONTENIDO
+# ==============================================================================
+
+class ProjectStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store, True)
+        settings_override = override_settings(PROJECT_STORE_DIR=self.store, PROJECT_STORE_MAX_AGE=3600,
+                                              PROJECT_STORE_MAX_MB=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.now = time.time()
+
+    def write(self, path: str, age: float, size: int = 10) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (self.now - age, self.now - age))
+        return path
+
+    def test_store_is_addressed_by_content(self):
+        path = store_project(PROJECT_XML.encode())
+        content_hash = project_content_hash(PROJECT_XML)
+        self.assertEqual(path, project_path(content_hash))
+        self.assertEqual(store_project(PROJECT_XML.encode()), path)
+        self.assertEqual(load_stored_project(path), PROJECT_XML)
+        self.assertEqual(load_stored_project(project_path('0' * 64)), '')
+
+    def test_read_upload_rewinds_the_upload(self):
+        upload = SimpleUploadedFile('demo.xml', b'<project/>')
+        upload.read(3)
+        self.assertEqual(read_upload(upload), b'<project/>')
+        self.assertEqual(upload.read(), b'<project/>')
+
+    def test_removes_projects_older_than_max_age(self):
+        old = self.write(project_path('ab' + '0' * 62), age=7200)
+        fresh = self.write(project_path('cd' + '0' * 62), age=60)
+        readme = self.write(os.path.join(self.store, 'README.md'), age=7200)
+        self.assertEqual(evict_projects(self.now), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(readme))
+
+    def test_removes_legacy_uploads(self):
+        legacy = self.write(os.path.join(self.store, 'f00_2020_01_01_00_00_00_1.sb2'), age=7200)
+        batch = self.write(os.path.join(self.store, 'batch_mode', 'job', 'p.sb2'), age=7200)
+        self.assertEqual(evict_projects(self.now), 1)
+        self.assertFalse(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(batch))
+
+    def test_removes_least_recently_used_over_max_size(self):
+        half = 512 * 1024
+        oldest = self.write(project_path('01' + '0' * 62), age=300, size=half)
+        middle = self.write(project_path('02' + '0' * 62), age=200, size=half)
+        newest = self.write(project_path('03' + '0' * 62), age=100, size=half)
+        self.assertEqual(evict_projects(self.now), 1)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertEqual(sorted(path for _, _, path in stored_projects()), sorted([middle, newest]))
+
+
+# ==============================================================================
+# user-046: COMPARACIÓN DE DOS PROYECTOS
+# ==============================================================================
+
+class ComparisonTests(SnapStandInMixin, DashboardTestCase):
+
+    def compare(self, *names):
+        return self.client.post(reverse('show_dashboard'), {
+            'dashboard_mode': 'Comparison', '_urls': '', 'urlProject': [snap_url(name) for name in names],
+        })
+
+    def test_both_projects_are_analysed(self):
+        response = self.compare('demo', 'uniq1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['Original']['url'], snap_url('demo'))
+        self.assertEqual(response.context['New']['extended']['total_points'], [8, 36])
+        self.assertIn('Compare', response.context)
+
+    def test_each_project_is_analysed_once(self):
+        analysed = []
+        original = analyzer.analysis_by_parsed_project
+
+        def spy(request, skill_points, project, filename, url, *args, **kwargs):
+            analysed.append(url)
+            return original(request, skill_points, project, filename, url, *args, **kwargs)
+
+        with mock.patch.object(analyzer, 'analysis_by_parsed_project', spy):
+            self.compare('demo', 'uniq1')
+            self.compare('demo', 'uniq2')
+        self.assertEqual(sorted(analysed), [snap_url('demo'), snap_url('uniq1'), snap_url('uniq2')])
+
+    def test_a_missing_project_is_reported(self):
+        response = self.compare('demo', 'missing')
+        self.assertEqual(response.context['New']['Error'], 'no_exists')
+
+
+# ==============================================================================
+# user-047: NUEVA VERSIÓN FRENTE AL PROYECTO DEL DASHBOARD
+# ==============================================================================
+
+class ProjectVersionTests(SnapStandInMixin, DashboardTestCase):
+
+    def compare_version(self, data: dict):
+        return self.client.post(reverse('get_analysis_d'), data)
+
+    def test_compares_an_uploaded_version(self):
+        self.client.post(reverse('show_dashboard'), upload('v1.xml'))
+        response = self.compare_version(upload('v2.xml', project_variant(2)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'mastery', 'duplicateScript', 'deadCode', 'spriteNaming',
+                                                'backdropNaming', 'scratchGolfing'})
+
+    def test_a_url_project_outlives_its_parse_cache(self):
+        self.client.post(reverse('show_dashboard'), {'dashboard_mode': 'Default', '_url': '',
+                                                     'urlProject': snap_url('demo')})
+        analysis_cache.clear()
+        response = self.compare_version({'_url': '', 'urlProject': snap_url('uniq1')})
+        self.assertEqual(response.status_code, 200)
+
+    def test_an_expired_dashboard_project_is_reported(self):
+        self.client.post(reverse('show_dashboard'), upload('v1.xml'))
+        analysis_cache.clear()
+        shutil.rmtree(settings.PROJECT_STORE_DIR)
+        response = self.compare_version(upload('v2.xml'))
+        self.assertEqual((response.status_code, response.json()), (410, {'error': 'session_expired'}))
+
+    def test_uploaded_versions_are_validated(self):
+        self.client.post(reverse('show_dashboard'), upload('v1.xml'))
+        png = SimpleUploadedFile('v2.xml', b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+        response = self.compare_version({'_upload': '', 'zipFile': png})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'invalid_file_type'}))
+
+
+# ==============================================================================
+# user-048: API NDJSON DE ANÁLISIS MASIVO
+# ==============================================================================
+
+@override_settings(ROOT_URLCONF='drScratch.api_urls', API_TOKENS=['s3cret'])
+class BulkApiTests(SnapStandInMixin, DashboardTestCase):
+
+    def analyze(self, data, token: str = 's3cret', **kwargs):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        response = self.client.post('/api/v1/analyze', data, **headers, **kwargs)
+        if response.streaming:
+            response.lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        return response
+
+    def analyze_urls(self, names: list, token: str = 's3cret', **options):
+        return self.analyze(dict(options, urls=[snap_url(name) for name in names]), token,
+                            content_type='application/json')
+
+    def test_one_line_per_project_and_a_final_line(self):
+        response = self.analyze_urls(['demo', 'missing', 'uniq1'])
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        *lines, done = response.lines
+        by_index = {line['index']: line for line in lines}
+        self.assertEqual(sorted(by_index), [0, 1, 2])
+        self.assertEqual(by_index[0]['points'], [8, 36])
+        self.assertEqual(by_index[1]['error'], 'no_exists')
+        self.assertEqual(by_index[2]['url'], snap_url('uniq1'))
+        self.assertEqual(done, {'done': True, 'version': 1, 'projects': 3, 'errors': 1})
+
+    def test_zip_uploads(self):
+        path = make_zip(os.path.join(settings.PROJECT_STORE_DIR, 'class.zip'),
+                        {'a.xml': project_variant(1), 'b.xml': project_variant(2), 'notes.txt': 'hi'})
+        with open(path, 'rb') as f:
+            response = self.analyze({'file': f, 'urls': snap_url('demo')})
+        *lines, done = response.lines
+        self.assertEqual(sorted((line['index'], line['filename']) for line in lines),
+                         [(0, 'a.xml'), (1, 'b.xml'), (2, snap_url('demo'))])
+        self.assertEqual(done['errors'], 0)
+
+    def test_requires_a_valid_token(self):
+        for token in (None, 'wrong', 's3cret-but-longer'):
+            response = self.analyze_urls(['demo'], token=token)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        with self.settings(API_TOKENS=[]):
+            self.assertEqual(self.analyze_urls(['demo']).status_code, 401)
+
+    def test_uploads_are_validated_like_the_web_form(self):
+        png = SimpleUploadedFile('p.xml', b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+        response = self.analyze({'file': png})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'invalid_file_type'}))
+
+    def test_invalid_requests_get_a_400_before_streaming(self):
+        self.assertEqual(self.analyze_urls(['demo'], rubric='12').status_code, 400)
+        self.assertEqual(self.analyze_urls(['demo'], mode='Comparison').status_code, 400)
+        self.assertEqual(self.analyze_urls([]).status_code, 400)
+
+
+# ==============================================================================
+# user-049: CONTROL DE ADMISIÓN
+# ==============================================================================
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def test_admits_up_to_slots(self):
+        admission = AdmissionController(slots=2, queue_size=0, timeout=1)
+        admission.acquire()
+        admission.acquire()
+        self.assertEqual(admission.running, 2)
+        self.assertEqual(admission.counters['admitted'], 2)
+
+    def test_rejects_at_once_when_queue_is_full(self):
+        admission = AdmissionController(slots=1, queue_size=0, timeout=5)
+        admission.acquire()
+        start = time.monotonic()
+        with self.assertRaises(AnalysisBusy) as busy:
+            admission.acquire()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(busy.exception.reason, 'queue_full')
+        self.assertEqual(busy.exception.retry_after, 5)
+        self.assertEqual(admission.counters['rejected_queue_full'], 1)
+        self.assertEqual((admission.running, admission.waiting), (1, 0))
+
+    def test_rejects_after_timeout(self):
+        admission = AdmissionController(slots=1, queue_size=1, timeout=0.05)
+        admission.acquire()
+        with self.assertRaises(AnalysisBusy) as busy:
+            admission.acquire()
+        self.assertEqual(busy.exception.reason, 'timeout')
+        self.assertEqual(admission.counters['rejected_timeout'], 1)
+        self.assertEqual(admission.waiting, 0)
+
+    def test_zero_timeout_does_not_wait(self):
+        admission = AdmissionController(slots=1, queue_size=4, timeout=5)
+        admission.acquire()
+        start = time.monotonic()
+        with self.assertRaises(AnalysisBusy):
+            admission.acquire(timeout=0)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(admission.waiting, 0)
+
+    def test_release_admits_a_waiting_thread(self):
+        admission = AdmissionController(slots=1, queue_size=1, timeout=5)
+        admission.acquire()
+        admitted = threading.Event()
+
+        def wait_for_slot():
+            admission.acquire()
+            admitted.set()
+
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        time.sleep(0.05)
+        self.assertFalse(admitted.is_set())
+        self.assertEqual(admission.waiting, 1)
+        admission.release()
+        waiter.join(2)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual((admission.running, admission.waiting), (1, 0))
+
+    def test_admit_releases_on_error(self):
+        admission = AdmissionController(slots=1, queue_size=0, timeout=1)
+        with self.assertRaises(ValueError):
+            with admission.admit():
+                raise ValueError
+        self.assertEqual(admission.running, 0)
+        with admission.admit():
+            self.assertEqual(admission.running, 1)
+
+    def test_async_waits_for_release(self):
+        admission = AdmissionController(slots=1, queue_size=1, timeout=2)
+        admission.acquire()
+
+        async def wait_for_slot():
+            asyncio.get_running_loop().call_later(0.05, admission.release)
+            async with admission.admit_async():
+                return admission.running, admission.waiting
+
+        self.assertEqual(asyncio.run(wait_for_slot()), (1, 0))
+        self.assertEqual(admission.running, 0)
+
+    def test_async_queue_full_and_timeout(self):
+        admission = AdmissionController(slots=1, queue_size=1, timeout=0.05)
+        admission.acquire()
+
+        async def two_waiters():
+            return await asyncio.gather(admission.acquire_async(), admission.acquire_async(),
+                                        return_exceptions=True)
+
+        results = sorted(error.reason for error in asyncio.run(two_waiters()))
+        self.assertEqual(results, ['queue_full', 'timeout'])
+        self.assertEqual((admission.running, admission.waiting), (1, 0))
+
+
+class AdmissionMetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def wait_for_metrics(self) -> dict:
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline:
+            metrics = admission_metrics()
+            if metrics['processes']:
+                return metrics
+            time.sleep(0.02)
+        self.fail('metrics were not published')
+
+    def test_metrics_are_written_by_the_publisher_thread(self):
+        writers = []
+
+        def spy(process_id):
+            writers.append(threading.current_thread().name)
+            return register_process(process_id)
+
+        admission = AdmissionController(slots=1, queue_size=0, timeout=1)
+        with mock.patch('app.admission.register_process', spy):
+            admission.acquire()
+            with self.assertRaises(AnalysisBusy):
+                admission.acquire()
+            metrics = self.wait_for_metrics()
+        self.assertTrue(writers)
+        self.assertEqual(set(writers), {'admission-metrics'})
+        self.assertEqual(list(metrics['processes']), [admission.process_id])
+        self.assertEqual(metrics['totals']['running'], 1)
+
+    def test_processes_whose_metrics_expired_are_forgotten(self):
+        register_process('gone:1')
+        AdmissionController(slots=1, queue_size=0, timeout=1).publish()
+        metrics = self.wait_for_metrics()
+        self.assertNotIn('gone:1', metrics['processes'])
+        self.assertNotIn('gone:1', registered_processes())
+
+
+# ==============================================================================
+# user-050: ARRANQUE DE LOS WORKERS
+# ==============================================================================
+
+class StartupImportTests(SimpleTestCase):
+
+    def test_wsgi_does_not_load_async_or_task_dependencies(self):
+        modules = ('app.views', 'httpx', 'celery', 'magic', 'css_inline', 'app.tasks', 'app.pyploma')
+        code = f"import sys, drScratch.wsgi; print(' '.join(m for m in {modules!r} if m in sys.modules))"
+        process = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True,
+                                 text=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        # La URLconf ya está cargada (se comparte entre workers con --preload), sus dependencias pesadas no
+        self.assertEqual(process.stdout.split(), ['app.views'])
+
+    def test_slowest_packages_sums_self_time_per_package(self):
+        report = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       300 |        300 |   lxml.etree",
+            "import time:      1200 |       1500 | lxml",
+            "import time:       500 |        500 |     django.urls",
+            "some warning printed by a module",
+        ])
+        self.assertEqual(StartupBenchmark().slowest_packages(report), [('lxml', 1.5), ('django', 0.5)])
@@ -8,18 +8,16 @@ import zipfile
 import shutil
 import unicodedata
 import logging
-import coloredlogs
 import re
 import csv
 import tempfile
-import magic
 import urllib.parse
 import ipaddress
 from datetime import datetime, timedelta, date
 from zipfile import ZipFile, BadZipfile
 
 # Django imports
-from django.http import HttpResponseRedirect, HttpResponse, JsonResponse, FileResponse
+from django.http import Http404, HttpResponseRedirect, HttpResponse, JsonResponse, FileResponse, StreamingHttpResponse
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from django.contrib import messages
@@ -32,15 +30,19 @@ from django.utils import timezone
 from django.db.models import Avg
 from django.contrib.auth.models import User
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 # App imports (Modelos y Formularios)
-from .models import BatchCSV, FeatureSuggestion, File, CSVs, Organization, OrganizationHash, Coder, Discuss, Stats, ContactMessage
+from .models import BatchCSV, BatchJob, FeatureSuggestion, File, CSVs, Organization, OrganizationHash, Coder, Discuss, Stats, ContactMessage
 from app.forms import UrlForm, OrganizationForm, OrganizationHashForm, LoginOrganizationForm, CoderForm, DiscussForm
-from app.pyploma import generate_certificate
 from app.hairball3.scratchGolfing import ScratchGolfing
+from app.exception import DrScratchException
 
 # Analyzer imports (CRUCIAL: Estas son las funciones que arreglamos para Snap!)
 from .analyzer import (
@@ -50,17 +52,25 @@ from .analyzer import (
     send_request_getsb3, 
     _make_compare, 
     analysis_by_upload, 
-    analysis_by_url
+    analysis_by_url,
+    cached_project_analysis,
+    get_snap_project_xml,
+    project_content_hash,
+    split_xml
 )
 
-# Tasks & Batch utils
-from .tasks import init_batch
+# Batch utils (tasks, magic y pyploma se importan donde se usan: cargarlos aquí arrastra Celery y libmagic a cada worker)
+from .async_analysis import dashboard_project_url, fetch_project_xml, run_analysis
+from .api import api_authorized, api_request_context, read_api_request, stream_api_analysis
+from .admission import AnalysisBusy, admission_metrics, get_admission
+from .results import load_parsed, load_result, permalink_etag, permalink_key, result_exists, rubric_code, save_parsed, save_result
+from .project_store import load_stored_project, project_path, read_upload
+from .stats import global_smell_averages, owner_daily_stats
 from .batch import skills_translation
 from . import batch as batch_utils 
 
-# Configuración de Logs
+# Configuración de Logs (handlers en settings.LOGGING)
 logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG', logger=logger)
 supported_languages = ['es', 'ca', 'gl', 'pt']
 
 # ==============================================================================
@@ -133,6 +143,7 @@ def is_safe_file(uploaded_file, max_size_mb=50):
         file_header = uploaded_file.read(2048)
         uploaded_file.seek(0)
 
+        import magic
         mime_type = magic.from_buffer(file_header, mime=True)
         print(f"[DEBUG SEGURIDAD] Archivo subido. MIME detectado: {mime_type}")
 
@@ -241,6 +252,7 @@ def process_contact_form(request):
 
         header = contact_media.read(2048)
         contact_media.seek(0)
+        import magic
         detected_mime = magic.from_buffer(header, mime=True)
 
         if detected_mime not in ALLOWED_CONTACT_MIMES:
@@ -363,18 +375,16 @@ def compare_uploader(request):
     user = str(identify_user_type(request))
     return render(request, user + '/compare-uploader.html')
 
-def show_dashboard(request, skill_points=None):
+def show_dashboard(request, skill_points=None, project_xml=None):
     user = "main"
     
     if request.method == 'POST':
         # 1. Decodificar rúbrica personalizada de la URL
-        url_code = request.path.split('/')[-1]
-        numbers = base32_to_str(url_code) if url_code else ''
-        skill_rubric = generate_rubric(numbers)
+        skill_rubric = dashboard_rubric(request)
         
         # 2. Ejecutar análisis (Normal, Comparación o Batch)
         # Nota: build_dictionary_with_automatic_analysis ya maneja la lógica de Snap! y errores
-        d = build_dictionary_with_automatic_analysis(request, skill_rubric)
+        d = build_dictionary_with_automatic_analysis(request, skill_rubric, project_xml)
         
         if request.POST.get('dashboard_mode') == 'Comparison':
             return render(request, user + '/dashboard-compare.html', d)
@@ -382,34 +392,12 @@ def show_dashboard(request, skill_points=None):
         # Normalizar respuesta (a veces devuelve dict indexado {0: {...}})
         if isinstance(d, dict) and 0 in d: 
             d = d[0]
-        
-        # 3. Guardar en sesión para recargas (F5)
-        request.session['last_analysis_data'] = d
-        request.session['last_dashboard_mode'] = d.get("dashboard_mode")
-
-        # 5. Manejo de Errores
-        error_type = d.get('Error')
-        if error_type and error_type != 'None':
-            if error_type == 'analyzing': 
-                return render(request, 'error/analyzing.html')
-            elif error_type == 'invalid_file_type':
-                return render(request, user + '/main.html', {'invalid_file_type': True})
-            elif error_type in ['MultiValueDict', 'id_error', 'no_exists']:
-                return render(request, user + '/main.html', {error_type: True})
-
-        # 6. Renderizar Dashboard según modo
-        mode = d.get("dashboard_mode")
-        template_map = {
-            'Personalized': 'dashboard-personal.html',
-            'Recommender': 'dashboard-recommender.html'
-        }
-        template = template_map.get(mode, 'dashboard-default.html')
-        
-        return render(request, user + '/' + template, d)
+        d.setdefault('language', request.LANGUAGE_CODE)
+        return render_dashboard(request, d, skill_rubric)
 
     else:
         # GET Request: Cargar último análisis de la sesión
-        d = request.session.get('last_analysis_data')
+        d = load_result(request.session.get('last_analysis_key'))
         if not d: 
             return redirect('/')
         
@@ -417,16 +405,147 @@ def show_dashboard(request, skill_points=None):
         if dashboard_mode == 'Comparison': 
             return render(request, user + '/dashboard-compare.html', d)
         
-        mode = d.get("dashboard_mode")
-        template_map = {
-            'Personalized': 'dashboard-personal.html',
-            'Recommender': 'dashboard-recommender.html'
-        }
-        template = template_map.get(mode, 'dashboard-default.html')
-        
-        return render(request, user + '/' + template, d)
+        return render(request, user + '/' + dashboard_template(d.get("dashboard_mode")), d)
+
+def dashboard_rubric(request) -> dict:
+    """ Rúbrica personalizada codificada al final de la URL (/show_dashboard/<código>) """
+    url_code = request.path.split('/')[-1]
+    numbers = base32_to_str(url_code) if url_code else ''
+    return generate_rubric(numbers)
+
+def render_dashboard(request, d: dict, skill_rubric: dict):
+    """ Guarda el resultado (recargas y permalink) y pinta el dashboard o su error """
+    user = "main"
+
+    # 3. Guardar para recargas (F5) y para su permalink: el resultado va al almacén,
+    #    en la sesión solo su clave
+    mode = d.get("dashboard_mode") or 'Default'
+    key = None
+    if d.get('content_hash') and d.get('Error') in (None, 'None'):
+        rubric = rubric_code(skill_rubric)
+        key = permalink_key(d['content_hash'], rubric, mode)
+        d['permalink'] = reverse('analysis_permalink', args=[d['content_hash'], rubric, mode])
+    request.session['last_analysis_key'] = save_result(d, key)
+    request.session['last_dashboard_mode'] = d.get("dashboard_mode")
+    # Proyecto del dashboard: get_analysis_d compara sus nuevas versiones con él
+    request.session['current_project_hash'] = d.get('content_hash')
+
+    # 5. Manejo de Errores
+    error_type = d.get('Error')
+    if error_type and error_type != 'None':
+        if error_type == 'analyzing': 
+            return render(request, 'error/analyzing.html')
+        elif error_type == 'invalid_file_type':
+            return render(request, user + '/main.html', {'invalid_file_type': True})
+        elif error_type in ['MultiValueDict', 'id_error', 'no_exists']:
+            return render(request, user + '/main.html', {error_type: True})
+
+    # 6. Renderizar Dashboard según modo
+    return render(request, user + '/' + dashboard_template(mode), dashboard_context(d, key))
+
+def cached_dashboard(request, project_xml=None):
+    """
+    Resultado ya guardado del proyecto enviado (mismo contenido, rúbrica, modo e
+    idioma), o None. Recommender no se reutiliza: depende además de curr_type.
+    """
+    mode = request.POST.get('dashboard_mode') or 'Default'
+    if mode == 'Recommender':
+        return None
+    url = dashboard_project_url(request.POST)
+    content, name = project_xml, url
+    if content is None and '_upload' in request.POST and 'zipFile' in request.FILES:
+        name, url = request.FILES['zipFile'].name, None
+        content = read_upload(request.FILES['zipFile']).decode('utf-8', errors='replace')
+    if not content:
+        return None
+    d = load_result(permalink_key(project_content_hash(content), rubric_code(dashboard_rubric(request)), mode))
+    if d is None or d.get('language') != request.LANGUAGE_CODE:
+        return None
+    # Mismo contenido, quizá con otro nombre o desde otra URL
+    return dict(d, filename=name, url=url)
+
+async def show_dashboard_async(request, skill_points=None):
+    """
+    Variante async de show_dashboard: la descarga desde Snap! no ocupa ningún hilo
+    y el resto (análisis, sesión, plantillas) se ejecuta en el ejecutor acotado.
+    Los análisis pasan por el control de admisión; los proyectos ya analizados se
+    sirven desde caché sin esperar turno.
+    """
+    project_xml = None
+    url = dashboard_project_url(request.POST) if request.method == 'POST' else None
+    if url:
+        try:
+            project_xml = await fetch_project_xml(url)
+        except DrScratchException as e:
+            logger.error(f"Error downloading {url}: {e}")
+            return await run_analysis(render, request, 'main/main.html', {'no_exists': True})
+
+    # La comparación pasa por la admisión proyecto a proyecto (cached_project_analysis)
+    if request.method != 'POST' or request.POST.get('dashboard_mode') == 'Comparison':
+        try:
+            return await run_analysis(show_dashboard, request, skill_points, project_xml)
+        except AnalysisBusy as e:
+            return busy_response(e)
+
+    admission = get_admission()
+    d = await sync_to_async(cached_dashboard, thread_sensitive=False)(request, project_xml)
+    if d is not None:
+        admission.cache_hit()
+        return await run_analysis(render_dashboard, request, d, dashboard_rubric(request))
+    try:
+        async with admission.admit_async():
+            return await run_analysis(show_dashboard, request, skill_points, project_xml)
+    except AnalysisBusy as e:
+        return busy_response(e)
+
+def busy_response(busy, as_json=False) -> HttpResponse:
+    """ 503 inmediato con Retry-After cuando no hay hueco para analizar """
+    if as_json:
+        response = JsonResponse({'error': 'busy', 'retry_after': busy.retry_after}, status=503)
+    else:
+        # Sin contexto de petición: no toca la BD y se puede pintar desde el bucle de eventos
+        response = HttpResponse(render_to_string('error/busy.html', {'retry_after': busy.retry_after}), status=503)
+    response['Retry-After'] = str(busy.retry_after)
+    return response
+
+def dashboard_template(mode) -> str:
+    template_map = {
+        'Personalized': 'dashboard-personal.html',
+        'Recommender': 'dashboard-recommender.html'
+    }
+    return template_map.get(mode, 'dashboard-default.html')
+
+def dashboard_context(d: dict, key=None) -> dict:
+    """
+    Con clave de permalink el panel del dashboard se cachea por idioma. El panel no
+    lleva token CSRF: sus formularios lo reciben al cargar la página (csrf-fill).
+    """
+    if key is None:
+        return d
+    return dict(d, permalink_key=key, fragment_ttl=settings.ANALYSIS_FRAGMENT_TTL)
+
+def analysis_permalink_etag(request, content_hash, rubric, mode):
+    """ ETag del permalink; sin ETag si el resultado ha caducado, para responder 404 y no 304 """
+    if not result_exists(permalink_key(content_hash, rubric, mode)):
+        return None
+    return permalink_etag(content_hash, rubric, mode, request.LANGUAGE_CODE)
+
+@cache_control(private=True, max_age=settings.ANALYSIS_PERMALINK_MAX_AGE)
+@condition(etag_func=analysis_permalink_etag)
+def analysis_permalink(request, content_hash, rubric, mode):
+    """
+    Dashboard de un análisis ya hecho, identificado por contenido, rúbrica y modo.
+    Se sirve desde el almacén de resultados sin volver a analizar; con If-None-Match
+    solo se comprueba que el resultado siga guardado. Es privado: la página lleva
+    el token CSRF del usuario.
+    """
+    key = permalink_key(content_hash, rubric, mode)
+    d = load_result(key)
+    if d is None:
+        raise Http404("Analysis not found")
+    return render(request, 'main/' + dashboard_template(mode), dashboard_context(d, key))
 
-def build_dictionary_with_automatic_analysis(request, skill_points: dict) -> dict:
+def build_dictionary_with_automatic_analysis(request, skill_points: dict, project_xml=None) -> dict:
     dict_metrics = {}
     project_counter = 0
     dashboard_mode = 'Default'
@@ -450,7 +569,7 @@ def build_dictionary_with_automatic_analysis(request, skill_points: dict) -> dic
         elif '_url_recom' in request.POST:
             url = request.POST.get('urlProject_recom',)
             if url:
-                dict_metrics[project_counter] = analysis_by_url(request, url, skill_points)
+                dict_metrics[project_counter] = analysis_by_url(request, url, skill_points, project_xml)
             else:
                 dict_metrics[project_counter] =  {'Error': 'MultiValueDict'}
                 
@@ -464,7 +583,7 @@ def build_dictionary_with_automatic_analysis(request, skill_points: dict) -> dic
                 try:
                     # Usamos analysis_by_url directamente.
                     # Esta función se encarga de descargar y analizar.
-                    dict_metrics[project_counter] = analysis_by_url(request, url, skill_points)
+                    dict_metrics[project_counter] = analysis_by_url(request, url, skill_points, project_xml)
                 except Exception as e:
                     print(f"Error en Dashboard con URL {url}: {e}")
                     dict_metrics[project_counter] = {'Error': 'Error analyzing project', 'details': str(e)}
@@ -490,6 +609,7 @@ def download_certificate(request):
     lang_code = request.LANGUAGE_CODE if is_supported_language(request.LANGUAGE_CODE) else 'en'
     
     # 2. Generar PDF (Llama a app.pyploma)
+    from app.pyploma import generate_certificate
     generate_certificate(latex_name, level, lang_code)
     
     # 3. Servir el archivo
@@ -520,8 +640,13 @@ def get_recommender(request, skill_points=None):
         # Generamos rúbrica por defecto
         skill_rubric = generate_rubric('')
         
-        # Ejecutamos análisis (la función lee los datos directamente del request.POST)
-        d = build_dictionary_with_automatic_analysis(request, skill_rubric)
+        # Ejecutamos análisis (la función lee los datos directamente del request.POST).
+        # Sin esperar turno: la vista corre en el hilo que comparte todo el worker ASGI
+        try:
+            with get_admission().admit(timeout=0):
+                d = build_dictionary_with_automatic_analysis(request, skill_rubric)
+        except AnalysisBusy as e:
+            return busy_response(e, as_json=True)
         
         # Normalizamos la respuesta si viene indexada
         if isinstance(d, dict) and 0 in d: 
@@ -536,18 +661,64 @@ def get_recommender(request, skill_points=None):
     else:
         return HttpResponseRedirect('/')
 
+def dashboard_project(request):
+    """
+    Proyecto parseado del dashboard actual: de la caché de parseo o, si caducó,
+    de su copia en el almacén de proyectos. None si ya no está en ninguna.
+    """
+    content_hash = request.session.get('current_project_hash')
+    if not content_hash:
+        return None
+    json_project = load_parsed(content_hash)
+    if json_project is None:
+        content = load_stored_project(project_path(content_hash))
+        if not content:
+            return None
+        json_project = split_xml(request, content)
+        save_parsed(content_hash, json_project)
+    return json_project
+
+def posted_project(request) -> tuple:
+    """ (contenido, nombre, url) de la nueva versión enviada por el formulario """
+    if '_upload' in request.POST and 'zipFile' in request.FILES:
+        upload = request.FILES['zipFile']
+        # Misma validación que la subida del formulario principal
+        if not is_safe_file(upload):
+            return {'Error': 'invalid_file_type'}, upload.name, None
+        return read_upload(upload).decode('utf-8', errors='replace'), upload.name, None
+    url = (request.POST.get('urlProject') or '').strip()
+    if not url:
+        return {'Error': 'MultiValueDict'}, None, None
+    info_project = return_scratch_project_identifier(url)
+    if info_project['platform'] == 'error':
+        return {'Error': 'id_error'}, url, url
+    try:
+        return get_snap_project_xml(info_project['username'], info_project['projectname']), url, url
+    except DrScratchException:
+        return {'Error': 'no_exists'}, url, url
+
 def get_analysis_d(request, skill_points=None):
+    """
+    Compara el proyecto del dashboard con su nueva versión. Los dos lados salen de
+    las cachés de resultados y de parseo por contenido: solo se analiza lo que no se
+    había analizado ya, y ScratchGolfing trabaja sobre los proyectos cacheados.
+    """
     if request.method == 'POST':
         url = request.path.split('/')[-1]
         numbers = base32_to_str(url) if url else ''
         skill_rubric = generate_rubric(numbers)
-        path_original_project = request.session.get('current_project_path', None)
-        if path_original_project != None:
-            json_scratch_original = load_json_project(path_original_project)
-        d = build_dictionary_with_automatic_analysis(request, skill_rubric) 
-        path_compare_project = request.session.get('current_project_path', None)
-        if path_compare_project != None:
-            json_scratch_compare = load_json_project(path_compare_project)
+        json_scratch_original = dashboard_project(request)
+        if json_scratch_original is None:
+            # El proyecto del dashboard caducó: hay que volver a analizarlo
+            return JsonResponse({'error': 'session_expired'}, status=410)
+        content, filename, project_url = posted_project(request)
+        try:
+            d, json_scratch_compare = cached_project_analysis(request, skill_rubric, content, filename, project_url,
+                                                              admission_timeout=0)
+        except AnalysisBusy as e:
+            return busy_response(e, as_json=True)
+        if d.get('Error') not in (None, 'None'):
+            return JsonResponse({'error': d['Error']}, status=400)
         dict_scratch_golfing = ScratchGolfing(json_scratch_original, json_scratch_compare).finalize()
         dict_scratch_golfing = dict_scratch_golfing['result']['scratch_golfing']
         user = str(identify_user_type(request))
@@ -653,6 +824,45 @@ def search_hashkey(request):
              return JsonResponse({"exist": "yes"}) 
     return JsonResponse({"exist": "no"})
 
+@csrf_exempt
+def api_v1_analyze(request):
+    """
+    API v1 para integraciones (LMS): analiza muchos proyectos (URLs y/o un ZIP) y
+    responde con una línea NDJSON por proyecto según termina cada uno, más una
+    línea final {"done": true, ...}.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    # Sin CSRF ni sesión: la autenticación es el token de la cabecera
+    if not api_authorized(request):
+        response = JsonResponse({'error': 'unauthorized'}, status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    # Misma validación de tipo y tamaño que las subidas del formulario
+    upload = request.FILES.get('file')
+    if upload is not None and not is_safe_file(upload):
+        return JsonResponse({'error': 'invalid_file_type'}, status=400)
+    try:
+        job = read_api_request(request)
+    except DrScratchException as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    context = api_request_context(request, job['mode'])
+    response = StreamingHttpResponse(
+        stream_api_analysis(context, generate_rubric(job['rubric']), job),
+        content_type='application/x-ndjson'
+    )
+    # Sin búfer en proxies: cada línea debe llegar en cuanto está lista
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def api_v1_load(request):
+    """ Métricas del control de admisión (análisis en curso, cola, rechazos) para staff """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    return JsonResponse(admission_metrics())
+
 # ==============================================================================
 # 4. BATCH MODE & CSVS
 # ==============================================================================
@@ -678,7 +888,8 @@ def batch_mode_view(request):
 
 def batch_analyze(request):
     """
-    Procesa la subida del archivo Batch (POST).
+    Procesa la subida del archivo Batch (POST): valida el fichero, encola el
+    análisis en Celery y devuelve enseguida el identificador del trabajo.
     """
     if request.method == 'POST' and request.FILES.get('batchFile'):
         uploaded_file = request.FILES['batchFile']
@@ -690,69 +901,33 @@ def batch_analyze(request):
             )
 
         filename = uploaded_file.name.lower()
-        batch_results = {}
-        project_counter = 0
         skill_rubric = generate_rubric('')
+        job_id = str(uuid.uuid4())
 
         try:
             # CASO A: ZIP
             if filename.endswith('.zip'):
-                with zipfile.ZipFile(uploaded_file, 'r') as z:
-
-                    # Anti-Zip Bomb y límite de ficheros — PRIMERA PASADA (solo leer índice, no extraer)
-                    MAX_EXTRACT_SIZE = 100 * 1024 * 1024  # 100 MB
-                    MAX_FILES_IN_ZIP = 500
-                    extracted_size = 0
-                    file_count = 0
-                    for zip_info in z.infolist():
-                        file_count += 1
-                        if file_count > MAX_FILES_IN_ZIP:
-                            return HttpResponse(
-                                "Error de seguridad: ZIP con demasiados archivos.",
-                                status=400
-                            )
-                        extracted_size += zip_info.file_size
-                        if extracted_size > MAX_EXTRACT_SIZE:
-                            return HttpResponse(
-                                "Error de seguridad: ZIP rechazado, supera el límite de tamaño descomprimido (posible Zip Bomb).",
-                                status=400
-                            )
-
-                    # SEGUNDA PASADA — ZIP es seguro, procesar ficheros
-                    for zip_info in z.infolist():
-                        name = zip_info.filename
-
-                        # Saltar directorios, archivos ocultos y del sistema
-                        if name.endswith('/') or name.startswith('__') or name.startswith('.'):
-                            continue
-
-                        # Solo procesar XML (proyectos Snap!)
-                        if not name.lower().endswith('.xml'):
-                            continue
-
-                        # Zip Slip: verificar que el nombre no escapa
-                        safe_name = os.path.basename(name)
-                        if not safe_name:
-                            logger.warning(f"SECURITY: Zip Slip bloqueado para '{name}'")
-                            continue
-
-                        try:
-                            file_content = z.read(name)
-                            temp_file = SimpleUploadedFile(safe_name, file_content)
-                            analysis = analysis_by_upload(request, skill_rubric, temp_file)
-                            analysis['filename'] = safe_name
-                            analysis['url'] = "ZIP Upload"
-                            batch_results[project_counter] = analysis
-                            project_counter += 1
-                        except Exception as e:
-                            print(f"Error analizando {safe_name}: {e}")
+                # Anti-Zip Bomb, Zip Slip y límite de ficheros en una sola pasada por el índice
+                with zipfile.ZipFile(uploaded_file, 'r') as zip_file:
+                    num_projects = len(batch_utils.scan_batch_zip(zip_file))
+                    if not num_projects:
+                        return HttpResponse("No se encontraron proyectos válidos para analizar.", status=400)
+
+                # El worker lee los proyectos directamente de este ZIP (sin extraerlo)
+                batch_dir = os.path.abspath(os.path.join(settings.MEDIA_ROOT, 'uploads', 'batch_mode'))
+                os.makedirs(batch_dir, exist_ok=True)
+                projects_file = os.path.join(batch_dir, f'{job_id}.zip')
+                uploaded_file.seek(0)
+                with open(projects_file, 'wb') as destination:
+                    for chunk in uploaded_file.chunks():
+                        destination.write(chunk)
 
             # CASO B: TXT con URLs
             elif filename.endswith('.txt'):
                 content = uploaded_file.read().decode('utf-8')
-                urls = content.splitlines()
+                projects_file = []
 
-                for url in urls:
+                for url in content.splitlines():
                     url = url.strip()
                     if not url:
                         continue
@@ -760,38 +935,13 @@ def batch_analyze(request):
                     # Validación SSRF antes de hacer fetch
                     if not is_safe_url(url):
                         logger.warning(f"SECURITY: URL bloqueada en batch TXT: {url}")
-                        batch_results[project_counter] = {
-                            'filename': url,
-                            'url': url,
-                            'Error': 'URL bloqueada por política de seguridad',
-                            'mastery': {'points': 0}
-                        }
-                        project_counter += 1
-                        continue
-
-                    try:
-                        analysis = analysis_by_url(request, url, skill_rubric)
-
-                        if not analysis:
-                            analysis = {'Error': 'No data returned', 'mastery': {'points': 0}}
-
-                        if analysis.get('Error'):
-                            print(f"Error reportado para {url}: {analysis.get('Error')}")
-
-                        analysis['filename'] = url
-                        analysis['url'] = url
-                        batch_results[project_counter] = analysis
-                        project_counter += 1
+                        projects_file.append({'url': url, 'Error': 'URL bloqueada por política de seguridad'})
+                    else:
+                        projects_file.append({'url': url})
 
-                    except Exception as e:
-                        print(f"Excepción analizando {url}: {e}")
-                        batch_results[project_counter] = {
-                            'filename': url,
-                            'url': url,
-                            'Error': f'Exception: {str(e)}',
-                            'mastery': {'points': 0}
-                        }
-                        project_counter += 1
+                if not projects_file:
+                    return HttpResponse("No se encontraron proyectos válidos para analizar.", status=400)
+                num_projects = len(projects_file)
 
             else:
                 return HttpResponse(
@@ -799,33 +949,87 @@ def batch_analyze(request):
                     status=400
                 )
 
+        except DrScratchException as e:
+            return HttpResponse(str(e), status=400)
         except Exception as e:
             return HttpResponse(f"Error procesando el archivo: {e}", status=400)
 
-        # Generar CSVs
-        if batch_results:
-            try:
-                batch_id = batch_utils.create_csv(request, batch_results)
-                batch_obj = BatchCSV.objects.get(id=batch_id)
-                zip_filepath = batch_obj.filepath
-
-                if os.path.exists(zip_filepath):
-                    zip_file = open(zip_filepath, 'rb')
-                    response = FileResponse(zip_file, content_type='application/zip')
-                    response['Content-Disposition'] = f'attachment; filename="DrSnap_Batch_{batch_id}.zip"'
-                    return response
-                else:
-                    return HttpResponse("Error: El archivo ZIP no se encuentra.", status=500)
+        request_data = {
+            'POST': {
+                'dashboard_mode': request.POST.get('dashboard_mode', 'Default'),
+                'email': request.POST.get('email', ''),
+                'urlsFile': projects_file,
+            },
+            'LANGUAGE_CODE': request.LANGUAGE_CODE,
+        }
+        # Cola según el tamaño del lote; el reparto justo entre organizaciones lo hace init_batch
+        from .tasks import batch_queue, init_batch
+        init_batch.apply_async(
+            args=(request_data, skill_rubric, batch_organization(request)),
+            task_id=job_id, queue=batch_queue(num_projects), priority=settings.BATCH_TOP_PRIORITY
+        )
 
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                return HttpResponse(f"Error generando los CSVs detallados: {e}", status=500)
-        else:
-            return HttpResponse("No se encontraron proyectos válidos para analizar.", status=400)
+        return JsonResponse({
+            'job': job_id,
+            'status': reverse('batch_status', args=[job_id]),
+            'download': reverse('batch_download', args=[job_id]),
+        }, status=202)
 
     return HttpResponseRedirect('/')
 
+def batch_organization(request) -> str:
+    """
+    Cliente al que se cuenta el lote para el reparto justo: el usuario autenticado o,
+    si es anónimo, su sesión (así los anónimos no compiten como un único cliente)
+    """
+    if request.user.is_authenticated:
+        return request.user.username
+    if request.session.session_key is None:
+        request.session.save()
+    return f'anon:{request.session.session_key}'
+
+def owned_batch_job(request, job_id):
+    """
+    Trabajo batch del mismo cliente que lo lanzó (usuario o sesión anónima), o None
+    si aún no existe. El de otro cliente da 404, igual que uno inexistente.
+    """
+    job = BatchJob.objects.filter(id=job_id).first()
+    if job is not None and job.organization != batch_organization(request):
+        raise Http404("Batch job not found")
+    return job
+
+def batch_status(request, job_id):
+    """
+    Estado de un trabajo batch (progreso, rendimiento por etapa y ETA) que la
+    página del lote consulta periódicamente y, cuando ha terminado, el enlace
+    de descarga. Si el worker aún no lo ha empezado, está en cola.
+    """
+    job = owned_batch_job(request, job_id)
+    if job is None:
+        return JsonResponse({'job': str(job_id), 'state': 'queued'})
+    status = batch_utils.batch_progress(job)
+    if status['state'] == 'done':
+        status['download'] = reverse('batch_download', args=[job_id])
+    return JsonResponse(status)
+
+def batch_download(request, job_id):
+    """
+    Descarga el ZIP con los CSV de un trabajo batch terminado (solo su cliente).
+    """
+    job = owned_batch_job(request, job_id)
+    if job is None:
+        raise Http404("Batch job not found")
+    if job.state != 'done' or job.csv is None:
+        return JsonResponse({'job': str(job.id), 'state': job.state}, status=409)
+
+    zip_filepath = job.csv.filepath
+    if not os.path.exists(zip_filepath):
+        return HttpResponse("Error: El archivo ZIP no se encuentra.", status=404)
+
+    response = FileResponse(open(zip_filepath, 'rb'), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="DrSnap_Batch_{job.csv.id}.zip"'
+    return response
+
 def analyze_csv(request):
     """
     (Legacy) Sube un archivo CSV y lo guarda en el servidor.
@@ -1156,105 +1360,6 @@ def reset_password_confirm(request, uidb64=None, token=None, *arg, **kwargs):
     else:
         return render(request, f'{page}/main.html')
 
-def calc_num_projects(batch_path: str) -> int:
-    """ Calcula recursivamente cuántos archivos hay en el directorio temporal """
-    num_projects = 0
-    for root, dirs, files in os.walk(batch_path):
-        # Filtramos archivos ocultos o del sistema (__MACOSX, .DS_Store)
-        valid_files = [f for f in files if not f.startswith('.') and not f.startswith('__')]
-        num_projects += len(valid_files)
-    return num_projects
-    
-def extract_batch_projects(projects_file: object) -> str:
-    """
-    Extrae el ZIP subido a una carpeta temporal y devuelve la ruta.
-    Protección contra: Zip Bombs, Zip Slip, archivos corruptos y exceso de ficheros.
-    """
-    project_name = str(uuid.uuid4())
-    unique_id = '{}_{}'.format(
-        project_name,
-        datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f")
-    )
-
-    extraction_path = os.path.join(settings.MEDIA_ROOT, 'uploads', 'batch_mode', unique_id)
-
-    MAX_EXTRACT_SIZE = 100 * 1024 * 1024  # 100 MB descomprimido
-    MAX_FILES_IN_ZIP = 500
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_file_path = os.path.join(temp_dir, projects_file.name)
-
-        with open(temp_file_path, 'wb+') as temp_file:
-            for chunk in projects_file.chunks():
-                temp_file.write(chunk)
-
-        try:
-            with ZipFile(temp_file_path, 'r') as zip_ref:
-
-                # Comprobación previa sin extraer
-                extracted_size = 0
-                file_count = 0
-                for zip_info in zip_ref.infolist():
-                    file_count += 1
-                    if file_count > MAX_FILES_IN_ZIP:
-                        raise Exception(
-                            f"SECURITY: ZIP rechazado — demasiados archivos "
-                            f"(más de {MAX_FILES_IN_ZIP})."
-                        )
-                    extracted_size += zip_info.file_size
-                    if extracted_size > MAX_EXTRACT_SIZE:
-                        raise Exception(
-                            "SECURITY: ZIP rechazado — supera el límite de "
-                            "tamaño al descomprimir (posible Zip Bomb)."
-                        )
-
-                # Extracción segura con protección Zip Slip
-                os.makedirs(extraction_path, exist_ok=True)
-                real_extraction_path = os.path.realpath(extraction_path)
-
-                for zip_info in zip_ref.infolist():
-                    dest_path = os.path.realpath(
-                        os.path.join(real_extraction_path, zip_info.filename)
-                    )
-                    if not dest_path.startswith(real_extraction_path + os.sep):
-                        raise Exception(
-                            f"SECURITY: Zip Slip detectado en '{zip_info.filename}'. "
-                            "Extracción abortada."
-                        )
-                    zip_ref.extract(zip_info, real_extraction_path)
-
-        except BadZipfile:
-            if os.path.exists(extraction_path):
-                shutil.rmtree(extraction_path)
-            raise Exception("El archivo subido no es un ZIP válido o está corrupto.")
-
-        except Exception as e:
-            if os.path.exists(extraction_path):
-                shutil.rmtree(extraction_path)
-            raise e
-
-    return extraction_path
-
-    def calc_eta(num_projects: int) -> str:
-    """ Calcula el tiempo estimado basado en los últimos 10 lotes """
-    last_ten = BatchCSV.objects.all().order_by('-date')[:10]
-    if not last_ten: return "Calculating..."
-    
-    try:
-        # Evitamos división por cero si un batch antiguo falló y tiene 0 proyectos
-        anal_time = sum(batch.task_time / batch.num_projects for batch in last_ten if batch.num_projects > 0) / 10
-        mean_tm = anal_time * num_projects
-        
-        hours = int(mean_tm // 3600)
-        minutes = int((mean_tm % 3600) // 60)
-        seconds = round(mean_tm % 60, 2)
-        
-        return f'{hours}h: {minutes}min: {seconds}s'
-    except Exception:
-        return "Calculating..."
-
-
-        
 '''
 # ==============================================================================
 # 6. ESTADÍSTICAS Y DESCARGAS
@@ -1263,70 +1368,48 @@ def extract_batch_projects(projects_file: object) -> str:
 def stats(request, username):
     """ 
     Genera las estadísticas visuales (Gráficos) para Organizaciones y Coders.
-    Optimizado para reducir consultas a la base de datos.
+    Usa los agregados diarios materializados: el número de consultas no depende
+    de la antigüedad de la cuenta ni del tamaño de la tabla File.
     """
-    # 1. Identificar usuario y obtener sus archivos
+    # 1. Identificar usuario
     if Organization.objects.filter(username=username).exists():
         user = Organization.objects.get(username=username)
-        files = File.objects.filter(organization=username)
         page = 'organization'
     elif Coder.objects.filter(username=username).exists():
         user = Coder.objects.get(username=username)
-        files = File.objects.filter(coder=username)
         page = 'coder'
     else:
         # Si el usuario no existe en ninguna tabla específica
         return HttpResponseRedirect("/")
 
-    # 2. Calcular puntuación diaria (Gráfico de línea)
+    # 2. Puntuación diaria (gráfico de línea) desde los agregados diarios del usuario
     date_joined = user.date_joined.date()
     end_date = datetime.today().date()
     date_list = date_range(date_joined, end_date)
-    
+    days = owner_daily_stats(username)
+
     mydates = []
     daily_score = []
-    
     for n in date_list:
         mydates.append(n.strftime("%d/%m"))
-        # Filtramos por fecha exacta (usando __date para comparar con objeto date)
-        points = files.filter(time__date=n).aggregate(Avg("score"))["score__avg"]
-        daily_score.append(int(points) if points is not None else 0)
-
-    # 3. Calcular métricas de habilidades (Gráfico de araña)
-    # Inicializamos a 0
-    skill_metrics = {
-        "Parallelism": 0, "abstraction": 0, "logic": 0, 
-        "synchronization": 0, "flowControl": 0, 
-        "userInteractivity": 0, "dataRepresentation": 0
+        day = days.get(n)
+        daily_score.append(int(day.score / day.projects) if day and day.projects else 0)
+
+    # 3. Métricas de habilidades (gráfico de araña) con los mismos agregados
+    skill_fields = {
+        "Parallelism": "parallelization", "abstraction": "abstraction", "logic": "logic",
+        "synchronization": "synchronization", "flowControl": "flowControl",
+        "userInteractivity": "userInteractivity", "dataRepresentation": "dataRepresentation"
     }
-    
-    if files.exists():
-        # Agregamos todas las medias en una sola consulta
-        avgs = files.aggregate(
-            Avg("Parallelism"), Avg("abstraction"), Avg("logic"), 
-            Avg("synchronization"), Avg("flowControl"), 
-            Avg("userInteractivity"), Avg("dataRepresentation")
-        )
-        # Limpiamos los resultados (None -> 0, float -> int)
-        for key, val in avgs.items():
-            clean_key = key.replace("__avg", "") # ej: Parallelism__avg -> Parallelism
-            skill_metrics[clean_key] = int(val) if val else 0
-
-    # 4. Calcular métricas globales de Code Smells (Comparativa global)
-    # Nota: Compara contra TODOS los archivos del sistema, no solo los del usuario
-    all_files = File.objects.all()
-    global_smells = all_files.aggregate(
-        Avg("deadCode"), Avg("duplicateScript"), 
-        Avg("spriteNaming"), Avg("initialization")
-    )
-    
-    code_smell_rate = {
-        "deadCode": int(global_smells["deadCode__avg"] or 0),
-        "duplicateScript": int(global_smells["duplicateScript__avg"] or 0),
-        "spriteNaming": int(global_smells["spriteNaming__avg"] or 0),
-        "initialization": int(global_smells["initialization__avg"] or 0)
+    total_projects = sum(day.projects for day in days.values())
+    skill_metrics = {
+        key: int(sum(getattr(day, field) for day in days.values()) / total_projects) if total_projects else 0
+        for key, field in skill_fields.items()
     }
 
+    # 4. Métricas globales de Code Smells (comparativa con TODOS los análisis, en caché)
+    code_smell_rate = global_smell_averages()
+
     dic = {
         "date": mydates, 
         "username": username, 
@@ -1406,7 +1489,7 @@ def statistics(request):
                 "skillRate": { 
                     "Parallelism": obj.parallelization, "abstraction": obj.abstraction, 
                     "logic": obj.logic, "synchronization": obj.synchronization, 
-                    "flowControl": obj.flow_control, "userInteractivity": obj.userInteractivity, 
+                    "flowControl": obj.flowControl, "userInteractivity": obj.userInteractivity, 
                     "dataRepresentation": obj.dataRepresentation 
                 },
                 "codeSmellRate": { 
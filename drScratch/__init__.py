@@ -1 +0,0 @@
-from celery import app as batch_mode
@@ -0,0 +1,11 @@
+# URLconf of the api service (WSGI, port 8001), selected with ROOT_URLCONF.
+# The NDJSON bulk API streams for the whole job: on the ASGI web service Django 4.1
+# would iterate it on the event loop and block the worker, so it is only routed here.
+from django.urls import re_path as url
+from app import views as app_views
+
+
+urlpatterns = [
+    url(r'^api/v1/analyze$', app_views.api_v1_analyze, name='api_v1_analyze'),
+    url(r'^api/v1/load$', app_views.api_v1_load, name='api_v1_load'),
+]
@@ -0,0 +1,18 @@
+"""
+ASGI config for DrScratch project.
+
+Serves the async views (URL analysis) without tying up a worker while Snap!
+responds. Run with: gunicorn drScratch.asgi:application -k uvicorn.workers.UvicornWorker --preload
+"""
+
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "drScratch.settings")
+
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
+
+# Load the URLconf and the async Snap! client now instead of on the first request.
+# With --preload this happens once in the master and is shared by every worker.
+import httpx  # noqa: F401
+from django.urls import get_resolver
+get_resolver().url_patterns
@@ -62,9 +62,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'drScratch.urls'
+# The api service sets ROOT_URLCONF=drScratch.api_urls: the streaming NDJSON API is only
+# routed there (WSGI), never on the ASGI web service
+ROOT_URLCONF = os.environ.get('ROOT_URLCONF', 'drScratch.urls')
 
 WSGI_APPLICATION = 'drScratch.wsgi.application'
+ASGI_APPLICATION = 'drScratch.asgi.application'
 
 DATABASES = {
     'default': {
@@ -120,11 +123,151 @@ EMAIL_HOST = 'smtp.gmail.com'
 
 # Celery and RabbitMQ config
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
-CELERY_RESULT_BACKEND = 'rpc://'
+# Task results (job and CSV ids) are kept in Redis
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_WORKER_CONCURRENCY = int(os.environ.get('CELERY_WORKER_CONCURRENCY', os.cpu_count() or 1))
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Batch tasks ack late; requeue them if the worker dies so the job resumes
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+
+# Separate queues so big batches cannot starve the rest: interactive work, batches of up
+# to BATCH_SMALL_MAX_PROJECTS projects and bulk batches. Priorities follow RabbitMQ
+# (higher runs first) and are used for the per-organization fair share of batch chunks.
+# Declared as dicts (Celery builds the kombu Queues) so web processes never import kombu
+CELERY_TASK_QUEUES = {
+    name: {'exchange': name, 'routing_key': name, 'queue_arguments': {'x-max-priority': 10}}
+    for name in ('interactive', 'batch_small', 'batch_bulk')
+}
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_QUEUE_MAX_PRIORITY = 10
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_TASK_ROUTES = {
+    'app.tasks.init_batch': {'queue': 'batch_bulk'},
+    'app.tasks.analyze_batch_chunk': {'queue': 'batch_bulk'},
+    'app.tasks.finish_batch': {'queue': 'batch_bulk'},
+}
+BATCH_SMALL_MAX_PROJECTS = int(os.environ.get('BATCH_SMALL_MAX_PROJECTS', 50))
+# Fair share: a batch chunk loses one priority level per BATCH_FAIR_SHARE_STEP projects
+# of the same organization queued ahead of it
+BATCH_TOP_PRIORITY = 8
+BATCH_FAIR_SHARE_STEP = int(os.environ.get('BATCH_FAIR_SHARE_STEP', 100))
+
+# Batch mode: projects per subtask (fixed, whatever the batch size) and max subtasks one
+# organization has queued or running at once; the next chunk is sent when one finishes
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 10))
+BATCH_ORG_MAX_RUNNING_CHUNKS = int(os.environ.get('BATCH_ORG_MAX_RUNNING_CHUNKS', 4))
+# Times the projects of a failed chunk are dispatched again before they get an error row
+BATCH_MAX_RETRIES = int(os.environ.get('BATCH_MAX_RETRIES', 2))
+
+# Batch pipeline (fetch -> parse -> analyse -> persist): threads per stage and queue size
+BATCH_QUEUE_SIZE = int(os.environ.get('BATCH_QUEUE_SIZE', 16))
+BATCH_FETCH_WORKERS = int(os.environ.get('BATCH_FETCH_WORKERS', 8))
+BATCH_PARSE_WORKERS = int(os.environ.get('BATCH_PARSE_WORKERS', 1))
+BATCH_ANALYZE_WORKERS = int(os.environ.get('BATCH_ANALYZE_WORKERS', 2))
+
+# Batch projects are parsed and analysed in a pool of child processes with per-project
+# limits: wall clock (child killed), CPU seconds and resident memory. Projects over a
+# limit get a 'timeout'/'too_large' error row and their XML is copied to error_analyzing/
+BATCH_ISOLATION = os.environ.get('BATCH_ISOLATION', 'True').lower() == 'true'
+BATCH_PROJECT_TIMEOUT = float(os.environ.get('BATCH_PROJECT_TIMEOUT', 60))
+BATCH_PROJECT_CPU_LIMIT = float(os.environ.get('BATCH_PROJECT_CPU_LIMIT', 45))
+BATCH_PROJECT_MAX_RSS_MB = int(os.environ.get('BATCH_PROJECT_MAX_RSS_MB', 1024))
+BATCH_CHILD_MAX_TASKS = int(os.environ.get('BATCH_CHILD_MAX_TASKS', 200))
+
+# Batch File rows are written with one bulk_create every BATCH_DB_BUFFER projects
+BATCH_DB_BUFFER = int(os.environ.get('BATCH_DB_BUFFER', 50))
+
+# Analysed results kept per pipeline to copy them to projects with identical content
+BATCH_DEDUP_CACHE = int(os.environ.get('BATCH_DEDUP_CACHE', 256))
+
+# Besides main.csv and the long findings.csv, also build the wide per-smell CSVs
+BATCH_WIDE_CSV = os.environ.get('BATCH_WIDE_CSV', 'True').lower() == 'true'
+
+# Batch progress: previous projects used to fit the time-per-size model of the ETA
+BATCH_ETA_HISTORY = int(os.environ.get('BATCH_ETA_HISTORY', 2000))
+BATCH_ETA_DEFAULT_SECONDS = float(os.environ.get('BATCH_ETA_DEFAULT_SECONDS', 2))
+
+# Analysis results are kept in the shared cache; sessions only hold their key
+ANALYSIS_RESULT_TTL = int(os.environ.get('ANALYSIS_RESULT_TTL', 7 * 24 * 3600))
+# Parsed projects (get_analysis_d) are much larger than results: kept for a short while
+ANALYSIS_PARSED_TTL = int(os.environ.get('ANALYSIS_PARSED_TTL', 3600))
+# Permalinks (/analysis/<hash>/<rubric>/<mode>): private browser max-age and per-language
+# cache of the rendered dashboard panel
+ANALYSIS_PERMALINK_MAX_AGE = int(os.environ.get('ANALYSIS_PERMALINK_MAX_AGE', 3600))
+ANALYSIS_FRAGMENT_TTL = int(os.environ.get('ANALYSIS_FRAGMENT_TTL', 24 * 3600))
+
+# Projects are analysed from memory; the copy of the dashboard's project (read again by the
+# version comparison once its parsed form expires) goes to a content-addressed store
+# bounded by size and age
+PROJECT_STORE_DIR = os.environ.get('PROJECT_STORE_DIR', os.path.join(BASE_DIR, 'uploads'))
+PROJECT_STORE_MAX_MB = int(os.environ.get('PROJECT_STORE_MAX_MB', 512))
+PROJECT_STORE_MAX_AGE = int(os.environ.get('PROJECT_STORE_MAX_AGE', 24 * 3600))
+PROJECT_STORE_EVICT_INTERVAL = int(os.environ.get('PROJECT_STORE_EVICT_INTERVAL', 300))
+
+# NDJSON bulk API (/api/v1/analyze): projects per request and lines buffered ahead of a slow client
+API_MAX_PROJECTS = int(os.environ.get('API_MAX_PROJECTS', 500))
+API_STREAM_BUFFER = int(os.environ.get('API_STREAM_BUFFER', 16))
+# Bearer tokens accepted by the NDJSON API (comma separated); with none set the API is closed
+API_TOKENS = [token.strip() for token in os.environ.get('API_TOKENS', '').split(',') if token.strip()]
+
+# Shared cache (batch progress, stage stats, analysis results) so web and Celery workers see the same data
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://redis:6379/1'),
+    },
+    # Analysis results, permalinks, parsed projects and dashboard fragments. A separate
+    # instance with maxmemory and allkeys-lru, so it cannot fill the one holding Celery
+    # results and batch progress
+    'analysis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('ANALYSIS_CACHE_URL', 'redis://redis-cache:6379/0'),
+    },
+}
+
+# Snap! API client (shared connection pool, concurrent fetches and retries)
+SNAP_API_URL = os.environ.get('SNAP_API_URL', 'https://snap.berkeley.edu/api/v1/projects')
+SNAP_FETCH_WORKERS = int(os.environ.get('SNAP_FETCH_WORKERS', 8))
+SNAP_MAX_PER_HOST = int(os.environ.get('SNAP_MAX_PER_HOST', 4))
+SNAP_FETCH_RETRIES = int(os.environ.get('SNAP_FETCH_RETRIES', 3))
+SNAP_FETCH_BACKOFF = float(os.environ.get('SNAP_FETCH_BACKOFF', 0.5))
+SNAP_FETCH_TIMEOUT = float(os.environ.get('SNAP_FETCH_TIMEOUT', 15))
+
+# Async dashboard views: threads running parsing/analysis while Snap! downloads stay on the event loop.
+# Keep it above ANALYSIS_MAX_CONCURRENT so cached dashboards never wait behind analyses
+ASYNC_ANALYSIS_WORKERS = int(os.environ.get('ASYNC_ANALYSIS_WORKERS', 6))
+
+# Admission control (per web process): analyses running at once, how many may wait for a slot
+# and for how long before getting a 503 "busy, retry" response
+ANALYSIS_MAX_CONCURRENT = int(os.environ.get('ANALYSIS_MAX_CONCURRENT', 4))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 8))
+ANALYSIS_QUEUE_TIMEOUT = float(os.environ.get('ANALYSIS_QUEUE_TIMEOUT', 10))
+ADMISSION_METRICS_TTL = int(os.environ.get('ADMISSION_METRICS_TTL', 60))
+
+# Coloured console logs for the views and the hairball3 plugins, configured once at startup
+# instead of coloredlogs.install() at import time in each module
+LOG_LEVEL = os.environ.get('DRSCRATCH_LOG_LEVEL', 'DEBUG')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'colored': {
+            '()': 'coloredlogs.ColoredFormatter',
+            'fmt': '%(asctime)s %(name)s[%(process)d] %(levelname)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'colored'},
+    },
+    'loggers': {
+        'app.views': {'handlers': ['console'], 'level': LOG_LEVEL},
+        'app.hairball3': {'handlers': ['console'], 'level': LOG_LEVEL},
+    },
+}
 
 TIME_ZONE = 'UTC'
 USE_I18N = True
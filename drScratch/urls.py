@@ -24,6 +24,8 @@ urlpatterns = [
 
     # API RECOMMENDER
     url(r'^get_recommender/.*$', app_views.get_recommender, name='get_recommender'),
+    # The bulk NDJSON API (/api/v1/analyze) lives in drScratch/api_urls.py (api service)
+    url(r'^api/v1/load$', app_views.api_v1_load, name='api_v1_load'),
     
     # CONTACT FORM
     url(r'^process_contact_form/$', app_views.process_contact_form, name='contact_form'),
@@ -40,6 +42,10 @@ urlpatterns = [
     # BATCH ANALYZE ACTION
     url(r'^batch_analyze/$', app_views.batch_analyze, name='batch_analyze'),
 
+    # BATCH JOBS (JSON): status with progress and ETA, and CSV download
+    path('batch/<uuid:job_id>/status', app_views.batch_status, name='batch_status'),
+    path('batch/<uuid:job_id>/download', app_views.batch_download, name='batch_download'),
+
     # Statistics
     url(r'^statistics$', app_views.statistics, name='statistics'),
 
@@ -60,7 +66,8 @@ urlpatterns = [
     url(r'^compare_uploader', app_views.compare_uploader, name='compare_uploader'),
         
     # Dashboards
-    url(r'^show_dashboard/(?P<skill_points>.{1,6})?$', app_views.show_dashboard, name='show_dashboard'),
+    url(r'^show_dashboard/(?P<skill_points>.{1,6})?$', app_views.show_dashboard_async, name='show_dashboard'),
+    url(r'^analysis/(?P<content_hash>[0-9a-f]{64})/(?P<rubric>[0-9]{1,9})/(?P<mode>[A-Za-z]+)$', app_views.analysis_permalink, name='analysis_permalink'),
     url(r'^download_certificate', app_views.download_certificate, name='certificate'),
 
     # Conact form
@@ -8,8 +8,7 @@ https://docs.djangoproject.com/en/1.7/howto/deployment/wsgi/
 """
 
 import os
-#os.environ.setdefault("DJANGO_SETTINGS_MODULE", "drScratch.settings")
-os.environ['DJANGO_SETTINGS_MODULE'] = "drScratch.settings"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "drScratch.settings")
 
 import django
 django.setup()
@@ -22,3 +21,9 @@ django.setup()
 
 import django.core.handlers.wsgi
 application = django.core.handlers.wsgi.WSGIHandler()
+
+# Load the URLconf (views, analyzer, hairball3 plugins) now instead of on the first
+# request. With gunicorn --preload this happens once in the master and is shared by
+# every forked worker.
+from django.urls import get_resolver
+get_resolver().url_patterns